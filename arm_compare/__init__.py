@@ -0,0 +1,45 @@
+from .arm_compare import (
+    main,
+    Comparer,
+    ArmCompareError,
+    ConfigError,
+    OutputError,
+    TemplateError,
+    compare_templates,
+    compare_templates_to_file,
+    compare_resources,
+    pair_resources,
+    ComparisonResult,
+    ResourceComparison,
+    ResourceFilter,
+    ResolvedValue,
+    build_row_filter,
+    generate_html_output,
+    generate_markdown_output,
+    generate_xlsx_output,
+    write_report,
+)
+from .expressions import resolve_template
+
+__all__ = [
+    "main",
+    "Comparer",
+    "ArmCompareError",
+    "ConfigError",
+    "OutputError",
+    "TemplateError",
+    "compare_templates",
+    "compare_templates_to_file",
+    "compare_resources",
+    "pair_resources",
+    "ComparisonResult",
+    "ResourceComparison",
+    "ResourceFilter",
+    "ResolvedValue",
+    "build_row_filter",
+    "generate_html_output",
+    "generate_markdown_output",
+    "generate_xlsx_output",
+    "write_report",
+    "resolve_template",
+]
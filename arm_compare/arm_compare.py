@@ -1,133 +1,2064 @@
 #!/usr/bin/env python3
 import argparse
+import base64
+import codecs
+import collections
+import concurrent.futures
+import difflib
+import hashlib
+import io
 import json
-import yaml
 import re
 import fnmatch
+import glob
 import os
+import shutil
+import struct
 import sys
+import tempfile
+import zlib
 
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import PatternFill
+from .timings import NO_TIMINGS
 
-# Added import for openpyxl
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
+def exit_with_error(message):
+    sys.stderr.write(message + "\n")
+    sys.stderr.flush()
+    sys.exit(1)
+
+#
+# Errors
+#
+# The library raises these instead of exiting; only the command line turns
+# them into an error message and exit code.
+#
+class ArmCompareError(Exception):
+    """
+    Base class of the errors raised by arm_compare.
+    """
+
+
+class TemplateError(ArmCompareError):
+    """
+    A template could not be read.
+    """
+
+
+class ConfigError(ArmCompareError):
+    """
+    A configuration file or batch manifest could not be read or is not valid.
+    """
+
+
+class OutputError(ArmCompareError):
+    """
+    A report could not be written.
+    """
+
+
+OUTPUT_FORMATS = ('markdown', 'html', 'html-compact', 'xlsx', 'ndjson', 'sqlite')
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare two ARM templates by type and name',
+                                     epilog='Run "arm-compare serve --help" for the HTTP server mode.')
+    parser.add_argument('--left', help='Left ARM template JSON file, directory or glob')
+    parser.add_argument('--right', help='Right ARM template JSON file, directory or glob')
+    parser.add_argument('--config', help='Configuration YAML file (optional)')
+    parser.add_argument('--output', help='Output file (in batch mode, the roll-up index report)')
+    parser.add_argument('--batch', help='Batch manifest (YAML or JSON) listing many left/right comparisons '
+                                        'to run in one process')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help='Output format: markdown, html, html-compact (for very large reports), xlsx, '
+                             'or the machine-readable ndjson and sqlite (default: html)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Index the resources arrays instead of loading them whole, and load each '
+                             'resource only when it is compared (for very large exports)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to compare resources; 0 uses every CPU (default: 1). '
+                             f'Inputs with fewer than {PARALLEL_MIN_PAIRS} resource pairs are always compared serially. '
+                             'In batch mode the comparisons themselves are spread across the processes')
+    parser.add_argument('--state',
+                        help='Write the per-resource digests and comparison results of this run to a state file')
+    parser.add_argument('--previous',
+                        help='State file of an earlier run: only resources that changed since then are compared '
+                             'again, and the report lists the changes')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Keep the --stream indexes of the templates in this directory, so an unchanged '
+                             'file is not indexed again (default: no cache)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB,
+                        help=f'Size limit of the --cache-dir cache in MB (default: {DEFAULT_CACHE_SIZE_MB}); '
+                             'the least recently used entries are removed first')
+    parser.add_argument('--auto-pair', type=float, nargs='?', const=AUTO_PAIR_DEFAULT_THRESHOLD, metavar='THRESHOLD',
+                        help='Pair leftover unmatched resources of the same type whose properties are at least '
+                             f'THRESHOLD similar (0-1, default: {AUTO_PAIR_DEFAULT_THRESHOLD})')
+    parser.add_argument('--resolve-expressions', action='store_true',
+                        help='Resolve template expressions such as [parameters(...)], [variables(...)], '
+                             '[concat(...)] and [resourceId(...)] before comparing, from each template\'s '
+                             'parameters and variables; the report shows both the value and the expression')
+    parser.add_argument('--left-parameters', metavar='FILE',
+                        help='Parameters file for the left template (implies --resolve-expressions)')
+    parser.add_argument('--right-parameters', metavar='FILE',
+                        help='Parameters file for the right template (implies --resolve-expressions)')
+    parser.add_argument('--only-differences', action='store_true',
+                        help='Only write the properties that differ in the detail tables; '
+                             'the summary still counts every property')
+    parser.add_argument('--keep-ignored', action='store_true',
+                        help='With --only-differences, also write the ignored properties')
+    parser.add_argument('--resource-type', action='append', metavar='GLOB',
+                        help='Only compare resources whose type matches GLOB (case-insensitive); may be repeated')
+    parser.add_argument('--resource-name', action='append', metavar='GLOB',
+                        help='Only compare resources whose name matches GLOB (case-insensitive); may be repeated')
+    parser.add_argument('--timings', nargs='?', const='-', metavar='FILE',
+                        help='Report the wall time, CPU time and peak memory of each phase and the slowest '
+                             'resource pairs, to stderr or as JSON to FILE')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Run under cProfile and save the stats to FILE')
+    args = parser.parse_args()
+    if args.keep_ignored and not args.only_differences:
+        parser.error("--keep-ignored requires --only-differences")
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 (every CPU) or more")
+    if args.auto_pair is not None and not 0 < args.auto_pair <= 1:
+        parser.error("--auto-pair THRESHOLD must be greater than 0 and at most 1")
+    if args.batch:
+        # Set per comparison in the manifest instead
+        per_comparison = [f"--{name.replace('_', '-')}" for name in
+                          ("left", "right", "format", "state", "previous", "left_parameters", "right_parameters")
+                          if getattr(args, name)]
+        if per_comparison:
+            parser.error(f"not allowed with --batch: {', '.join(per_comparison)}")
+    else:
+        missing = [f"--{name}" for name in ("left", "right", "output") if not getattr(args, name)]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+        args.format = args.format or 'html'
+    return args
+
+def load_json_file(filepath):
+    if not os.path.exists(filepath):
+        raise TemplateError(f"JSON file '{filepath}' does not exist.")
+    try:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        raise TemplateError(f"Failed to read JSON file '{filepath}': {e}") from e
+
+def index_template_file(filepath):
+    try:
+        return index_json_file(filepath)
+    except Exception as e:
+        raise TemplateError(f"Failed to read JSON file '{filepath}': {e}") from e
+
+def load_yaml_file(filepath):
+    if not os.path.exists(filepath):
+        raise ConfigError(f"YAML config file '{filepath}' does not exist.")
+    import yaml  # only needed for config files, so not imported at startup
+    try:
+        with open(filepath, 'r') as f:
+            return yaml.safe_load(f)
+    except Exception as e:
+        raise ConfigError(f"Failed to read YAML config file '{filepath}': {e}") from e
+
+def load_config(config):
+    """
+    Returns the configuration as a dict: config may be a dict, a path to a YAML (or
+    JSON) file or None. Raises ConfigError if it is not a mapping.
+    """
+    if config is None:
+        return {}
+    if isinstance(config, (str, os.PathLike)):
+        path = os.fspath(config)
+        config = load_yaml_file(path) or {}
+    else:
+        path = "<config>"
+    if not isinstance(config, dict):
+        raise ConfigError(f"Config '{path}' must be a mapping of ignoreRules, resourceMappings and arrayKeys.")
+    validate_config(config, path)
+    return config
+
+MAPPING_KEYS = ("leftResourceType", "leftResourceName", "rightResourceType", "rightResourceName")
+
+def validate_config(config, path="<config>"):
+    """
+    Raises ConfigError if the ignoreRules, resourceMappings or arrayKeys of a config
+    have the wrong shape. comparisonRules are checked when they are compiled.
+    """
+    ignore_rules = config.get("ignoreRules")
+    if ignore_rules is not None and (not isinstance(ignore_rules, list)
+                                     or not all(isinstance(rule, str) for rule in ignore_rules)):
+        raise ConfigError(f"Config '{path}': ignoreRules must be a list of strings.")
+    mappings = config.get("resourceMappings")
+    if mappings is not None and not isinstance(mappings, list):
+        raise ConfigError(f"Config '{path}': resourceMappings must be a list.")
+    for i, mapping in enumerate(mappings or [], start=1):
+        if not isinstance(mapping, dict) or not all(isinstance(mapping.get(key), str) for key in MAPPING_KEYS):
+            raise ConfigError(f"Config '{path}': resource mapping {i} must have the string keys "
+                              f"{', '.join(MAPPING_KEYS)}.")
+    array_keys = config.get("arrayKeys")
+    if array_keys is not None and (not isinstance(array_keys, dict)
+                                   or not all(isinstance(field, str) for field in array_keys.values())):
+        raise ConfigError(f"Config '{path}': arrayKeys must map array paths to a key field name.")
+
+#
+# Streaming ingestion
+#
+# For very large exports the top-level "resources" array is read one element
+# at a time. Only a ResourceRef (type, name, byte offset/length and a content
+# digest) is kept per resource; its body is parsed again when its pair is compared.
+#
+STREAM_CHUNK_SIZE = 1 << 20
+
+class ResourceRef:
+    """
+    A resource indexed from a template file without keeping its body in memory.
+    get() answers "type" and "name" like the resource dict would; load() parses the body.
+    A resource lifted out of a nested resources array, or a parent of such resources,
+    has its own byte span in the file and lifted set: load() then drops its nested
+    resources and gives it the type and name it was lifted with (see iter_lifted_resources).
+    """
+    __slots__ = ("filepath", "type", "name", "offset", "length", "digest", "lifted")
+
+    def __init__(self, filepath, resource, offset, length, digest, lifted=False):
+        self.filepath = filepath
+        self.type = resource.get("type")
+        self.name = resource.get("name")
+        self.offset = offset
+        self.length = length
+        self.digest = digest
+        # The unresolved type and name, as ResolvedRef replaces type and name
+        self.lifted = (self.type, self.name) if lifted else None
+
+    def get(self, key, default=None):
+        if key == "type":
+            return default if self.type is None else self.type
+        if key == "name":
+            return default if self.name is None else self.name
+        return default
+
+    def load(self):
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)
+            resource = json.loads(f.read(self.length).decode('utf-8'))
+        if self.lifted is None:
+            return resource
+        lifted_type, lifted_name = self.lifted
+        return dict({key: value for key, value in resource.items()
+                     if not (key == "resources" and isinstance(value, list))},
+                    type=lifted_type, name=lifted_name)
+
+
+class JsonStream:
+    """
+    Minimal pull reader over a UTF-8 JSON file: values are decoded with
+    json.JSONDecoder.raw_decode from a buffer that is refilled chunk by chunk,
+    and the byte offset of the buffer start is tracked so values can be re-read later.
+    """
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.pos = 0
+        self.byte_offset = 0  # byte offset of self.buffer[0] in the file
+        self.eof = False
+
+    def fill(self, size=None):
+        if self.eof:
+            return False
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b"", final=True)
+            return False
+        self.buffer += self.text_decoder.decode(data)
+        return True
+
+    def trim(self):
+        """
+        Drops the consumed part of the buffer.
+        """
+        if self.pos:
+            self.byte_offset += len(self.buffer[:self.pos].encode('utf-8'))
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character ('' at end of file).
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n\ufeff":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.trim()
+            if not self.fill():
+                return ''
+
+    def tell(self):
+        """
+        Returns the byte offset of the next unread character.
+        """
+        return self.byte_offset + len(self.buffer[:self.pos].encode('utf-8'))
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at byte {self.tell()}")
+        self.pos += 1
+
+    def decode(self):
+        """
+        Decodes the next JSON value, reading more of the file until it is complete.
+        Returns (value, byte_offset, raw_bytes).
+        """
+        self.peek()
+        self.trim()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    break
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(read_size)
+            read_size *= 2
+        raw = self.buffer[:end].encode('utf-8')
+        offset = self.byte_offset
+        self.buffer = self.buffer[end:]
+        self.byte_offset += len(raw)
+        return value, offset, raw
+
+
+def index_resource_spans(stream, spans, path=()):
+    """
+    Reads the resource object at the stream position and records the byte span
+    (offset, length) of it and of every resource nested in its resources arrays
+    in spans, keyed by their path as in iter_lifted_resources.
+    """
+    stream.peek()
+    start = stream.tell()
+    stream.expect('{')
+    while stream.peek() != '}':
+        key, _offset, _raw = stream.decode()
+        stream.expect(':')
+        if key == "resources" and stream.peek() == '[':
+            stream.expect('[')
+            index = 0
+            while stream.peek() != ']':
+                if stream.peek() == '{':
+                    index_resource_spans(stream, spans, path + (index,))
+                else:
+                    stream.decode()
+                index += 1
+                if stream.peek() == ',':
+                    stream.expect(',')
+            stream.expect(']')
+        else:
+            stream.decode()
+        if stream.peek() == ',':
+            stream.expect(',')
+    stream.expect('}')
+    spans[path] = (start, stream.tell() - start)
+
+def index_json_file(filepath):
+    """
+    Reads an ARM template without holding its resources in memory.
+    Returns a template dict whose "resources" list holds a ResourceRef per resource;
+    every other top-level property is loaded as usual.
+    """
+    template = {}
+    resources = []
+    with open(filepath, 'rb') as f:
+        stream = JsonStream(f)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key, _offset, _raw = stream.decode()
+            stream.expect(':')
+            if key == "resources" and stream.peek() == '[':
+                stream.expect('[')
+                while stream.peek() != ']':
+                    resource, offset, raw = stream.decode()
+                    if nested_children(resource):
+                        # Each lifted resource gets its own span, so loading one
+                        # child does not parse its parent and siblings again
+                        spans = {}
+                        index_resource_spans(JsonStream(io.BytesIO(raw)), spans)
+                        for path, lifted in iter_lifted_resources(resource):
+                            span_offset, span_length = spans[path]
+                            resources.append(ResourceRef(filepath, lifted, offset + span_offset, span_length,
+                                                         json_digest(lifted), lifted=True))
+                    elif isinstance(resource, dict):
+                        digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+                        resources.append(ResourceRef(filepath, resource, offset, len(raw), digest))
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                stream.expect(']')
+                template[key] = resources
+            else:
+                template[key], _offset, _raw = stream.decode()
+            if stream.peek() == ',':
+                stream.expect(',')
+        stream.expect('}')
+    return template
+
+def json_digest(value):
+    """
+    Returns the digest of the canonical JSON of value. Values that are not JSON
+    (such as a ResolvedValue) are digested as their string form.
+    """
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+def load_resource(resource):
+    """
+    Returns the resource body, loading it first if it is a ResourceRef.
+    """
+    return resource.load() if isinstance(resource, ResourceRef) else resource
+
+#
+# Template cache
+#
+# With --cache-dir, the --stream indexes of templates are kept on disk, keyed by
+# the file's content hash and the tool version, so an unchanged input (such as a
+# baseline compared against many exports) is not indexed again. Entries are
+# plain JSON of the byte spans and the top-level sections, never pickles, and
+# the directory and files are private to the user. The least recently used
+# entries are evicted once the cache exceeds its size.
+#
+CACHE_FORMAT = 4
+DEFAULT_CACHE_SIZE_MB = 512
+
+def tool_version():
+    try:
+        from importlib.metadata import version
+        return version("azure-arm-compare")
+    except Exception:
+        return "unknown"
+
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Read once at import, as os.umask can only be read by setting it
+NEW_FILE_MODE = 0o666 & ~_current_umask()
+
+def replace_with_temp_file(temp_path, filepath):
+    """
+    Moves a file written with tempfile.mkstemp over filepath, first giving it the
+    mode a newly created file would have (mkstemp creates it readable by its owner only).
+    """
+    os.chmod(temp_path, NEW_FILE_MODE)
+    os.replace(temp_path, filepath)
+
+def encode_index(template):
+    """
+    Returns the JSON-serializable form of a template indexed by index_json_file:
+    each ResourceRef becomes [type, name, offset, length, digest, lifted].
+    """
+    resources = template.get("resources")
+    if not isinstance(resources, list):
+        return {"template": template, "resources": None}
+    return {"template": {key: value for key, value in template.items() if key != "resources"},
+            "resources": [[ref.type, ref.name, ref.offset, ref.length, ref.digest, ref.lifted is not None]
+                          for ref in resources]}
+
+def decode_index(entry, filepath):
+    """
+    Rebuilds the template of an encode_index entry, with its ResourceRefs reading filepath.
+    """
+    template = dict(entry["template"])
+    if entry["resources"] is not None:
+        template["resources"] = [ResourceRef(filepath, {"type": type_, "name": name}, offset, length, digest,
+                                             lifted=lifted)
+                                 for type_, name, offset, length, digest, lifted in entry["resources"]]
+    return template
+
+class TemplateCache:
+    """
+    Content-addressed on-disk cache of --stream indexes with LRU eviction.
+    An entry's modification time is its last use; put() removes the oldest
+    entries until the cache is no larger than max_bytes. The directory is
+    created with mode 0700 and the entries with 0600, and a directory that other
+    users can write to is not used at all.
+    Cache errors are never fatal: the template is then simply indexed again.
+    """
+    SUFFIX = ".json"
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE_MB << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = tool_version()
+
+    def key(self, filepath):
+        """
+        Returns the cache key for the index of a file.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest.update(f"|index|{CACHE_FORMAT}|{self.version}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def is_private(self):
+        """
+        Returns True if the cache directory is owned by this user and no one else can write to it.
+        """
+        stat = os.stat(self.directory)
+        if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+            return False
+        return not stat.st_mode & 0o022
+
+    def get(self, key, filepath):
+        """
+        Returns the cached index of filepath, or None.
+        """
+        path = self.path(key)
+        try:
+            if not self.is_private():
+                return None
+            with open(path, 'rb') as f:
+                template = decode_index(json.load(f), filepath)
+            os.utime(path)  # mark as recently used
+            return template
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.remove(path)
+            return None
+
+    def put(self, key, template):
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            if not self.is_private():
+                return
+            # mkstemp creates the file with mode 0600
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(encode_index(template), f, separators=(',', ':'))
+            os.replace(temp_path, self.path(key))
+            self.evict()
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_template(filepath, stream=False, cache=None):
+    """
+    Loads a template, or indexes it with index_json_file if stream is set.
+    Indexes go through the TemplateCache if one is given; a whole template is
+    always parsed again, as reading it back from a cache would cost about as much.
+    """
+    if not stream:
+        return load_json_file(filepath)
+    if cache is None:
+        return index_template_file(filepath)
+    try:
+        key = cache.key(filepath)
+    except OSError:
+        return index_template_file(filepath)
+    # The same content may have been indexed under another path, so the
+    # entry is rebuilt with this one
+    template = cache.get(key, filepath)
+    if template is None:
+        template = index_template_file(filepath)
+        cache.put(key, template)
+    return template
+
+
+#
+# Multi-file input
+#
+# --left and --right may name a directory or a glob as well as a single file.
+# The files are loaded on a thread pool and their resources merged, in file
+# order, into one template per side, so resources pair across files. Each
+# resource records the file it came from, and the merged template keeps every
+# file's own parameters and variables to resolve that file's expressions with.
+#
+TEMPLATE_LOAD_THREADS = 8
+
+# Sections whose entries a file's expressions refer to by name
+TEMPLATE_SCOPED_SECTIONS = ("parameters", "variables")
+
+class SourcedResource(dict):
+    """
+    A resource dict that records the template file it was loaded from.
+    """
+    __slots__ = ("source",)
+
+    def __init__(self, resource, source):
+        super().__init__(resource)
+        self.source = source
+
+    def __reduce__(self):
+        return (SourcedResource, (dict(self), self.source))
+
+def with_source(resource, source):
+    """
+    Returns resource as a SourcedResource if source is set, otherwise as it is.
+    """
+    return SourcedResource(resource, source) if source else resource
+
+class MergedTemplate(dict):
+    """
+    A template merged from several files by load_templates. sources maps each
+    file to its own top-level sections (everything but its resources).
+    """
+    def __init__(self, template, sources):
+        super().__init__(template)
+        self.sources = sources
+
+def resource_source(resource):
+    """
+    Returns the file a resource was loaded from, or None if it is not known.
+    """
+    if isinstance(resource, ResourceRef):
+        return resource.filepath
+    return getattr(resource, "source", None)
+
+def is_template_glob(path):
+    return any(char in path for char in "*?[") and not os.path.exists(path)
+
+def template_paths(path):
+    """
+    Returns the template files for a --left or --right argument: every *.json file
+    under a directory (apart from *.parameters.json), the files a glob matches
+    (** matches any number of folders), or the file itself.
+    """
+    if os.path.isdir(path):
+        paths = [os.path.join(root, name) for root, _dirs, names in os.walk(path) for name in names
+                 if name.lower().endswith(".json") and not name.lower().endswith(".parameters.json")]
+    elif is_template_glob(path):
+        paths = [match for match in glob.glob(path, recursive=True) if os.path.isfile(match)]
+    else:
+        return [path]
+    if not paths:
+        raise TemplateError(f"No template files found for '{path}'.")
+    return sorted(paths)
+
+def load_templates(path, stream=False, cache=None):
+    """
+    Loads the template files of a --left or --right argument (see template_paths)
+    with load_template on a thread pool and merges them into one template. The
+    resources are concatenated in file order as SourcedResources (or ResourceRefs,
+    with stream set); for the other top-level sections, such as parameters and
+    variables, the first file to define an entry wins. A parameter or variable that
+    another file defines differently is reported on stderr; resolve_template still
+    resolves each file's expressions with its own definitions (see MergedTemplate).
+    Parameters files are skipped.
+    """
+    paths = template_paths(path)
+    if paths == [path]:
+        return load_template(path, stream, cache)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(paths), TEMPLATE_LOAD_THREADS)) as executor:
+        templates = list(executor.map(lambda filepath: load_template(filepath, stream, cache), paths))
+    merged = {}
+    sources = {}
+    defined_in = {}  # (section, name) -> first file defining it
+    resources = []
+    for filepath, template in zip(paths, templates):
+        if not isinstance(template, dict):
+            raise TemplateError(f"Template file '{filepath}' does not contain a JSON object.")
+        if "deploymentParameters" in str(template.get("$schema", "")):
+            continue
+        sections = {key: value for key, value in template.items() if key != "resources"}
+        sources[filepath] = sections
+        for key, value in sections.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                if key in TEMPLATE_SCOPED_SECTIONS:
+                    for name, definition in value.items():
+                        if name in merged[key] and merged[key][name] != definition:
+                            sys.stderr.write(f"Warning: {key[:-1].capitalize()} '{name}' is defined differently "
+                                             f"in '{defined_in[key, name]}' and '{filepath}'; each file's "
+                                             "expressions are resolved with its own definition.\n")
+                merged[key] = dict(value, **merged[key])
+            else:
+                merged.setdefault(key, value)
+            if key in TEMPLATE_SCOPED_SECTIONS and isinstance(value, dict):
+                for name in value:
+                    defined_in.setdefault((key, name), filepath)
+        for resource in template.get("resources", []):
+            resources.append(with_source(resource, filepath) if type(resource) is dict else resource)
+    merged["resources"] = resources
+    return MergedTemplate(merged, sources)
+
+def sort_list_if_possible(lst):
+    """
+    If lst is a non-empty list of dictionaries, attempt to sort it.
+    First, if every dict has a "name" key, sort by that.
+    Otherwise, if every dict has an "id" key, sort by that.
+    Otherwise, leave the list unchanged.
+    """
+    if isinstance(lst, list) and lst and all(isinstance(item, dict) for item in lst):
+        if all("name" in item for item in lst):
+            return sorted(lst, key=lambda x: x["name"])
+        elif all("id" in item for item in lst):
+            return sorted(lst, key=lambda x: x["id"])
+    return lst
+
+class IgnoreMatcher:
+    """
+    The ignoreRules wildcard patterns compiled into a single regular expression.
+    Results are memoised per path, since the same property paths repeat across resources.
+    Patterns ending in "*" also match every descendant of a container whose path
+    (plus the "." or "[" separator) they match, which lets flatten_json skip that subtree.
+    A path with right-only array elements ("[+j]", see AddedIndex) also matches the
+    rules written for "[j]", so rules from before array alignment keep working.
+    """
+    CACHE_LIMIT = 65536
+    ADDED_INDEX_RE = re.compile(r"\[\+(\d+)\]")
+
+    def __init__(self, ignore_rules):
+        self.rules = list(ignore_rules or [])
+        patterns = [os.path.normcase(rule) for rule in self.rules]
+        self._regex = self._compile(patterns)
+        self._subtree_regex = self._compile([p for p in patterns if p.endswith("*")])
+        self._cache = {}
+        self._prune_cache = {}
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+    def _match(self, regex, text):
+        text = os.path.normcase(text)
+        if regex.match(text) is not None:
+            return True
+        return "[+" in text and regex.match(self.ADDED_INDEX_RE.sub(r"[\1]", text)) is not None
+
+    def __call__(self, path):
+        """
+        Returns True if the property path (or resource type) matches any ignore rule.
+        path may be a string or a tuple of path segments, which is only joined on a cache miss.
+        """
+        try:
+            return self._cache[path]
+        except KeyError:
+            pass
+        text = join_path(path) if isinstance(path, tuple) else path
+        result = self._regex is not None and self._match(self._regex, text)
+        if len(self._cache) >= self.CACHE_LIMIT:
+            self._cache.clear()
+        self._cache[path] = result
+        return result
+
+    def prunes(self, segments, container):
+        """
+        Returns True if every property below the dict or list at the given path
+        segments is ignored. The path is only joined if there are trailing-* rules.
+        """
+        if self._subtree_regex is None or not segments:
+            return False
+        separator = "." if isinstance(container, dict) else "["
+        cache_key = (segments, separator)
+        try:
+            return self._prune_cache[cache_key]
+        except KeyError:
+            pass
+        result = self._match(self._subtree_regex, join_path(segments) + separator)
+        if len(self._prune_cache) >= self.CACHE_LIMIT:
+            self._prune_cache.clear()
+        self._prune_cache[cache_key] = result
+        return result
+
+
+class IgnoredSubtree:
+    """
+    Placeholder value for a dict or list that flatten_json skipped because all of
+    its properties are ignored. It is reported as a single Ignored row.
+    """
+    __slots__ = ("is_list",)
+
+    def __init__(self, container):
+        self.is_list = isinstance(container, list)
+
+    def __str__(self):
+        return "[...]" if self.is_list else "{...}"
+
+    __repr__ = __str__
+
+    def __eq__(self, other):
+        return isinstance(other, IgnoredSubtree) and other.is_list == self.is_list
+
+    def __hash__(self):
+        return hash(("IgnoredSubtree", self.is_list))
+
+
+class ResolvedValue:
+    """
+    A scalar that --resolve-expressions evaluated from a template expression.
+    It compares (and sorts) as its value, so rows are compared on what the
+    expression resolves to, and is shown as "value (from [expression])".
+    """
+    __slots__ = ("value", "expression")
+
+    def __init__(self, value, expression):
+        self.value = value
+        self.expression = expression
+
+    def __str__(self):
+        return f"{self.value} (from {self.expression})"
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, ResolvedValue) else other)
+
+    def __lt__(self, other):
+        return self.value < (other.value if isinstance(other, ResolvedValue) else other)
+
+    def __gt__(self, other):
+        return self.value > (other.value if isinstance(other, ResolvedValue) else other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+def plain_value(value):
+    """
+    Returns the resolved value of a ResolvedValue, and any other value as it is.
+    """
+    return value.value if isinstance(value, ResolvedValue) else value
+
+
+#
+# Array alignment
+#
+# Arrays listed in the arrayKeys config are aligned by a key field of their
+# items, and their elements get paths like "securityRules[name=allow-https]".
+# Other arrays are aligned with a longest-matching-subsequence diff of their
+# items, so an inserted or removed element only shows up as that element.
+#
+class ArrayKey:
+    """
+    Path segment for an element of a keyed array, written as "[field=value]".
+    """
+    __slots__ = ("field", "value")
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def __str__(self):
+        return f"[{self.field}={self.value}]"
+
+    __repr__ = __str__
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayKey) and other.field == self.field and other.value == self.value
+
+    def __hash__(self):
+        return hash(("ArrayKey", self.field, self.value))
+
+
+class AddedIndex:
+    """
+    Path segment for an element that is only in the right-hand array, written as
+    "[+j]" where j is its index on the right. Elements present on the left keep
+    their left index.
+    """
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __str__(self):
+        return f"[+{self.index}]"
+
+    __repr__ = __str__
+
+    def __eq__(self, other):
+        return isinstance(other, AddedIndex) and other.index == self.index
+
+    def __hash__(self):
+        return hash(("AddedIndex", self.index))
+
+
+class ArrayKeys:
+    """
+    The arrayKeys config compiled: a mapping of array property paths to the item
+    field that identifies each element, e.g. {"properties.securityRules": "name"}.
+    Paths are written without list indexes and may use wildcards; the first
+    matching entry wins. Lookups are memoised per path.
+    """
+    CACHE_LIMIT = 65536
+    KEY_TYPES = (str, int, float, bool)
+
+    def __init__(self, array_keys):
+        self.rules = dict(array_keys or {})
+        self._exact = {}
+        self._globs = []
+        for path, field in self.rules.items():
+            if any(char in path for char in "*?["):
+                self._globs.append((re.compile(fnmatch.translate(path)), field))
+            else:
+                self._exact.setdefault(path, field)
+        self._cache = {}
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def field(self, segments):
+        """
+        Returns the key field for the array at the given path segments, or None.
+        """
+        try:
+            return self._cache[segments]
+        except KeyError:
+            pass
+        path = ".".join(segment for segment in segments if isinstance(segment, str))
+        field = self._exact.get(path)
+        if field is None:
+            field = next((field for regex, field in self._globs if regex.match(path)), None)
+        if len(self._cache) >= self.CACHE_LIMIT:
+            self._cache.clear()
+        self._cache[segments] = field
+        return field
+
+    def key_items(self, segments, items):
+        """
+        Returns {ArrayKey: item} for the array at the given path if it has a key
+        field and every item is a dict with a unique scalar value for it.
+        Otherwise returns None and the array is aligned by position.
+        """
+        field = self.field(segments)
+        if field is None:
+            return None
+        keyed = {}
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(plain_value(item.get(field)), self.KEY_TYPES):
+                return None
+            key = ArrayKey(field, plain_value(item[field]))
+            if key in keyed:
+                return None
+            keyed[key] = item
+        return keyed
+
+def build_array_keys(array_keys):
+    """
+    Compiles the arrayKeys config. An already compiled ArrayKeys is returned as is.
+    """
+    if isinstance(array_keys, ArrayKeys):
+        return array_keys
+    return ArrayKeys(array_keys)
+
+#
+# Comparison rules
+#
+# The comparisonRules config changes how the values at matching property paths
+# are compared. Each rule has a "path" glob and one or more settings:
+#
+#   caseInsensitive: true   strings are equal if they differ only in case
+#   tolerance: 0.01         numbers are equal if they differ by no more than this
+#   looseTypes: true        numeric and boolean strings equal their value ("10" and 10)
+#   missingAs: ""           a property missing on one side equals this value
+#   resourceId: true        Azure resource IDs are equal if they differ only in case
+#                           or a trailing "/"
+#
+# Every rule whose glob matches a path applies; when several set the same
+# setting the first one wins. Each distinct path is looked up once and cached,
+# so the cost per row does not grow with the number of rules.
+#
+MISSING = object()  # the side of a row whose property is missing, while rows are compared
+LOOSE_NUMBER_RE = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?")
+
+def loose_value(value):
+    """
+    Returns a numeric or boolean string as its number or boolean, other values as they are.
+    """
+    if not isinstance(value, str):
+        return value
+    lowered = value.strip().lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    if LOOSE_NUMBER_RE.fullmatch(lowered):
+        number = float(lowered)
+        return int(number) if number.is_integer() and "." not in lowered and "e" not in lowered else number
+    return value
+
+def is_resource_id(value):
+    lowered = value[:15].lower()
+    return lowered.startswith("/subscriptions/") or lowered.startswith("/providers/")
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ValueComparator:
+    """
+    Compares the two values of a row with the settings of the comparison rules
+    that apply to its path. A missing side is passed as MISSING.
+    """
+    __slots__ = ("case_insensitive", "tolerance", "loose_types", "has_missing_as", "missing_as", "resource_id")
+
+    def __init__(self, settings):
+        self.case_insensitive = bool(settings.get("caseInsensitive", False))
+        self.tolerance = settings.get("tolerance")
+        self.loose_types = bool(settings.get("looseTypes", False))
+        self.has_missing_as = "missingAs" in settings
+        self.missing_as = settings.get("missingAs")
+        self.resource_id = bool(settings.get("resourceId", False))
+
+    def normalize(self, value):
+        if value is MISSING:
+            value = self.missing_as if self.has_missing_as else ''
+        value = plain_value(value)
+        if self.loose_types:
+            value = loose_value(value)
+        if isinstance(value, str):
+            if self.resource_id and is_resource_id(value):
+                value = value.rstrip("/").lower()
+            elif self.case_insensitive:
+                value = value.casefold()
+        return value
+
+    def __call__(self, left_val, right_val):
+        left_val = self.normalize(left_val)
+        right_val = self.normalize(right_val)
+        if left_val == right_val:
+            return True
+        return (self.tolerance is not None and is_number(left_val) and is_number(right_val)
+                and abs(left_val - right_val) <= self.tolerance)
+
+
+class ComparisonRules:
+    """
+    The comparisonRules config compiled: comparator(path) returns the ValueComparator
+    for a property path, or None where no rule applies. Lookups are memoised per
+    path, and paths with the same settings share one ValueComparator.
+    """
+    CACHE_LIMIT = 65536
+    SETTINGS = ("caseInsensitive", "tolerance", "looseTypes", "missingAs", "resourceId")
+
+    def __init__(self, comparison_rules):
+        self.rules = [dict(rule) for rule in comparison_rules or []]
+        self._compiled = []
+        for i, rule in enumerate(self.rules, start=1):
+            if not isinstance(rule.get("path"), str):
+                raise ConfigError(f"Comparison rule {i} needs a 'path' glob.")
+            unknown = sorted(set(rule) - {"path"} - set(self.SETTINGS))
+            if unknown:
+                raise ConfigError(f"Comparison rule {i} ('{rule['path']}') has unknown settings: {', '.join(unknown)}")
+            tolerance = rule.get("tolerance")
+            if tolerance is not None and (not is_number(tolerance) or tolerance < 0):
+                raise ConfigError(f"Comparison rule {i} ('{rule['path']}') needs a tolerance of 0 or more.")
+            settings = {key: value for key, value in rule.items() if key != "path"}
+            self._compiled.append((re.compile(fnmatch.translate(rule["path"])), settings))
+        self._comparators = {}
+        self._cache = {}
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def comparator(self, path):
+        try:
+            return self._cache[path]
+        except KeyError:
+            pass
+        settings = {}
+        for regex, rule_settings in self._compiled:
+            if regex.match(path):
+                for key, value in rule_settings.items():
+                    settings.setdefault(key, value)
+        comparator = None
+        if settings:
+            settings_key = json.dumps(settings, sort_keys=True)
+            comparator = self._comparators.get(settings_key)
+            if comparator is None:
+                comparator = self._comparators[settings_key] = ValueComparator(settings)
+        if len(self._cache) >= self.CACHE_LIMIT:
+            self._cache.clear()
+        self._cache[path] = comparator
+        return comparator
+
+def build_comparison_rules(comparison_rules):
+    """
+    Compiles the comparisonRules config. Already compiled ComparisonRules are returned as is.
+    """
+    if isinstance(comparison_rules, ComparisonRules):
+        return comparison_rules
+    return ComparisonRules(comparison_rules)
+
+def item_fingerprint(item):
+    """
+    Returns a hashable stand-in for an array item, used to align arrays.
+    """
+    if isinstance(item, (dict, list)):
+        return json.dumps(item, sort_keys=True, default=lambda value: str(plain_value(value)))
+    return item
+
+def align_lists(left_items, right_items):
+    """
+    Aligns two arrays by their longest matching runs of equal items and yields
+    (left_index, right_index) pairs; either index is None for an element that is
+    only on one side. Elements between matching runs are paired by position.
+    """
+    matcher = difflib.SequenceMatcher(None, [item_fingerprint(item) for item in left_items],
+                                      [item_fingerprint(item) for item in right_items], autojunk=False)
+    for _tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        paired = min(i2 - i1, j2 - j1)
+        for k in range(paired):
+            yield i1 + k, j1 + k
+        for i in range(i1 + paired, i2):
+            yield i, None
+        for j in range(j1 + paired, j2):
+            yield None, j
+
+def join_path(segments):
+    """
+    Joins path segments into a property path string: dict keys are separated by
+    "." and list indexes are written as "[i]", e.g. ("properties", "rules", 0, "name")
+    becomes "properties.rules[0].name". ArrayKey and AddedIndex segments are written
+    as "[field=value]" and "[+j]".
+    """
+    parts = []
+    for segment in segments:
+        if isinstance(segment, str):
+            parts.append("." + segment if parts else segment)
+        elif isinstance(segment, int):
+            parts.append(f"[{segment}]")
+        else:
+            parts.append(str(segment))
+    return "".join(parts)
+
+def list_children(segments, node, array_keys=None):
+    """
+    Returns the (segment, item) children of an array when flattening one side:
+    keyed by ArrayKey if arrayKeys applies to it, otherwise indexed after
+    sort_list_if_possible.
+    """
+    if array_keys:
+        keyed = array_keys.key_items(segments, node)
+        if keyed is not None:
+            return list(keyed.items())
+    return list(enumerate(sort_list_if_possible(node)))
+
+def iter_flatten(data, ignore_matcher=None, segments=(), array_keys=None):
+    """
+    Iteratively flattens JSON, yielding (path_segments, value) for every leaf value.
+    path_segments is a tuple of dict keys and list indexes; join_path turns it into
+    the property path string. Lists are sorted with sort_list_if_possible first.
+    Leaves are yielded in document order and nothing is copied between levels.
+    If an IgnoreMatcher is given, non-empty dicts and lists whose properties are all
+    ignored are not expanded and are yielded as a single IgnoredSubtree value instead.
+    segments is the path of data itself when flattening part of a resource.
+    Arrays covered by array_keys (an ArrayKeys) are keyed instead of indexed.
+    """
+    stack = [(segments, data)]
+    while stack:
+        segments, node = stack.pop()
+        if isinstance(node, dict):
+            if node and ignore_matcher is not None and ignore_matcher.prunes(segments, node):
+                yield segments, IgnoredSubtree(node)
+                continue
+            stack.extend(reversed([(segments + (k,), v) for k, v in node.items()]))
+        elif isinstance(node, list):
+            if node and ignore_matcher is not None and ignore_matcher.prunes(segments, node):
+                yield segments, IgnoredSubtree(node)
+                continue
+            stack.extend(reversed([(segments + (segment,), item)
+                                   for segment, item in list_children(segments, node, array_keys)]))
+        else:
+            yield segments, node
+
+def flatten_json(data, parent_key='', ignore_matcher=None):
+    """
+    Flattens JSON into a dict mapping full property paths to values.
+    Lists are indexed. If a list contains dictionaries with a "name" or "id" property,
+    it will be sorted in memory before flattening.
+    The comparison itself streams from iter_flatten; this is kept for callers that want a dict.
+    """
+    items = {}
+    for segments, value in iter_flatten(data, ignore_matcher):
+        key = join_path(segments)
+        if parent_key:
+            key = parent_key + key if key.startswith("[") or not key else f"{parent_key}.{key}"
+        items[key] = value
+    return items
+
+#
+# Matched branches
+#
+# Both sides of a resource pair are walked together from the root. A dict or
+# list that is equal on both sides (a single C-level deep comparison) is
+# recorded as a matched branch with only its leaf and ignored counts; only
+# branches that differ are flattened and compared leaf by leaf.
+#
+def count_branch(segments, node, ignore_matcher, ignored_properties, array_keys=None):
+    """
+    Returns (leaf_count, ignored_count) for a dict or list, counting the same leaves
+    iter_flatten would yield. Ignored paths are added to ignored_properties.
+    """
+    leaves = 0
+    ignored = 0
+    stack = [(segments, node)]
+    while stack:
+        segments, node = stack.pop()
+        if node and ignore_matcher.prunes(segments, node):
+            leaves += 1
+            ignored += 1
+            ignored_properties.add(join_path(segments))
+            continue
+        children = node.items() if isinstance(node, dict) else list_children(segments, node, array_keys)
+        for key, child in children:
+            if isinstance(child, (dict, list)):
+                stack.append((segments + (key,), child))
+            else:
+                leaves += 1
+                if ignore_matcher(segments + (key,)):
+                    ignored += 1
+                    ignored_properties.add(join_path(segments + (key,)))
+    return leaves, ignored
+
+def expand_matched_branch(segments, left_node, right_node, ignore_matcher, array_keys=None):
+    """
+    Yields the rows for a branch that is equal on both sides. The right side is
+    flattened too, as equal values can still be written differently (1 and 1.0).
+    """
+    left_leaves = list(iter_flatten(left_node, ignore_matcher, segments, array_keys))
+    right_leaves = list(iter_flatten(right_node, ignore_matcher, segments, array_keys))
+    if any(left[0] != right[0] for left, right in zip(left_leaves, right_leaves)):
+        # Dict keys are in a different order on each side
+        right_values = dict(right_leaves)
+        right_leaves = [(leaf_segments, right_values[leaf_segments]) for leaf_segments, _ in left_leaves]
+    for (leaf_segments, left_val), (_, right_val) in zip(left_leaves, right_leaves):
+        key = join_path(leaf_segments)
+        matched = "Ignored" if isinstance(left_val, IgnoredSubtree) or ignore_matcher(key) else ""
+        yield (matched, key, left_val, right_val)
+
+def generate_anchor(resource_type, resource_name):
+    """
+    Generates a sanitized anchor string based on resource type and name.
+    """
+    combined = f"{resource_type}-{resource_name}"
+    anchor = re.sub(r'[^a-zA-Z0-9-]', '', combined.replace(' ', '-')).lower()
+    return anchor
+
+#
+# Comparison model
+#
+# The comparison is run exactly once per resource pair. Every renderer works
+# from the resulting rows and counts and never re-flattens or re-matches.
+#
+class ResourceComparison:
+    """
+    The result of comparing one left/right resource pair.
+    rows is a sorted list of (matched, property_path, left_value, right_value) tuples,
+    where matched is "Ignored", "X" (different) or "" (correct).
+    Branches that are equal on both sides are held in matched_branches as
+    (path_segments, left_node, right_node, leaf_count, ignored_count) and only expanded into rows
+    the first time rows is read; the counts already include them.
+    rendered_table is set to (output_format, table) when a worker process has already
+    rendered the detail table; rows are then not kept.
+    auto_paired is (right_name, similarity) when the pair was found by auto_pair_resources.
+    shown_rows limits report_rows to the rows whose matched value it contains
+    (see build_row_filter); None shows every row. The counts always cover every row.
+    """
+    def __init__(self, resource_type, resource_name, rows, matched_branches=None, ignore_matcher=None,
+                 array_keys=None):
+        self.resource_type = resource_type
+        self.resource_name = resource_name
+        self._rows = rows
+        self.matched_branches = matched_branches or []
+        self._ignore_matcher = ignore_matcher
+        self._array_keys = array_keys
+        self.anchor = generate_anchor(resource_type, resource_name)
+        self.rendered_table = None
+        self.auto_paired = None
+        self.shown_rows = None
+        self.total = len(rows) + sum(branch[3] for branch in self.matched_branches)
+        self.ignored = (sum(1 for row in rows if row[0] == "Ignored")
+                        + sum(branch[4] for branch in self.matched_branches))
+        self.incorrect = sum(1 for row in rows if row[0] == "X")
+        self.correct = self.total - self.ignored - self.incorrect
+
+    @property
+    def difference_rows(self):
+        """
+        The rows that were compared individually, without expanding matched branches.
+        """
+        return self._rows
+
+    @property
+    def rows(self):
+        if self.matched_branches:
+            rows = list(self._rows)
+            for segments, left_node, right_node, _leaves, _ignored in self.matched_branches:
+                rows.extend(expand_matched_branch(segments, left_node, right_node, self._ignore_matcher,
+                                                  self._array_keys))
+            rows.sort(key=lambda row: row[1])
+            self._rows = rows
+            self.matched_branches = []
+        return self._rows
+
+    @property
+    def report_rows(self):
+        """
+        The rows the renderers write. Matched branches only hold correct and Ignored
+        rows, so when correct rows are not shown they are left unexpanded, apart from
+        branches with Ignored rows when those are shown.
+        """
+        shown = self.shown_rows
+        if shown is None:
+            return self.rows
+        if "" in shown:
+            return [row for row in self.rows if row[0] in shown]
+        rows = [row for row in self._rows if row[0] in shown]
+        if "Ignored" in shown and any(branch[4] for branch in self.matched_branches):
+            for segments, left_node, right_node, _leaves, ignored in self.matched_branches:
+                if ignored:
+                    rows.extend(row for row in expand_matched_branch(segments, left_node, right_node,
+                                                                     self._ignore_matcher, self._array_keys)
+                                 if row[0] in shown)
+            rows.sort(key=lambda row: row[1])
+        return rows
+
+    @property
+    def paired_name(self):
+        """
+        The name shown in the summary and headings. Auto-paired resources also show
+        the right-hand name and their similarity.
+        """
+        if self.auto_paired is None:
+            return self.resource_name
+        right_name, similarity = self.auto_paired
+        return f"{self.resource_name} -> {right_name} (auto-paired, {similarity:.0%})"
+
+    @property
+    def display_name(self):
+        return f"{self.resource_type} / {self.paired_name}"
+
+    def summary_entry(self):
+        """
+        Returns the (resource_type, resource_name, total, ignored, correct, incorrect, anchor)
+        tuple used by the summary renderers.
+        """
+        return (self.resource_type, self.paired_name, self.total,
+                self.ignored, self.correct, self.incorrect, self.anchor)
+
+
+class ComparisonResult:
+    """
+    The full result of comparing two ARM templates.
+    resources holds a ResourceComparison per paired resource (in pairing order),
+    unmatched_left/unmatched_right map (type, name) to resources that were not paired,
+    ignored_properties is the set of property paths that matched an ignore rule and
+    duplicates lists a DuplicateDefinition per definition of a type and name that
+    a side defines more than once.
+    """
+    def __init__(self, resources, unmatched_left, unmatched_right, ignored_properties, duplicates=None):
+        self.resources = resources
+        self.unmatched_left = unmatched_left
+        self.unmatched_right = unmatched_right
+        self.ignored_properties = ignored_properties
+        self.duplicates = duplicates or []
+
+    @property
+    def summary_entries(self):
+        return [resource.summary_entry() for resource in self.resources]
+
+    @property
+    def detailed_data(self):
+        return [(resource.resource_type, resource.resource_name, resource.rows)
+                for resource in self.resources]
+
+
+def build_row_filter(only_differences=False, keep_ignored=False):
+    """
+    Returns the ResourceComparison.shown_rows for the report options: None for every
+    row, otherwise the set of matched values ("X", and "Ignored" with keep_ignored).
+    """
+    if not only_differences:
+        return None
+    return frozenset(("X", "Ignored") if keep_ignored else ("X",))
+
+
+class ResourceFilter:
+    """
+    Selects resources by type and name globs, case-insensitively. A resource is
+    selected if its type matches one of types and its name one of names; an empty
+    list selects everything. Paired resources are selected if either side is.
+    """
+    def __init__(self, types=None, names=None):
+        self.types = list(types or [])
+        self.names = list(names or [])
+        self._type_regex = self._compile(self.types)
+        self._name_regex = self._compile(self.names)
+
+    @staticmethod
+    def _compile(globs):
+        if not globs:
+            return None
+        return re.compile("|".join(f"(?:{fnmatch.translate(glob)})" for glob in globs), re.IGNORECASE)
+
+    def __call__(self, resource):
+        return ((self._type_regex is None or self._type_regex.match(resource.get("type", "")) is not None)
+                and (self._name_regex is None or self._name_regex.match(resource.get("name", "")) is not None))
+
+    def filter(self, resource_pairs, unmatched_left, unmatched_right):
+        """
+        Returns (resource_pairs, unmatched_left, unmatched_right) with only the selected resources.
+        """
+        return ([(left_res, right_res) for left_res, right_res in resource_pairs
+                 if self(left_res) or self(right_res)],
+                {key: res for key, res in unmatched_left.items() if self(res)},
+                {key: res for key, res in unmatched_right.items() if self(res)})
+
+def build_resource_filter(types=None, names=None):
+    """
+    Returns a ResourceFilter for the given globs, or None if there are none.
+    """
+    if not types and not names:
+        return None
+    return ResourceFilter(types, names)
+
+
+def get_resource_key(resource):
+    return (resource.get("type"), resource.get("name"))
+
+#
+# Nested child resources
+#
+# A resource may declare child resources in its own "resources" array. They are
+# lifted out into top-level resources with the composite type and name that a
+# top-level child resource has ("<parent type>/<child type>", "<parent name>/<child
+# name>"), so each child is paired, mapped, flattened and compared on its own.
+#
+def is_template_expression(value):
+    """
+    Returns True for a string that is a template expression, "[...]" (but not an
+    escaped literal "[[...").
+    """
+    return isinstance(value, str) and value.startswith("[") and value.endswith("]") and not value.startswith("[[")
+
+def child_resource_key(parent_type, parent_name, child):
+    """
+    Returns the composite (type, name) of a child resource nested in a parent.
+    A child type that is already qualified (it has a namespace, such as
+    "Microsoft.Network/virtualNetworks/subnets") and a child name that already
+    starts with the parent name are kept as they are. If either name is an
+    expression, the composite name is the expression that concatenates them.
+    """
+    child_type = child.get("type")
+    child_name = child.get("name")
+    if isinstance(child_type, str) and isinstance(parent_type, str) and "." not in child_type.split("/", 1)[0]:
+        child_type = f"{parent_type}/{child_type}"
+    if not isinstance(child_name, str) or not isinstance(parent_name, str):
+        return child_type, child_name
+    if is_template_expression(parent_name) or is_template_expression(child_name):
+        parts = [name[1:-1] if is_template_expression(name) else "'" + name.replace("'", "''") + "'"
+                 for name in (parent_name, child_name)]
+        child_name = f"[concat({parts[0]}, '/', {parts[1]})]"
+    elif not child_name.startswith(parent_name + "/"):
+        child_name = f"{parent_name}/{child_name}"
+    return child_type, child_name
+
+def nested_children(resource):
+    """
+    Returns the child resources nested in resource, or an empty list.
+    """
+    children = resource.get("resources") if isinstance(resource, dict) else None
+    if not isinstance(children, list):
+        return []
+    return [child for child in children if isinstance(child, dict)]
+
+def iter_lifted_resources(resource, path=()):
+    """
+    Yields (path, resource) for resource and, depth first, every child resource
+    nested in it. path holds the indexes into the nested "resources" arrays that
+    lead to each one; the resources yielded have no "resources" of their own.
+    """
+    children = resource.get("resources")
+    if not isinstance(children, list):
+        yield path, resource
+        return
+    source = resource_source(resource)
+    yield path, with_source({key: value for key, value in resource.items() if key != "resources"}, source)
+    for index, child in enumerate(children):
+        if isinstance(child, dict):
+            child_type, child_name = child_resource_key(resource.get("type"), resource.get("name"), child)
+            yield from iter_lifted_resources(with_source(dict(child, type=child_type, name=child_name), source),
+                                             path + (index,))
+
+def expand_nested_resources(resources):
+    """
+    Returns resources with every nested child resource lifted out after its parent.
+    The list is returned as is when no resource has nested children.
+    """
+    if not any(nested_children(resource) for resource in resources):
+        return resources
+    expanded = []
+    for resource in resources:
+        if isinstance(resource, dict):
+            expanded.extend(lifted for _path, lifted in iter_lifted_resources(resource))
+        else:
+            expanded.append(resource)
+    return expanded
+
+class MappingIndex:
+    """
+    resourceMappings compiled into a character trie on the left type prefix, whose
+    nodes hold a second trie on the left name prefix. Looking up a resource walks
+    its type and name once, so the cost depends on the key length rather than on
+    the number of mappings.
+    """
+    def __init__(self, resource_mappings):
+        self.mappings = []
+        # Each node is a dict of character -> child node; the None entry holds the
+        # name trie (in the type trie) or the mapping indexes (in a name trie).
+        self._root = {}
+        for mapping in resource_mappings or []:
+            left_type = mapping.get("leftResourceType")
+            left_name = mapping.get("leftResourceName")
+            index = len(self.mappings)
+            self.mappings.append((len(left_type), len(left_name),
+                                  mapping.get("rightResourceType"), mapping.get("rightResourceName")))
+            node = self._root
+            for char in left_type:
+                node = node.setdefault(char, {})
+            node = node.setdefault(None, {})
+            for char in left_name:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(index)
+
+    def __len__(self):
+        return len(self.mappings)
+
+    def candidates(self, resource_type, resource_name):
+        """
+        Returns (mapping_index, right_key) for every mapping whose left type and name
+        are prefixes of the resource's, in mapping order. The right key has the
+        remainder of the resource's type and name appended, so child resources
+        follow their parent.
+        """
+        name_tries = []
+        node = self._root
+        for char in resource_type:
+            if None in node:
+                name_tries.append(node[None])
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                name_tries.append(node[None])
+
+        indexes = []
+        for node in name_tries:
+            for char in resource_name:
+                if None in node:
+                    indexes.extend(node[None])
+                node = node.get(char)
+                if node is None:
+                    break
+            else:
+                if None in node:
+                    indexes.extend(node[None])
+
+        found = []
+        for index in sorted(indexes):
+            type_length, name_length, right_type, right_name = self.mappings[index]
+            found.append((index, (right_type + resource_type[type_length:],
+                                  right_name + resource_name[name_length:])))
+        return found
+
+def build_mapping_index(resource_mappings):
+    """
+    Compiles the resource mappings. An already compiled MappingIndex is returned as is.
+    """
+    if isinstance(resource_mappings, MappingIndex):
+        return resource_mappings
+    return MappingIndex(resource_mappings)
+
+def index_resources(resources, side, duplicates=None):
+    """
+    Returns the resources with a type and name keyed by (type, name). When a key
+    is defined more than once the last definition is kept and, if duplicates is
+    given, (side, key, definitions) is appended to it.
+    """
+    index = {}
+    repeated = {}
+    for res in resources:
+        if not (res.get("type") and res.get("name")):
+            continue
+        key = get_resource_key(res)
+        if key in index:
+            repeated.setdefault(key, [index[key]]).append(res)
+        index[key] = res
+    if duplicates is not None:
+        duplicates.extend((side, key, definitions) for key, definitions in repeated.items())
+    return index
+
+# One definition of a type and name defined more than once on a side. definition
+# counts from 1 in template (file) order; only the last one is compared.
+DuplicateDefinition = collections.namedtuple(
+    "DuplicateDefinition", ["side", "type", "name", "definition", "source", "compared"])
+
+def duplicate_definitions(duplicates, resource_filter=None):
+    """
+    Returns a DuplicateDefinition per definition of the duplicates collected by
+    index_resources, leaving out those resource_filter does not select.
+    """
+    return [DuplicateDefinition(side, key[0], key[1], number, resource_source(res), number == len(definitions))
+            for side, key, definitions in duplicates
+            if not resource_filter or resource_filter(definitions[-1])
+            for number, res in enumerate(definitions, start=1)]
+
+def duplicate_resource_count(duplicates):
+    """
+    Returns the number of distinct (side, type, name) keys among DuplicateDefinitions.
+    """
+    return len({(entry.side, entry.type, entry.name) for entry in duplicates})
+
+def pair_resources(left_resources, right_resources, resource_mappings=None, duplicates=None):
+    """
+    Pairs resources from the left and right templates.
+    Mappings are applied first (prefix based, so child resources follow their parent),
+    then resources with identical type and name are paired.
+    resource_mappings is the resourceMappings list or a compiled MappingIndex.
+    Resources whose type and name repeat are collected in duplicates, see index_resources.
+    Returns (resource_pairs, unmatched_left, unmatched_right).
+    """
+    left_dict = index_resources(left_resources, "left", duplicates)
+    right_dict = index_resources(right_resources, "right", duplicates)
+
+    resource_pairs = []
+
+    # Enhanced partial mapping based on prefixes. Mappings are applied in order,
+    # each to the left resources in template order, and a resource is paired by
+    # the first mapping whose candidate right resource is still unpaired.
+    mapping_index = build_mapping_index(resource_mappings)
+    if mapping_index:
+        candidates = []
+        for order, key in enumerate(left_dict):
+            for index, candidate_key in mapping_index.candidates(*key):
+                if candidate_key in right_dict:
+                    candidates.append((index, order, key, candidate_key))
+        candidates.sort(key=lambda candidate: candidate[:2])
+        for _index, _order, key, candidate_key in candidates:
+            if key in left_dict and candidate_key in right_dict:
+                resource_pairs.append((left_dict.pop(key), right_dict.pop(candidate_key)))
+
+    for key in list(left_dict.keys()):
+        if key in right_dict:
+            resource_pairs.append((left_dict[key], right_dict[key]))
+            del left_dict[key]
+            del right_dict[key]
 
-def exit_with_error(message):
-    sys.stderr.write(message + "\n")
-    sys.stderr.flush()
-    sys.exit(1)
+    return resource_pairs, left_dict, right_dict
 
-def parse_arguments():
-    parser = argparse.ArgumentParser(description='Compare two ARM templates by type and name')
-    parser.add_argument('--left', required=True, help='Left ARM template JSON file')
-    parser.add_argument('--right', required=True, help='Right ARM template JSON file')
-    parser.add_argument('--config', help='Configuration YAML file (optional)')
-    parser.add_argument('--output', required=True, help='Output file')
-    # Updated the choices to include 'xlsx'
-    parser.add_argument('--format', choices=['markdown', 'html', 'xlsx'], default='html',
-                        help='Output format: markdown, html, or xlsx (default: html)')
-    return parser.parse_args()
+#
+# Similarity-based auto-pairing
+#
+# Resources left unmatched after pairing are sketched with MinHash over their
+# flattened "path=value" leaves. Signatures are split into LSH bands and only
+# resources of the same type that share a band bucket are compared, so the cost
+# grows roughly linearly with the number of unmatched resources.
+#
+MINHASH_PERMUTATIONS = 64
+MINHASH_UNPACK = struct.Struct(f"<{MINHASH_PERMUTATIONS}Q").unpack
+LSH_MAX_BUCKET_SIDE = 64  # per side, so a crowded bucket cannot go quadratic
+AUTO_PAIR_DEFAULT_THRESHOLD = 0.6
 
-def load_json_file(filepath):
-    if not os.path.exists(filepath):
-        exit_with_error(f"Error: JSON file '{filepath}' does not exist.")
-    try:
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        exit_with_error(f"Error: Failed to read JSON file '{filepath}': {e}")
+def minhash_signature(resource, ignore_matcher=None):
+    """
+    Returns the MinHash signature of a resource's flattened, non-ignored leaves,
+    or None if it has none. The top-level name is left out, since it is what
+    differs between the resources being auto-paired. Each leaf is hashed once with
+    SHAKE-128, whose output is read as one 64-bit value per permutation.
+    """
+    hashes = []
+    for segments, value in iter_flatten(resource, ignore_matcher):
+        if segments == ("name",) or isinstance(value, IgnoredSubtree):
+            continue
+        path = join_path(segments)
+        if ignore_matcher is not None and ignore_matcher(path):
+            continue
+        leaf = f"{path}={value!r}".encode("utf-8")
+        hashes.append(MINHASH_UNPACK(hashlib.shake_128(leaf).digest(MINHASH_PERMUTATIONS * 8)))
+    if not hashes:
+        return None
+    return tuple(map(min, zip(*hashes)))
 
-def load_yaml_file(filepath):
-    if not os.path.exists(filepath):
-        exit_with_error(f"Error: YAML config file '{filepath}' does not exist.")
-    try:
-        with open(filepath, 'r') as f:
-            return yaml.safe_load(f)
-    except Exception as e:
-        exit_with_error(f"Error: Failed to read YAML config file '{filepath}': {e}")
+def lsh_band_rows(threshold):
+    """
+    Chooses the rows per LSH band: the most selective banding that still makes
+    resources at the threshold similarity candidates with high probability.
+    """
+    for rows in (8, 4, 2):
+        bands = MINHASH_PERMUTATIONS // rows
+        if 1 - (1 - threshold ** rows) ** bands >= 0.8:
+            return rows
+    return 1
+
+def auto_pair_resources(unmatched_left, unmatched_right, threshold=AUTO_PAIR_DEFAULT_THRESHOLD,
+                        ignore_matcher=None):
+    """
+    Pairs leftover resources of the same type whose estimated Jaccard similarity
+    (over flattened property paths and values) is at least threshold.
+    The best matches are paired first. Paired resources are removed from
+    unmatched_left/unmatched_right.
+    Returns a list of (left_resource, right_resource, similarity).
+    """
+    rows = lsh_band_rows(threshold)
+    signatures = ({}, {})
+    buckets = collections.defaultdict(lambda: ([], []))
+    for side, unmatched in enumerate((unmatched_left, unmatched_right)):
+        for key in unmatched:
+            signature = minhash_signature(load_resource(unmatched[key]), ignore_matcher)
+            if signature is None:
+                continue
+            signatures[side][key] = signature
+            for band in range(0, MINHASH_PERMUTATIONS, rows):
+                bucket = buckets[(key[0], band, signature[band:band + rows])][side]
+                if len(bucket) < LSH_MAX_BUCKET_SIDE:
+                    bucket.append(key)
+
+    left_order = {key: order for order, key in enumerate(signatures[0])}
+    right_order = {key: order for order, key in enumerate(signatures[1])}
+    candidates = set()
+    for left_keys, right_keys in buckets.values():
+        for left_key in left_keys:
+            for right_key in right_keys:
+                candidates.add((left_key, right_key))
+
+    scored = []
+    for left_key, right_key in candidates:
+        left_signature = signatures[0][left_key]
+        right_signature = signatures[1][right_key]
+        similarity = sum(1 for a, b in zip(left_signature, right_signature) if a == b) / MINHASH_PERMUTATIONS
+        if similarity >= threshold:
+            scored.append((-similarity, left_order[left_key], right_order[right_key], left_key, right_key))
+    scored.sort(key=lambda candidate: candidate[:3])
+
+    auto_pairs = []
+    for negative_similarity, _left, _right, left_key, right_key in scored:
+        if left_key in unmatched_left and right_key in unmatched_right:
+            auto_pairs.append((unmatched_left.pop(left_key), unmatched_right.pop(right_key),
+                               -negative_similarity))
+    return auto_pairs
+
+def mark_auto_paired(comparisons, auto_pairs):
+    """
+    Sets ResourceComparison.auto_paired to (right_name, similarity) on the
+    comparisons of auto-paired resources.
+    """
+    auto_paired = {get_resource_key(left_res): (right_res.get("name"), similarity)
+                   for left_res, right_res, similarity in auto_pairs}
+    for comparison in comparisons:
+        if auto_paired:
+            comparison.auto_paired = auto_paired.get((comparison.resource_type, comparison.resource_name))
+        yield comparison
+
+def compare_resources(left_res, right_res, ignore_matcher, ignored_properties, array_keys=None,
+                      comparison_rules=None):
+    """
+    Compares a single resource pair, adding any ignored property paths to
+    ignored_properties. Returns a ResourceComparison.
+    Both sides are walked together from the root: branches that are equal are
+    recorded as matched without being flattened, and only branches that differ
+    are flattened and compared leaf by leaf. Arrays are aligned by their
+    array_keys field where configured, and otherwise with align_lists.
+    Leaves whose path has a comparison_rules comparator are compared with it.
+    """
+    resource_type = left_res.get("type", "Unknown type")
+    resource_name = left_res.get("name", "Unknown name")
+
+    # Leaves from differing branches are merged into one [left, right] entry per path.
+    # Paths are joined once per leaf, since rows are ordered by the path string.
+    merged = {}
+
+    def add_side(node, segments, side):
+        for leaf_segments, value in iter_flatten(node, ignore_matcher, segments, array_keys):
+            key = join_path(leaf_segments)
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = [MISSING, MISSING]
+            entry[side] = value
+
+    def is_pruned(segments, node):
+        return isinstance(node, (dict, list)) and node and ignore_matcher.prunes(segments, node)
+
+    def walk_mapping(segments, left_map, right_map):
+        for key, left_child in left_map.items():
+            if key in right_map:
+                stack.append((segments + (key,), left_child, right_map[key]))
+            else:
+                add_side(left_child, segments + (key,), 0)
+        for key, right_child in right_map.items():
+            if key not in left_map:
+                add_side(right_child, segments + (key,), 1)
+
+    matched_branches = []
+    stack = [((), left_res, right_res)]
+    while stack:
+        segments, left_node, right_node = stack.pop()
+        if isinstance(left_node, (dict, list)) and type(left_node) is type(right_node) \
+                and left_node == right_node:
+            leaves, ignored = count_branch(segments, left_node, ignore_matcher, ignored_properties, array_keys)
+            matched_branches.append((segments, left_node, right_node, leaves, ignored))
+        elif is_pruned(segments, left_node) or is_pruned(segments, right_node):
+            add_side(left_node, segments, 0)
+            add_side(right_node, segments, 1)
+        elif isinstance(left_node, dict) and isinstance(right_node, dict):
+            walk_mapping(segments, left_node, right_node)
+        elif isinstance(left_node, list) and isinstance(right_node, list):
+            left_keyed = array_keys.key_items(segments, left_node) if array_keys else None
+            right_keyed = array_keys.key_items(segments, right_node) if left_keyed is not None else None
+            if right_keyed is not None:
+                walk_mapping(segments, left_keyed, right_keyed)
+                continue
+            left_items = sort_list_if_possible(left_node)
+            right_items = sort_list_if_possible(right_node)
+            for i, j in align_lists(left_items, right_items):
+                if j is None:
+                    add_side(left_items[i], segments + (i,), 0)
+                elif i is None:
+                    add_side(right_items[j], segments + (AddedIndex(j),), 1)
+                else:
+                    stack.append((segments + (i,), left_items[i], right_items[j]))
+        else:
+            add_side(left_node, segments, 0)
+            add_side(right_node, segments, 1)
+
+    rows = []
+    for key in sorted(merged):
+        left_val, right_val = merged[key]
+        # A pruned subtree only hides its own ignored leaves: it is Ignored against
+        # another pruned subtree or a missing side, but not against a scalar
+        pruned = (isinstance(left_val, IgnoredSubtree) or isinstance(right_val, IgnoredSubtree)) \
+            and all(isinstance(val, IgnoredSubtree) or val is MISSING for val in (left_val, right_val))
+        comparator = comparison_rules.comparator(key) if comparison_rules else None
+        if comparator is None:
+            # A missing side is shown, and compared, as ''
+            if left_val is MISSING:
+                left_val = ''
+            if right_val is MISSING:
+                right_val = ''
+        if pruned or ignore_matcher(key):
+            matched = "Ignored"
+            ignored_properties.add(key)
+        elif comparator is not None:
+            matched = "" if comparator(left_val, right_val) else "X"
+        elif left_val == right_val:
+            matched = ""
+        else:
+            matched = "X"
+        rows.append((matched, key, '' if left_val is MISSING else left_val, '' if right_val is MISSING else right_val))
 
-def sort_list_if_possible(lst):
+    return ResourceComparison(resource_type, resource_name, rows, matched_branches, ignore_matcher, array_keys)
+
+def build_ignore_matcher(ignore_rules):
     """
-    If lst is a non-empty list of dictionaries, attempt to sort it.
-    First, if every dict has a "name" key, sort by that.
-    Otherwise, if every dict has an "id" key, sort by that.
-    Otherwise, leave the list unchanged.
+    Compiles the ignore rules, always including "dependsOn".
+    An already compiled IgnoreMatcher is returned as is, so its caches can be shared.
     """
-    if isinstance(lst, list) and lst and all(isinstance(item, dict) for item in lst):
-        if all("name" in item for item in lst):
-            return sorted(lst, key=lambda x: x["name"])
-        elif all("id" in item for item in lst):
-            return sorted(lst, key=lambda x: x["id"])
-    return lst
+    if isinstance(ignore_rules, IgnoreMatcher):
+        return ignore_rules
+    ignore_rules = list(ignore_rules or [])
+    if "dependsOn" not in ignore_rules:
+        ignore_rules.append("dependsOn")
+    return IgnoreMatcher(ignore_rules)
 
-def flatten_json(data, parent_key=''):
+def iter_resource_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs=1, output_format=None,
+                              array_keys=None, shown_rows=None, comparison_rules=None):
     """
-    Recursively flattens JSON into a dict mapping full property paths to values.
-    Lists are indexed. If a list contains dictionaries with a "name" or "id" property,
-    it will be sorted in memory before flattening.
+    Yields a ResourceComparison per resource pair as each comparison completes,
+    in pairing order. Resource pairs whose type matches an ignore rule are skipped
+    entirely. With jobs > 1 and enough pairs, the pairs are compared in batches on
+    a process pool; the output is identical to the serial comparison.
+    If output_format is 'html' or 'markdown', the workers also render each detail
+    table (see ResourceComparison.rendered_table) and do not send the rows back.
+    shown_rows is set on every comparison; workers then only send back the
+    report rows. comparison_rules, a ComparisonRules, is passed to compare_resources.
     """
-    items = {}
-    if isinstance(data, dict):
-        for k, v in data.items():
-            new_key = f"{parent_key}.{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.update(flatten_json(v, new_key))
-            elif isinstance(v, list):
-                v = sort_list_if_possible(v)
-                for i, item in enumerate(v):
-                    list_key = f"{new_key}[{i}]"
-                    if isinstance(item, (dict, list)):
-                        items.update(flatten_json(item, list_key))
-                    else:
-                        items[list_key] = item
-            else:
-                items[new_key] = v
-    elif isinstance(data, list):
-        data = sort_list_if_possible(data)
-        for i, item in enumerate(data):
-            new_key = f"{parent_key}[{i}]"
-            if isinstance(item, (dict, list)):
-                items.update(flatten_json(item, new_key))
-            else:
-                items[new_key] = item
-    else:
-        items[parent_key] = data
-    return items
+    # If the entire resource type is ignored by some rule, skip it
+    resource_pairs = [(left_res, right_res) for left_res, right_res in resource_pairs
+                      if not ignore_matcher(left_res.get("type", "Unknown type"))]
+    if jobs > 1 and len(resource_pairs) >= PARALLEL_MIN_PAIRS:
+        yield from iter_parallel_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs,
+                                             output_format, array_keys, shown_rows, comparison_rules)
+        return
+    for left_res, right_res in resource_pairs:
+        comparison = compare_resources(load_resource(left_res), load_resource(right_res),
+                                       ignore_matcher, ignored_properties, array_keys, comparison_rules)
+        comparison.shown_rows = shown_rows
+        yield comparison
 
-def generate_anchor(resource_type, resource_name):
+#
+# Parallel comparison
+#
+# Pairs are sent to worker processes in batches to keep pickling overhead low,
+# and at most a few batches per worker are in flight so memory stays bounded.
+# Workers expand the rows themselves, so only plain row tuples (or, for the
+# text formats, the rendered tables) come back.
+#
+PARALLEL_MIN_PAIRS = 200
+PARALLEL_MAX_BATCH_SIZE = 64
+PARALLEL_BATCHES_IN_FLIGHT = 2  # per worker
+
+_worker_ignore_matcher = None
+_worker_array_keys = None
+_worker_output_format = None
+_worker_shown_rows = None
+_worker_comparison_rules = None
+
+def _init_comparison_worker(ignore_rules, array_keys, output_format, shown_rows, comparison_rules):
+    global _worker_ignore_matcher, _worker_array_keys, _worker_output_format, _worker_shown_rows
+    global _worker_comparison_rules
+    _worker_ignore_matcher = IgnoreMatcher(ignore_rules)
+    _worker_array_keys = ArrayKeys(array_keys)
+    _worker_output_format = output_format
+    _worker_shown_rows = shown_rows
+    _worker_comparison_rules = ComparisonRules(comparison_rules)
+
+def _compare_batch(batch):
+    ignored_properties = set()
+    comparisons = []
+    for left_res, right_res in batch:
+        comparison = compare_resources(load_resource(left_res), load_resource(right_res),
+                                       _worker_ignore_matcher, ignored_properties, _worker_array_keys,
+                                       _worker_comparison_rules)
+        comparison.shown_rows = _worker_shown_rows
+        if _worker_output_format in TABLE_GENERATORS:
+            table = TABLE_GENERATORS[_worker_output_format](comparison)
+            comparison.rendered_table = (_worker_output_format, table)
+            comparison.matched_branches = []
+            comparison._rows = []
+        elif _worker_shown_rows is not None:
+            comparison._rows = comparison.report_rows
+            comparison.matched_branches = []
+        else:
+            comparison.rows  # expand matched branches in the worker
+        comparison._ignore_matcher = None
+        comparison._array_keys = None
+        comparisons.append(comparison)
+    return comparisons, ignored_properties
+
+def iter_parallel_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs, output_format=None,
+                              array_keys=None, shown_rows=None, comparison_rules=None):
     """
-    Generates a sanitized anchor string based on resource type and name.
+    Compares resource pairs on a pool of jobs worker processes, yielding results in order.
     """
-    combined = f"{resource_type}-{resource_name}"
-    anchor = re.sub(r'[^a-zA-Z0-9-]', '', combined.replace(' ', '-')).lower()
-    return anchor
+    batch_size = max(1, min(PARALLEL_MAX_BATCH_SIZE, len(resource_pairs) // (jobs * 4)))
+    batches = (resource_pairs[i:i + batch_size] for i in range(0, len(resource_pairs), batch_size))
+    initargs = (ignore_matcher.rules, array_keys.rules if array_keys else None, output_format, shown_rows,
+                comparison_rules.rules if comparison_rules else None)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_comparison_worker,
+                                                initargs=initargs) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(_compare_batch, batch))
+            if len(pending) >= jobs * PARALLEL_BATCHES_IN_FLIGHT:
+                yield from _collect_batch(pending.popleft(), ignore_matcher, ignored_properties, array_keys)
+        while pending:
+            yield from _collect_batch(pending.popleft(), ignore_matcher, ignored_properties, array_keys)
+
+def _collect_batch(future, ignore_matcher, ignored_properties, array_keys):
+    comparisons, batch_ignored = future.result()
+    ignored_properties.update(batch_ignored)
+    for comparison in comparisons:
+        comparison._ignore_matcher = ignore_matcher
+        comparison._array_keys = array_keys
+        yield comparison
+
+def pair_templates(left_template, right_template, resource_mappings, ignore_matcher, auto_pair=None,
+                   resource_filter=None, timings=NO_TIMINGS, duplicates=None):
+    """
+    Pairs the resources of two templates with pair_resources and, if auto_pair is a
+    similarity threshold, auto-pairs the leftovers with auto_pair_resources.
+    Nested child resources are lifted out first with expand_nested_resources.
+    resource_filter, a ResourceFilter, then drops the resources it does not select.
+    Every definition of a type and name defined more than once on a side is
+    appended to duplicates, if given, as a DuplicateDefinition.
+    Returns (resource_pairs, unmatched_left, unmatched_right, auto_pairs).
+    """
+    repeated = []
+    with timings.phase("pairing"):
+        resource_pairs, unmatched_left, unmatched_right = pair_resources(
+            expand_nested_resources(left_template.get("resources", [])),
+            expand_nested_resources(right_template.get("resources", [])),
+            resource_mappings,
+            repeated,
+        )
+    if duplicates is not None:
+        duplicates.extend(duplicate_definitions(repeated, resource_filter))
+    auto_pairs = []
+    if auto_pair:
+        with timings.phase("auto-pair"):
+            auto_pairs = auto_pair_resources(unmatched_left, unmatched_right, auto_pair, ignore_matcher)
+        resource_pairs.extend((left_res, right_res) for left_res, right_res, _similarity in auto_pairs)
+    if resource_filter:
+        resource_pairs, unmatched_left, unmatched_right = resource_filter.filter(
+            resource_pairs, unmatched_left, unmatched_right)
+    return resource_pairs, unmatched_left, unmatched_right, auto_pairs
+
+def compare_templates(left_template, right_template, ignore_rules=None, resource_mappings=None, jobs=1,
+                      auto_pair=None, array_keys=None, resource_filter=None, comparison_rules=None):
+    """
+    Compares two parsed ARM templates and returns a ComparisonResult.
+    Templates from index_json_file are accepted too; each resource body is then
+    only loaded when its pair is compared.
+    "dependsOn" is always ignored. Resource pairs whose type matches an ignore
+    rule are skipped entirely. jobs > 1 compares the pairs on a process pool.
+    auto_pair is an optional similarity threshold (0-1) for pairing leftover
+    resources of the same type by their properties. array_keys is the arrayKeys
+    config (or a compiled ArrayKeys) naming the key field of specific arrays.
+    resource_filter, a ResourceFilter, limits the comparison to the resources it selects.
+    comparison_rules is the comparisonRules config (or compiled ComparisonRules).
+    """
+    ignore_matcher = build_ignore_matcher(ignore_rules)
+    array_keys = build_array_keys(array_keys)
+    comparison_rules = build_comparison_rules(comparison_rules)
+    duplicates = []
+    resource_pairs, unmatched_left, unmatched_right, auto_pairs = pair_templates(
+        left_template, right_template, resource_mappings, ignore_matcher, auto_pair, resource_filter,
+        duplicates=duplicates)
+    ignored_properties = set()
+    resources = list(mark_auto_paired(
+        iter_resource_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs,
+                                  array_keys=array_keys, comparison_rules=comparison_rules), auto_pairs))
+    return ComparisonResult(resources, unmatched_left, unmatched_right, ignored_properties, duplicates)
 
-def generate_markdown_table(resource_key_display, left_flat, right_flat, ignore_rules, ignored_set):
+def generate_markdown_table(resource):
     """
-    Given two flattened dicts for a resource (left and right), generate a Markdown table comparing the property values.
-    If a property key matches an ignore rule, its fail result is set to "Ignored" (and added to ignored_set);
-    if it doesn't match and the left/right values differ, a cross (X) is printed;
-    if they match, the cell is left empty.
+    Generates a Markdown table for a ResourceComparison.
+    The Matched column reads "Ignored" for ignored properties, a cross (X) where
+    the left/right values differ, and is left empty where they match.
     """
     md_lines = []
-    md_lines.append(f"### Comparison for Resource: {resource_key_display}\n")
+    md_lines.append(f"### Comparison for Resource: {resource.display_name}\n")
     md_lines.append("| Matched | Property Path | Left Value | Right Value |")
     md_lines.append("| --- | --- | --- | --- |")
-    all_keys = set(left_flat.keys()).union(set(right_flat.keys()))
-    for key in sorted(all_keys):
-        is_ignored = ignore_rules and any(fnmatch.fnmatch(key, pattern) for pattern in ignore_rules)
-        if is_ignored:
-            fail_cell = "Ignored"
-            ignored_set.add(key)
-        else:
-            fail_cell = "" if left_flat.get(key, '') == right_flat.get(key, '') else "X"
-        left_val = left_flat.get(key, '')
-        right_val = right_flat.get(key, '')
-        md_lines.append(f"| {fail_cell} | {key} | {left_val} | {right_val} |")
+    for matched, key, left_val, right_val in resource.report_rows:
+        md_lines.append(f"| {matched} | {key} | {left_val} | {right_val} |")
     return "\n".join(md_lines)
 
 def format_html_value(value):
@@ -143,32 +2074,22 @@ def format_html_value(value):
             f'<span class="full" style="display:none;">{value}</span> '
             f'<a href="#" class="toggle-more" onclick="toggleMore(this); return false;">[more]</a>')
 
-def generate_html_table(resource_key_display, left_flat, right_flat, ignore_rules, ignored_set):
+def generate_html_table(resource):
     """
-    Given two flattened dicts for a resource (left and right), generate an HTML table comparing the property values.
-    If a property key matches an ignore rule, its cell will display "Ignored" (and be added to ignored_set);
-    if they differ, a cross (X) is displayed in the "Matched" column.
+    Generates an HTML table for a ResourceComparison.
+    The Matched column reads "Ignored" for ignored properties and a cross (X) where the values differ.
     """
     html_lines = []
-    html_lines.append(f"<h3>Comparison for Resource: {resource_key_display}</h3>")
+    html_lines.append(f"<h3>Comparison for Resource: {resource.display_name}</h3>")
     html_lines.append("<table>")
     html_lines.append("<thead>")
     html_lines.append("<tr><th>Matched</th><th>Property Path</th><th>Left Value</th><th>Right Value</th></tr>")
     html_lines.append("</thead>")
     html_lines.append("<tbody>")
-    all_keys = set(left_flat.keys()).union(set(right_flat.keys()))
-    for key in sorted(all_keys):
-        is_ignored = ignore_rules and any(fnmatch.fnmatch(key, pattern) for pattern in ignore_rules)
-        if is_ignored:
-            fail_cell = "Ignored"
-            ignored_set.add(key)
-        else:
-            fail_cell = "" if left_flat.get(key, '') == right_flat.get(key, '') else "X"
-        left_val = left_flat.get(key, '')
-        right_val = right_flat.get(key, '')
+    for matched, key, left_val, right_val in resource.report_rows:
         html_lines.append(
             f"<tr>"
-            f"<td>{fail_cell}</td>"
+            f"<td>{matched}</td>"
             f"<td onclick='highlightRow(this);' style='cursor: pointer;'>{key}</td>"
             f"<td>{format_html_value(left_val)}</td>"
             f"<td>{format_html_value(right_val)}</td>"
@@ -178,11 +2099,15 @@ def generate_html_table(resource_key_display, left_flat, right_flat, ignore_rule
     html_lines.append("</table>")
     return "\n".join(html_lines)
 
-def generate_html_summary(summary_entries, ignored_properties, left_dict, right_dict):
+def generate_html_summary(summary_entries, ignored_properties, left_dict, right_dict, changes=None,
+                          duplicates=None):
     """
     Generates the HTML summary section with an additional "Ignored" column.
     Each summary entry is a tuple of (resource_type, resource_name, total, ignored, correct, incorrect, anchor),
     where total == ignored + correct + incorrect.
+    changes, when comparing against a previous run, is a list of
+    (resource_type, resource_name, change, anchor) tuples.
+    duplicates is a list of DuplicateDefinition.
     """
     html = []
     html.append("<h1>Summary</h1>")
@@ -193,6 +2118,21 @@ def generate_html_summary(summary_entries, ignored_properties, left_dict, right_
         for prop in sorted(ignored_properties):
             html.append(f"<li>{prop}</li>")
         html.append("</ul>")
+    if changes is not None:
+        html.append("<h2>Changes Since Previous Run</h2>")
+        if changes:
+            html.append("<table>")
+            html.append("<thead>")
+            html.append("<tr><th>Resource Type</th><th>Name</th><th>Change</th></tr>")
+            html.append("</thead>")
+            html.append("<tbody>")
+            for rtype, rname, change, anchor in changes:
+                name = f"<a href='#{anchor}'>{rname}</a>" if anchor else rname
+                html.append(f"<tr><td>{rtype}</td><td>{name}</td><td>{change}</td></tr>")
+            html.append("</tbody>")
+            html.append("</table>")
+        else:
+            html.append("<p>No resources changed since the previous run.</p>")
     html.append("<h2>Compared Resources</h2>")
     html.append("<table>")
     html.append("<thead>")
@@ -239,13 +2179,31 @@ def generate_html_summary(summary_entries, ignored_properties, left_dict, right_
             html.append(f"<tr><td>{rtype}</td><td>{rname}</td></tr>")
         html.append("</tbody>")
         html.append("</table>")
+    if duplicates:
+        html.append("<h2>Duplicate Resources</h2>")
+        html.append("<p>These resources are defined more than once; only the last definition is compared.</p>")
+        html.append("<table>")
+        html.append("<thead>")
+        html.append("<tr><th>Side</th><th>Resource Type</th><th>Name</th><th>Definition</th><th>Source</th>"
+                    "<th>Compared</th></tr>")
+        html.append("</thead>")
+        html.append("<tbody>")
+        for side, rtype, rname, definition, source, compared in duplicates:
+            html.append(f"<tr><td>{side.capitalize()}</td><td>{rtype}</td><td>{rname}</td><td>{definition}</td>"
+                        f"<td>{source or ''}</td><td>{'Yes' if compared else 'No'}</td></tr>")
+        html.append("</tbody>")
+        html.append("</table>")
     return "\n".join(html)
 
-def generate_markdown_summary(summary_entries, ignored_properties, left_dict, right_dict):
+def generate_markdown_summary(summary_entries, ignored_properties, left_dict, right_dict, changes=None,
+                              duplicates=None):
     """
     Generates the Markdown summary section with an additional "Ignored" column.
     Each summary entry is a tuple of (resource_type, resource_name, total, ignored, correct, incorrect, anchor),
     where total == ignored + correct + incorrect.
+    changes, when comparing against a previous run, is a list of
+    (resource_type, resource_name, change, anchor) tuples.
+    duplicates is a list of DuplicateDefinition.
     """
     lines = []
     lines.append("# Summary\n")
@@ -255,6 +2213,17 @@ def generate_markdown_summary(summary_entries, ignored_properties, left_dict, ri
         for prop in sorted(ignored_properties):
             lines.append(f"- {prop}")
         lines.append("")
+    if changes is not None:
+        lines.append("## Changes Since Previous Run\n")
+        if changes:
+            lines.append("| Resource Type | Name | Change |")
+            lines.append("| --- | --- | --- |")
+            for rtype, rname, change, anchor in changes:
+                name = f"[{rname}](#{anchor})" if anchor else rname
+                lines.append(f"| {rtype} | {name} | {change} |")
+        else:
+            lines.append("No resources changed since the previous run.")
+        lines.append("")
     lines.append("## Compared Resources\n")
     lines.append("| Resource Type | Name | Total Properties | Ignored | Correct | Incorrect |")
     lines.append("| --- | --- | --- | --- | --- | --- |")
@@ -279,583 +2248,996 @@ def generate_markdown_summary(summary_entries, ignored_properties, left_dict, ri
             rtype = res.get("type", "Unknown type")
             rname = res.get("name", "Unknown name")
             lines.append(f"| {rtype} | {rname} |")
+    if duplicates:
+        lines.append("\n## Duplicate Resources\n")
+        lines.append("These resources are defined more than once; only the last definition is compared.\n")
+        lines.append("| Side | Resource Type | Name | Definition | Source | Compared |")
+        lines.append("| --- | --- | --- | --- | --- | --- |")
+        for side, rtype, rname, definition, source, compared in duplicates:
+            lines.append(f"| {side.capitalize()} | {rtype} | {rname} | {definition} | {source or ''} | "
+                         f"{'Yes' if compared else 'No'} |")
     return "\n".join(lines)
 
-def generate_html_output(summary_entries, ignored_properties, left_dict, right_dict, detailed_sections):
+TABLE_GENERATORS = {
+    "html": generate_html_table,
+    "markdown": generate_markdown_table,
+}
+
+HTML_STYLE = [
+    "table { width: 100%; max-width: 100%; border-collapse: collapse; }",
+    "th, td { border: 1px solid #000; padding: 4px; overflow-wrap: break-word; word-wrap: break-word; }",
+]
+
+HTML_SCRIPT = [
+    "function toggleMore(link) {",
+    "  var full = link.previousElementSibling;",
+    "  var truncated = full.previousElementSibling;",
+    "  if (full.style.display === 'none') {",
+    "    full.style.display = 'inline';",
+    "    truncated.style.display = 'none';",
+    "    link.textContent = '[less]';",
+    "  } else {",
+    "    full.style.display = 'none';",
+    "    truncated.style.display = 'inline';",
+    "    link.textContent = '[more]';",
+    "  }",
+    "}",
+    "function highlightRow(cell) {",
+    "  var row = cell.parentNode;",
+    "  if(row.style.backgroundColor === 'yellow') {",
+    "    row.style.backgroundColor = '';",
+    "  } else {",
+    "    row.style.backgroundColor = 'yellow';",
+    "  }",
+    "}",
+]
+
+HTML_HEAD = "\n".join([
+    "<html>",
+    "<head>",
+    "<meta charset='UTF-8'>",
+    "<title>Comparison Report</title>",
+    "<style>",
+    *HTML_STYLE,
+    "</style>",
+    "<script>",
+    *HTML_SCRIPT,
+    "</script>",
+    "</head>",
+    "<body>",
+])
+
+#
+# Text report writers
+#
+# Each resource section is written as soon as its comparison completes. The
+# sections go to a spooled temporary file (in memory while small, on disk once
+# large) because the summary has to come first; the final file is then
+# written as header + summary + the spooled sections.
+#
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+def write_text_report(out, output_format, resources, ignored_properties, unmatched_left, unmatched_right,
+                      changes=None, duplicates=None):
+    """
+    Writes an HTML or Markdown report to the text file object out.
+    resources may be any iterable of ResourceComparison, including a generator that
+    compares lazily; ignored_properties and changes are only read once it has been consumed.
+    """
+    table_generator = TABLE_GENERATORS[output_format]
+    summary_entries = []
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+', encoding='utf-8') as details:
+        for resource in resources:
+            details.write(f'\n<a id="{resource.anchor}"></a>\n')
+            if resource.rendered_table and resource.rendered_table[0] == output_format:
+                details.write(resource.rendered_table[1])
+            else:
+                details.write(table_generator(resource))
+            details.write("\n\n")
+            summary_entries.append(resource.summary_entry())
+
+        if output_format == "html":
+            out.write(HTML_HEAD)
+            out.write("\n")
+            out.write(generate_html_summary(summary_entries, ignored_properties, unmatched_left, unmatched_right,
+                                            changes, duplicates))
+            out.write("\n<hr>")
+        else:
+            out.write(generate_markdown_summary(summary_entries, ignored_properties, unmatched_left, unmatched_right,
+                                                changes, duplicates))
+            out.write("\n---")
+        details.seek(0)
+        shutil.copyfileobj(details, out)
+    if output_format == "html":
+        out.write("\n</body>\n</html>")
+
+def generate_html_output(result):
     """
     Generates the complete HTML output including summary and detailed comparison sections.
     """
-    html_lines = []
-    html_lines.append("<html>")
-    html_lines.append("<head>")
-    html_lines.append("<meta charset='UTF-8'>")
-    html_lines.append("<title>Comparison Report</title>")
-    html_lines.append("<style>")
-    html_lines.append("table { width: 100%; max-width: 100%; border-collapse: collapse; }")
-    html_lines.append("th, td { border: 1px solid #000; padding: 4px; overflow-wrap: break-word; word-wrap: break-word; }")
-    html_lines.append("</style>")
-    html_lines.append("<script>")
-    html_lines.append("function toggleMore(link) {")
-    html_lines.append("  var full = link.previousElementSibling;")
-    html_lines.append("  var truncated = full.previousElementSibling;")
-    html_lines.append("  if (full.style.display === 'none') {")
-    html_lines.append("    full.style.display = 'inline';")
-    html_lines.append("    truncated.style.display = 'none';")
-    html_lines.append("    link.textContent = '[less]';")
-    html_lines.append("  } else {")
-    html_lines.append("    full.style.display = 'none';")
-    html_lines.append("    truncated.style.display = 'inline';")
-    html_lines.append("    link.textContent = '[more]';")
-    html_lines.append("  }")
-    html_lines.append("}")
-    html_lines.append("function highlightRow(cell) {")
-    html_lines.append("  var row = cell.parentNode;")
-    html_lines.append("  if(row.style.backgroundColor === 'yellow') {")
-    html_lines.append("    row.style.backgroundColor = '';")
-    html_lines.append("  } else {")
-    html_lines.append("    row.style.backgroundColor = 'yellow';")
-    html_lines.append("  }")
-    html_lines.append("}")
-    html_lines.append("</script>")
-    html_lines.append("</head>")
-    html_lines.append("<body>")
-    html_lines.append(generate_html_summary(summary_entries, ignored_properties, left_dict, right_dict))
-    html_lines.append("<hr>")
-    html_lines.extend(detailed_sections)
-    html_lines.append("</body>")
-    html_lines.append("</html>")
-    return "\n".join(html_lines)
+    out = io.StringIO()
+    write_text_report(out, "html", result.resources, result.ignored_properties,
+                      result.unmatched_left, result.unmatched_right, duplicates=result.duplicates)
+    return out.getvalue()
+
+def generate_markdown_output(result):
+    """
+    Generates the complete Markdown output including summary and detailed comparison sections.
+    """
+    out = io.StringIO()
+    write_text_report(out, "markdown", result.resources, result.ignored_properties,
+                      result.unmatched_left, result.unmatched_right, duplicates=result.duplicates)
+    return out.getvalue()
 
 #
-# Generate XLSX header cell
+# Compact HTML
+#
+# The html-compact format embeds the detail rows once, as gzip-compressed JSON
+# in base64, instead of writing a table row per property. Property paths are
+# interned into a single list and each row refers to its path by index. The
+# page decompresses the payload when it loads (DecompressionStream), builds a
+# collapsed section per resource and renders a section's table when it is
+# opened. Tables are virtualized in blocks of rows: only blocks near the
+# viewport hold rows, the others are spacers of the same height.
 #
-def set_header_cell(ws, row, col, value, font, alignment=None):
+COMPACT_ROW_STATUS = {"": 0, "X": 1, "Ignored": 2}
+COMPACT_BASE64_CHUNK = 3 * (1 << 14)  # a multiple of 3, so chunks encode independently
+
+COMPACT_HTML_STYLE = [
+    "details > summary { cursor: pointer; }",
+    "details > summary h3 { display: inline; }",
+    "tr.spacer td { padding: 0; border: 0; }",
+]
+
+COMPACT_HTML_SCRIPT = [
+    "var BLOCK_ROWS = 100, ROW_HEIGHT = 26, MAX_VALUE = 64;",
+    "var STATUS = ['', 'X', 'Ignored'];",
+    "var report = null;",
+    "var blockObserver = null;",
+    "async function loadReport() {",
+    "  var container = document.getElementById('details');",
+    "  if (typeof DecompressionStream === 'undefined') {",
+    "    container.textContent = 'This browser cannot read the compact report (DecompressionStream is not supported).';",
+    "    return;",
+    "  }",
+    "  var data = atob(document.getElementById('report-data').textContent.replace(/\\s+/g, ''));",
+    "  var bytes = new Uint8Array(data.length);",
+    "  for (var i = 0; i < data.length; i++) bytes[i] = data.charCodeAt(i);",
+    "  var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));",
+    "  report = JSON.parse(await new Response(stream).text());",
+    "  blockObserver = new IntersectionObserver(onBlocksVisible, {rootMargin: '1000px 0px'});",
+    "  container.textContent = '';",
+    "  report.resources.forEach(function (resource) {",
+    "    var details = document.createElement('details');",
+    "    details.id = resource.anchor;",
+    "    var summary = document.createElement('summary');",
+    "    var title = document.createElement('h3');",
+    "    title.textContent = 'Comparison for Resource: ' + resource.name;",
+    "    summary.appendChild(title);",
+    "    details.appendChild(summary);",
+    "    details.addEventListener('toggle', function () {",
+    "      if (details.open && !details.lastChild.tagName.match(/TABLE/)) renderTable(details, resource);",
+    "    });",
+    "    container.appendChild(details);",
+    "  });",
+    "  openAnchor();",
+    "}",
+    "function openAnchor() {",
+    "  var target = location.hash && document.getElementById(decodeURIComponent(location.hash.slice(1)));",
+    "  if (target && target.tagName === 'DETAILS') {",
+    "    target.open = true;",
+    "    target.scrollIntoView();",
+    "  }",
+    "}",
+    "function renderTable(details, resource) {",
+    "  var table = document.createElement('table');",
+    "  table.innerHTML = '<thead><tr><th>Matched</th><th>Property Path</th>' +",
+    "                    '<th>Left Value</th><th>Right Value</th></tr></thead>';",
+    "  var count = resource.rows.length / 4;",
+    "  for (var start = 0; start < count; start += BLOCK_ROWS) {",
+    "    var body = document.createElement('tbody');",
+    "    body.resource = resource;",
+    "    body.start = start;",
+    "    body.end = Math.min(count, start + BLOCK_ROWS);",
+    "    body.highlighted = {};",
+    "    body.expanded = {};",
+    "    showSpacer(body, (body.end - start) * ROW_HEIGHT);",
+    "    table.appendChild(body);",
+    "    blockObserver.observe(body);",
+    "  }",
+    "  details.appendChild(table);",
+    "}",
+    "function onBlocksVisible(entries) {",
+    "  entries.forEach(function (entry) {",
+    "    if (entry.isIntersecting) {",
+    "      if (!entry.target.filled) fillBlock(entry.target);",
+    "    } else if (entry.target.filled) {",
+    "      saveBlockState(entry.target);",
+    "      showSpacer(entry.target, entry.target.offsetHeight);",
+    "    }",
+    "  });",
+    "}",
+    "function showSpacer(body, height) {",
+    "  body.filled = false;",
+    "  body.innerHTML = '<tr class=\"spacer\"><td colspan=\"4\"></td></tr>';",
+    "  body.firstChild.firstChild.style.height = height + 'px';",
+    "}",
+    "function saveBlockState(body) {",
+    "  for (var row = body.firstChild, i = body.start; row; row = row.nextSibling, i++) {",
+    "    body.highlighted[i] = row.style.backgroundColor === 'yellow';",
+    "    [2, 3].forEach(function (col) {",
+    "      var full = row.cells[col].querySelector('.full');",
+    "      body.expanded[i + ':' + col] = !!full && full.style.display !== 'none';",
+    "    });",
+    "  }",
+    "}",
+    "function fillBlock(body) {",
+    "  var rows = body.resource.rows, paths = report.paths;",
+    "  var fragment = document.createDocumentFragment();",
+    "  for (var i = body.start; i < body.end; i++) {",
+    "    var row = document.createElement('tr');",
+    "    addCell(row, STATUS[rows[4 * i]]);",
+    "    var path = addCell(row, paths[rows[4 * i + 1]]);",
+    "    path.setAttribute('onclick', 'highlightRow(this);');",
+    "    path.style.cursor = 'pointer';",
+    "    addValueCell(row, rows[4 * i + 2], body.expanded[i + ':2']);",
+    "    addValueCell(row, rows[4 * i + 3], body.expanded[i + ':3']);",
+    "    if (body.highlighted[i]) row.style.backgroundColor = 'yellow';",
+    "    fragment.appendChild(row);",
+    "  }",
+    "  body.textContent = '';",
+    "  body.appendChild(fragment);",
+    "  body.filled = true;",
+    "}",
+    "function addCell(row, text) {",
+    "  var cell = row.insertCell();",
+    "  cell.textContent = text;",
+    "  return cell;",
+    "}",
+    "function addValueCell(row, value, expanded) {",
+    "  var text = String(value);",
+    "  if (text.length <= MAX_VALUE) return addCell(row, text);",
+    "  var cell = row.insertCell();",
+    "  var truncated = document.createElement('span');",
+    "  truncated.className = 'truncated';",
+    "  truncated.textContent = text.slice(0, MAX_VALUE);",
+    "  var full = document.createElement('span');",
+    "  full.className = 'full';",
+    "  full.textContent = text;",
+    "  var link = document.createElement('a');",
+    "  link.href = '#';",
+    "  link.className = 'toggle-more';",
+    "  link.setAttribute('onclick', 'toggleMore(this); return false;');",
+    "  truncated.style.display = expanded ? 'none' : 'inline';",
+    "  full.style.display = expanded ? 'inline' : 'none';",
+    "  link.textContent = expanded ? '[less]' : '[more]';",
+    "  cell.append(truncated, full, ' ', link);",
+    "  return cell;",
+    "}",
+    "window.addEventListener('hashchange', openAnchor);",
+]
+
+COMPACT_HTML_HEAD = "\n".join([
+    "<html>",
+    "<head>",
+    "<meta charset='UTF-8'>",
+    "<title>Comparison Report</title>",
+    "<style>",
+    *HTML_STYLE,
+    *COMPACT_HTML_STYLE,
+    "</style>",
+    "<script>",
+    *HTML_SCRIPT,
+    *COMPACT_HTML_SCRIPT,
+    "</script>",
+    "</head>",
+    "<body>",
+])
+
+def compact_value(value):
     """
-    Sets the given cell's value, font, and (optionally) alignment.
+    Returns a row value as shown by the HTML report; numbers stay numbers.
     """
-    cell = ws.cell(row=row, column=col)
-    cell.value = value
-    cell.font = font
-    if alignment:
-        cell.alignment = alignment
-
+    if isinstance(value, str) or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return value
+    return str(value)
 
-def generate_xlsx_output(summary_entries, ignored_properties, left_dict, right_dict, detailed_data):
+def write_compact_html_report(out, resources, ignored_properties, unmatched_left, unmatched_right,
+                              changes=None, duplicates=None):
     """
-    Generates the XLSX output with two sheets:
-    1) "Summary & Ignored" with summary info, ignored properties, unmatched resources
-    2) "Details" with a merged row for each resource that reads:
-       "Comparison for Resource: {ResourceType}/{ResourceName}",
-       followed by columns: Matched, Property Path, Left Value, Right Value.
+    Writes the html-compact report to the text file object out: the usual HTML
+    summary, followed by the detail rows as one compressed JSON payload
+    ({"resources": [{"name", "anchor", "rows"}], "paths": [...]}, where rows is a
+    flat list of status, path index, left value and right value per property).
     """
-    wb = Workbook()
-    ws_summary = wb.active
-    ws_summary.title = "Summary & Ignored"
-
-    # Formatting
-    ws_summary.column_dimensions['A'].width = 64
-    ws_summary.column_dimensions['B'].width = 32
-    ws_summary.column_dimensions['C'].width = 16
-    ws_summary.column_dimensions['D'].width = 16
-    ws_summary.column_dimensions['E'].width = 16
-    ws_summary.column_dimensions['F'].width = 16
-
-    bold_font = Font(bold=True)
-    center_alignment = Alignment(horizontal='center')
-    orange_fill = PatternFill(start_color='FFF2CC', end_color='FFF2CC', fill_type='solid')
-    red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-
-    # Write ignored properties (if any)
-    row = 1
-    ws_summary.cell(row=row, column=1, value="Ignored Properties").font = bold_font
-    row += 1
-    if ignored_properties:
-        for prop in sorted(ignored_properties):
-            ws_summary.cell(row=row, column=1, value=prop)
-            row += 1
-    else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
-
-    row += 1  # blank line
-
-    # Write summary table header
-    ws_summary.cell(row=row, column=1, value="Resource Type").font = bold_font
-    ws_summary.cell(row=row, column=2, value="Resource Name").font = bold_font
-
-    set_header_cell(ws_summary, row, 3, "Total Properties", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 4, "Ignored", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 5, "Correct", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 6, "Incorrect", bold_font, center_alignment)
-
-    row += 1
-
-    # Write summary rows
-    for entry in summary_entries:
-        rtype, rname, total, ignored, correct, incorrect, _anchor = entry
-        ws_summary.cell(row=row, column=1, value=rtype)
-        ws_summary.cell(row=row, column=2, value=rname)
-        
-        cell_3 = ws_summary.cell(row=row, column=3, value=total)
-        cell_3.alignment = center_alignment
-
-        cell_4 = ws_summary.cell(row=row, column=4, value=ignored)
-        cell_4.alignment = center_alignment
-
-        cell_5 = ws_summary.cell(row=row, column=5, value=correct)
-        cell_5.alignment = center_alignment
-
-        cell_6 = ws_summary.cell(row=row, column=6, value=incorrect)
-        cell_6.alignment = center_alignment
-
-        row += 1
-
-    row += 1  # blank line
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    paths = {}
+    summary_entries = []
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as payload:
+        payload.write(compressor.compress(b'{"resources":['))
+        for i, resource in enumerate(resources):
+            flat = []
+            for matched, path, left_val, right_val in resource.report_rows:
+                path_index = paths.get(path)
+                if path_index is None:
+                    path_index = paths[path] = len(paths)
+                flat += (COMPACT_ROW_STATUS.get(matched, 0), path_index,
+                         compact_value(left_val), compact_value(right_val))
+            record = dumps({"name": resource.display_name, "anchor": resource.anchor, "rows": flat})
+            payload.write(compressor.compress(((',' if i else '') + record).encode('utf-8')))
+            summary_entries.append(resource.summary_entry())
+        payload.write(compressor.compress(('],"paths":' + dumps(list(paths)) + '}').encode('utf-8')))
+        payload.write(compressor.flush())
+
+        out.write(COMPACT_HTML_HEAD)
+        out.write("\n")
+        out.write(generate_html_summary(summary_entries, ignored_properties, unmatched_left, unmatched_right,
+                                        changes, duplicates))
+        out.write("\n<hr>\n<div id=\"details\">Loading comparison details...</div>\n")
+        out.write('<script id="report-data" type="application/octet-stream">\n')
+        payload.seek(0)
+        for chunk in iter(lambda: payload.read(COMPACT_BASE64_CHUNK), b""):
+            out.write(base64.b64encode(chunk).decode('ascii'))
+            out.write("\n")
+        out.write("</script>\n<script>loadReport();</script>\n</body>\n</html>")
 
-    # Unmatched resources in left template
-    ws_summary.cell(row=row, column=1, value="Unmatched Resources in Left Template").font = bold_font
-    row += 1
-    if left_dict:
-        ws_summary.cell(row=row, column=1, value="Resource Type")
-        ws_summary.cell(row=row, column=2, value="Name")
-        row += 1
-        for res in left_dict.values():
-            rtype = res.get("type", "Unknown type")
-            rname = res.get("name", "Unknown name")
-            ws_summary.cell(row=row, column=1, value=rtype)
-            ws_summary.cell(row=row, column=2, value=rname)
-            row += 1
-    else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
+#
+# XLSX styles
+#
+# The workbook is written in openpyxl's write-only mode, so every row is
+# streamed straight to disk. Styles are registered once as named styles and
+# shared by every cell rather than being rebuilt per row. openpyxl is only
+# imported once an XLSX report is written, which keeps it out of the start-up
+# time of every other format.
+#
+XLSX_FILLS = {
+    "Ignored": "FFF2CC",  # orange
+    "X": "FFC7CE",        # red
+    "": "C6EFCE",         # green (correct)
+}
 
-    row += 2
+def register_xlsx_styles(wb):
+    """
+    Registers the named styles used by the XLSX output and returns a lookup of
+    (matched, column) -> style name for the detail rows.
+    Column 1 (Matched) is centered and columns 3/4 (Left/Right Value) wrap.
+    """
+    from openpyxl.styles import Font, Alignment, NamedStyle, PatternFill
+    wb.add_named_style(NamedStyle(name="arm_bold", font=Font(bold=True)))
+    wb.add_named_style(NamedStyle(name="arm_bold_center", font=Font(bold=True),
+                                  alignment=Alignment(horizontal='center')))
+    wb.add_named_style(NamedStyle(name="arm_bold_wrap", font=Font(bold=True),
+                                  alignment=Alignment(wrap_text=True)))
+    wb.add_named_style(NamedStyle(name="arm_title", font=Font(bold=True, size=16)))
+    wb.add_named_style(NamedStyle(name="arm_center", alignment=Alignment(horizontal='center')))
+
+    row_styles = {}
+    for matched, color in XLSX_FILLS.items():
+        fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+        prefix = f"arm_row_{color}"
+        wb.add_named_style(NamedStyle(name=f"{prefix}_center", fill=fill,
+                                      alignment=Alignment(horizontal='center')))
+        wb.add_named_style(NamedStyle(name=prefix, fill=fill))
+        wb.add_named_style(NamedStyle(name=f"{prefix}_wrap", fill=fill,
+                                      alignment=Alignment(wrap_text=True)))
+        row_styles[matched] = (f"{prefix}_center", prefix, f"{prefix}_wrap", f"{prefix}_wrap")
+    return row_styles
+
+def styled_cell(ws, value, style):
+    """
+    Creates a write-only cell carrying the given named style.
+    """
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
 
-    # Unmatched resources in right template
-    ws_summary.cell(row=row, column=1, value="Unmatched Resources in Right Template").font = bold_font
-    row += 1
-    if right_dict:
-        ws_summary.cell(row=row, column=1, value="Resource Type")
-        ws_summary.cell(row=row, column=2, value="Name")
-        row += 1
-        for res in right_dict.values():
-            rtype = res.get("type", "Unknown type")
-            rname = res.get("name", "Unknown name")
-            ws_summary.cell(row=row, column=1, value=rtype)
-            ws_summary.cell(row=row, column=2, value=rname)
-            row += 1
-    else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
+def set_column_widths(ws, widths):
+    """
+    Sets column widths; in write-only mode this must happen before any rows are appended.
+    """
+    from openpyxl.utils import get_column_letter
+    for col, width in enumerate(widths, start=1):
+        dimension = ws.column_dimensions[get_column_letter(col)]
+        dimension.width = width
+        dimension.auto_size = True
 
-    # --- Summary & Ignored Sheet (unchanged from your current code) ---
-    # ... Keep all of your existing logic for writing ignored properties,
-    # ... summary rows, unmatched resources, etc.
 
-    # Example placeholders (do NOT delete your existing summary code):
-    bold_font = Font(bold=True)
-    larger_bold_font = Font(bold=True, size=16)
-    center_alignment = Alignment(horizontal='center')
-    orange_fill = PatternFill(start_color='FFF2CC', end_color='FFF2CC', fill_type='solid')
-    red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+def generate_xlsx_output(result):
+    """
+    Generates the XLSX workbook for a ComparisonResult; see build_xlsx_workbook.
+    """
+    return build_xlsx_workbook(result.resources, result.ignored_properties,
+                               result.unmatched_left, result.unmatched_right, duplicates=result.duplicates)
 
-    # (Your existing summary code continues here; nothing changed)
+def build_xlsx_workbook(resources, ignored_properties, left_dict, right_dict, changes=None, duplicates=None):
+    """
+    Generates the XLSX output with two sheets:
+    1) "Summary & Ignored" with summary info, ignored properties, unmatched and
+       duplicate resources and, when comparing against a previous run, the changes since then
+    2) "Details" with a merged row for each resource that reads:
+       "{ResourceType}/{ResourceName}",
+       followed by columns: Matched, Property Path, Left Value, Right Value.
+    The workbook is write-only; rows are streamed so time and memory grow linearly
+    with the number of property rows. resources may be a generator: each resource is
+    written to the Details sheet as it arrives and the summary sheet is filled in last.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    row_styles = register_xlsx_styles(wb)
 
-    # --- Details Sheet ---
+    ws_summary = wb.create_sheet("Summary & Ignored")
+    set_column_widths(ws_summary, [64, 32, 16, 16, 16, 16])
     ws_details = wb.create_sheet("Details")
+    set_column_widths(ws_details, [12, 64, 64, 64])
 
+    summary_entries = []
     details_row = 1
-    for (rtype, rname, comparisons) in detailed_data:
+    for resource in resources:
+        summary_entries.append(resource.summary_entry())
+
         # 1) Merged header row for each resource
-        ws_details.merge_cells(start_row=details_row, start_column=1, end_row=details_row, end_column=4)
-        resource_cell = ws_details.cell(row=details_row, column=1)
-        resource_cell.value = f"{rtype}/{rname}"
-        resource_cell.font = larger_bold_font
+        ws_details.merged_cells.add(f"A{details_row}:D{details_row}")
+        ws_details.append([styled_cell(ws_details, f"{resource.resource_type}/{resource.paired_name}",
+                                       "arm_title")])
         details_row += 1
 
         # 2) Header row for matched, property path, left value, right value
-        ws_details.cell(row=details_row, column=1, value="Matched").font = bold_font
-        ws_details.cell(row=details_row, column=2, value="Property Path").font = bold_font
-        ws_details.cell(row=details_row, column=3, value="Left Value").font = bold_font
-        ws_details.cell(row=details_row, column=4, value="Right Value").font = bold_font
-
-        # Formatting
-        ws_details.column_dimensions['A'].width = 12
-        ws_details.column_dimensions['B'].width = 64
-        ws_details.column_dimensions['C'].width = 64
-        ws_details.column_dimensions['D'].width = 64
-
+        ws_details.append([
+            styled_cell(ws_details, "Matched", "arm_bold"),
+            styled_cell(ws_details, "Property Path", "arm_bold"),
+            styled_cell(ws_details, "Left Value", "arm_bold_wrap"),
+            styled_cell(ws_details, "Right Value", "arm_bold_wrap"),
+        ])
         details_row += 1
 
-        # 3) One row per property comparison
-        for matched, prop_path, left_val, right_val in comparisons:
-            if matched == "Ignored":
-                row_fill = orange_fill
-            elif matched == "X":
-                row_fill = red_fill
-            else:  # matched == "" => correct
-                row_fill = green_fill
-
-            # Write each cell
-            matched_cell = ws_details.cell(row=details_row, column=1)
-            matched_cell.value = matched
-            matched_cell.alignment = center_alignment
-
-            ws_details.cell(row=details_row, column=2, value=prop_path)
-            ws_details.cell(row=details_row, column=3, value=str(left_val))
-            ws_details.cell(row=details_row, column=4, value=str(right_val))
-
-            # Apply fill across the row
-            for col in range(1, 5):
-                ws_details.cell(row=details_row, column=col).fill = row_fill
-
-            # Apply wrap text to columns C and D (columns 3 and 4) for all rows
-            for row_cells in ws_details.iter_rows(min_col=3, max_col=4, min_row=1, max_row=ws_details.max_row):
-                for cell in row_cells:
-                    # Keep any existing horizontal/vertical setting if desired, just set wrap_text=True
-                    cell.alignment = Alignment(wrap_text=True)
-
+        # 3) One row per property comparison, filled by result
+        for matched, prop_path, left_val, right_val in resource.report_rows:
+            styles = row_styles.get(matched, row_styles[""])
+            values = (matched, prop_path, str(left_val), str(right_val))
+            ws_details.append([styled_cell(ws_details, value, style)
+                               for value, style in zip(values, styles)])
             details_row += 1
 
         # Add a blank row after each resource to separate blocks
+        ws_details.append([])
         details_row += 1
 
-    # (Optionally adjust column widths or call auto_size)
-    for sheet in [ws_summary, ws_details]:
-        for col in range(1, sheet.max_column + 1):
-            sheet.column_dimensions[get_column_letter(col)].auto_size = True
-
-    return wb
-
-#
-# New function to generate XLSX output
-#
-def generate_xlsx_outputxxx(summary_entries, ignored_properties, left_dict, right_dict, detailed_data):
-    """
-    Generates the XLSX output with two sheets:
-    1) "Summary & Ignored" with summary info, ignored properties, unmatched resources
-    2) "Details" with the detailed comparison for each resource
-    """
-    wb = Workbook()
-    ws_summary = wb.active
-    ws_summary.title = "Summary & Ignored"
-
-    # Formatting
-    ws_summary.column_dimensions['A'].width = 64
-    ws_summary.column_dimensions['B'].width = 32
-    ws_summary.column_dimensions['C'].width = 16
-    ws_summary.column_dimensions['D'].width = 16
-    ws_summary.column_dimensions['E'].width = 16
-    ws_summary.column_dimensions['F'].width = 16
-
-    bold_font = Font(bold=True)
-    center_alignment = Alignment(horizontal='center')
-    orange_fill = PatternFill(start_color='FFF2CC', end_color='FFF2CC', fill_type='solid')
-    red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+    # --- Summary & Ignored Sheet ---
 
     # Write ignored properties (if any)
-    row = 1
-    ws_summary.cell(row=row, column=1, value="Ignored Properties").font = bold_font
-    row += 1
+    ws_summary.append([styled_cell(ws_summary, "Ignored Properties", "arm_bold")])
     if ignored_properties:
         for prop in sorted(ignored_properties):
-            ws_summary.cell(row=row, column=1, value=prop)
-            row += 1
+            ws_summary.append([prop])
     else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
-
-    row += 1  # blank line
+        ws_summary.append(["None"])
 
-    # Write summary table header
-    ws_summary.cell(row=row, column=1, value="Resource Type").font = bold_font
-    ws_summary.cell(row=row, column=2, value="Resource Name").font = bold_font
+    ws_summary.append([])  # blank line
 
-    set_header_cell(ws_summary, row, 3, "Total Properties", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 4, "Ignored", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 5, "Correct", bold_font, center_alignment)
-    set_header_cell(ws_summary, row, 6, "Incorrect", bold_font, center_alignment)
+    # Changes since the previous run (if comparing against one)
+    if changes is not None:
+        ws_summary.append([styled_cell(ws_summary, "Changes Since Previous Run", "arm_bold")])
+        if changes:
+            ws_summary.append(["Resource Type", "Name", "Change"])
+            for rtype, rname, change, _anchor in changes:
+                ws_summary.append([rtype, rname, change])
+        else:
+            ws_summary.append(["None"])
+        ws_summary.append([])
 
-    row += 1
+    # Write summary table header
+    ws_summary.append([
+        styled_cell(ws_summary, "Resource Type", "arm_bold"),
+        styled_cell(ws_summary, "Resource Name", "arm_bold"),
+        styled_cell(ws_summary, "Total Properties", "arm_bold_center"),
+        styled_cell(ws_summary, "Ignored", "arm_bold_center"),
+        styled_cell(ws_summary, "Correct", "arm_bold_center"),
+        styled_cell(ws_summary, "Incorrect", "arm_bold_center"),
+    ])
 
     # Write summary rows
     for entry in summary_entries:
         rtype, rname, total, ignored, correct, incorrect, _anchor = entry
-        ws_summary.cell(row=row, column=1, value=rtype)
-        ws_summary.cell(row=row, column=2, value=rname)
-        
-        cell_3 = ws_summary.cell(row=row, column=3, value=total)
-        cell_3.alignment = center_alignment
+        ws_summary.append([rtype, rname] + [
+            styled_cell(ws_summary, value, "arm_center")
+            for value in (total, ignored, correct, incorrect)
+        ])
+
+    ws_summary.append([])  # blank line
+
+    # Unmatched resources in left, then right template
+    for heading, unmatched, gap in (("Unmatched Resources in Left Template", left_dict, 2),
+                                    ("Unmatched Resources in Right Template", right_dict, 0)):
+        ws_summary.append([styled_cell(ws_summary, heading, "arm_bold")])
+        if unmatched:
+            ws_summary.append(["Resource Type", "Name"])
+            for res in unmatched.values():
+                ws_summary.append([res.get("type", "Unknown type"), res.get("name", "Unknown name")])
+        else:
+            ws_summary.append(["None"])
+        for _ in range(gap):
+            ws_summary.append([])
+
+    if duplicates:
+        ws_summary.append([])
+        ws_summary.append([])
+        ws_summary.append([styled_cell(ws_summary, "Duplicate Resources", "arm_bold")])
+        ws_summary.append(["Side", "Resource Type", "Name", "Definition", "Source", "Compared"])
+        for side, rtype, rname, definition, source, compared in duplicates:
+            ws_summary.append([side.capitalize(), rtype, rname, definition, source or "", "Yes" if compared else "No"])
 
-        cell_4 = ws_summary.cell(row=row, column=4, value=ignored)
-        cell_4.alignment = center_alignment
+    return wb
 
-        cell_5 = ws_summary.cell(row=row, column=5, value=correct)
-        cell_5.alignment = center_alignment
+#
+# Machine-readable output
+#
+# NDJSON and SQLite reports hold the same rows and summary entries as the other
+# formats. Rows are written as each resource is compared, so neither format
+# keeps more than one resource's rows in memory.
+#
+ROW_STATUS = {"X": "different", "": "correct", "Ignored": "ignored"}
 
-        cell_6 = ws_summary.cell(row=row, column=6, value=incorrect)
-        cell_6.alignment = center_alignment
+def json_value(value):
+    """
+    Returns a row value as stored in the machine-readable formats: JSON scalars
+    as they are, ignored subtrees as "{...}" or "[...]" and resolved expressions
+    as their value.
+    """
+    if isinstance(value, IgnoredSubtree):
+        return str(value)
+    return plain_value(value)
 
-        row += 1
+def expression_of(value):
+    """
+    Returns the expression a ResolvedValue was evaluated from, otherwise None.
+    """
+    return value.expression if isinstance(value, ResolvedValue) else None
 
-    row += 1  # blank line
+def resource_record(resource):
+    rtype, rname, total, ignored, correct, incorrect, anchor = resource.summary_entry()
+    right_name, similarity = resource.auto_paired or (None, None)
+    return {"record": "resource", "type": resource.resource_type, "name": resource.resource_name,
+            "rightName": right_name, "similarity": similarity, "total": total, "ignored": ignored,
+            "correct": correct, "incorrect": incorrect, "anchor": anchor}
 
-    # Unmatched resources in left template
-    ws_summary.cell(row=row, column=1, value="Unmatched Resources in Left Template").font = bold_font
-    row += 1
-    if left_dict:
-        ws_summary.cell(row=row, column=1, value="Resource Type")
-        ws_summary.cell(row=row, column=2, value="Name")
-        row += 1
-        for res in left_dict.values():
-            rtype = res.get("type", "Unknown type")
-            rname = res.get("name", "Unknown name")
-            ws_summary.cell(row=row, column=1, value=rtype)
-            ws_summary.cell(row=row, column=2, value=rname)
-            row += 1
-    else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
+def write_ndjson_report(out, resources, ignored_properties, unmatched_left, unmatched_right, changes=None,
+                        duplicates=None):
+    """
+    Writes an NDJSON report to the text file object out: for each resource one
+    "row" record per property row followed by its "resource" summary record, then
+    "unmatched", "duplicate", "ignored" and "change" records and a final "summary" record.
+    Rows with values resolved by --resolve-expressions also have "leftExpression"
+    and "rightExpression".
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    counts = collections.Counter()
+    for resource in resources:
+        for matched, path, left_val, right_val in resource.report_rows:
+            record = {"record": "row", "type": resource.resource_type, "name": resource.resource_name,
+                      "status": ROW_STATUS.get(matched, matched), "path": path,
+                      "left": json_value(left_val), "right": json_value(right_val)}
+            if isinstance(left_val, ResolvedValue) or isinstance(right_val, ResolvedValue):
+                record["leftExpression"] = expression_of(left_val)
+                record["rightExpression"] = expression_of(right_val)
+            out.write(dumps(record))
+            out.write("\n")
+        out.write(dumps(resource_record(resource)))
+        out.write("\n")
+        counts["resources"] += 1
+        counts["resourcesWithDifferences"] += 1 if resource.incorrect else 0
+        counts["incorrect"] += resource.incorrect
+    for side, unmatched in (("left", unmatched_left), ("right", unmatched_right)):
+        for res in unmatched.values():
+            out.write(dumps({"record": "unmatched", "side": side,
+                             "type": res.get("type", "Unknown type"), "name": res.get("name", "Unknown name")}))
+            out.write("\n")
+    for side, rtype, rname, definition, source, compared in duplicates or []:
+        out.write(dumps({"record": "duplicate", "side": side, "type": rtype, "name": rname,
+                         "definition": definition, "source": source, "compared": compared}))
+        out.write("\n")
+    for prop in sorted(ignored_properties):
+        out.write(dumps({"record": "ignored", "path": prop}))
+        out.write("\n")
+    for rtype, rname, change, _anchor in changes or []:
+        out.write(dumps({"record": "change", "type": rtype, "name": rname, "change": change}))
+        out.write("\n")
+    out.write(dumps({"record": "summary", "resources": counts["resources"],
+                     "resourcesWithDifferences": counts["resourcesWithDifferences"],
+                     "incorrect": counts["incorrect"], "unmatchedLeft": len(unmatched_left),
+                     "unmatchedRight": len(unmatched_right), "ignoredProperties": len(ignored_properties),
+                     "duplicateResources": duplicate_resource_count(duplicates or [])}))
+    out.write("\n")
+
+SQLITE_SCHEMA = """
+CREATE TABLE resources (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    right_name TEXT,
+    similarity REAL,
+    total INTEGER NOT NULL,
+    ignored INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    incorrect INTEGER NOT NULL,
+    anchor TEXT NOT NULL
+);
+CREATE TABLE properties (
+    resource_id INTEGER NOT NULL REFERENCES resources(id),
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    left_value,
+    right_value,
+    left_expression TEXT,
+    right_expression TEXT
+);
+CREATE TABLE unmatched (
+    side TEXT NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE duplicates (
+    side TEXT NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    definition INTEGER NOT NULL,
+    source TEXT,
+    compared INTEGER NOT NULL
+);
+CREATE TABLE ignored (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE changes (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    change TEXT NOT NULL
+);
+"""
+
+# Created once the rows are in, which is faster than maintaining them per insert
+SQLITE_INDEXES = """
+CREATE INDEX resources_type_name ON resources (type, name);
+CREATE INDEX properties_resource ON properties (resource_id);
+CREATE INDEX properties_path ON properties (path);
+CREATE INDEX properties_status_path ON properties (status, path);
+CREATE INDEX unmatched_type_name ON unmatched (type, name);
+"""
+
+def write_sqlite_report(output_path, resources, ignored_properties, unmatched_left, unmatched_right,
+                        changes=None, duplicates=None):
+    """
+    Writes the report as a SQLite database with resources, properties, unmatched,
+    duplicates, ignored and changes tables. An existing file at output_path is replaced.
+    """
+    import sqlite3
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    conn = sqlite3.connect(output_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(SQLITE_SCHEMA)
+        with conn:
+            for resource_id, resource in enumerate(resources, start=1):
+                record = resource_record(resource)
+                conn.execute(
+                    "INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (resource_id, record["type"], record["name"], record["rightName"], record["similarity"],
+                     record["total"], record["ignored"], record["correct"], record["incorrect"], record["anchor"]))
+                conn.executemany(
+                    "INSERT INTO properties VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((resource_id, path, ROW_STATUS.get(matched, matched), json_value(left_val), json_value(right_val),
+                      expression_of(left_val), expression_of(right_val))
+                     for matched, path, left_val, right_val in resource.report_rows))
+            conn.executemany(
+                "INSERT INTO unmatched VALUES (?, ?, ?)",
+                [(side, res.get("type", "Unknown type"), res.get("name", "Unknown name"))
+                 for side, unmatched in (("left", unmatched_left), ("right", unmatched_right))
+                 for res in unmatched.values()])
+            conn.executemany("INSERT INTO duplicates VALUES (?, ?, ?, ?, ?, ?)",
+                             [(side, rtype, rname, definition, source, int(compared))
+                              for side, rtype, rname, definition, source, compared in duplicates or []])
+            conn.executemany("INSERT INTO ignored VALUES (?)", [(prop,) for prop in sorted(ignored_properties)])
+            conn.executemany("INSERT INTO changes VALUES (?, ?, ?)",
+                             [(rtype, rname, change) for rtype, rname, change, _anchor in changes or []])
+        conn.executescript(SQLITE_INDEXES)
+    finally:
+        conn.close()
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+# What is left of a comparison once its report has been written
+ReportSummary = collections.namedtuple(
+    "ReportSummary", ["summary_entries", "unmatched_left_count", "unmatched_right_count", "ignored_count",
+                      "duplicate_count"])
+
+def write_report(result, output_path, output_format, shown_rows=None):
+    """
+    Renders a ComparisonResult in the given format ('html', 'html-compact', 'markdown', 'xlsx', 'ndjson'
+    or 'sqlite') and writes it to output_path. shown_rows (see build_row_filter) limits
+    the detail rows written; the summary counts are unchanged.
+    """
+    write_report_file(output_path, output_format, result.resources, result.ignored_properties,
+                      result.unmatched_left, result.unmatched_right, shown_rows=shown_rows,
+                      duplicates=result.duplicates)
 
-    row += 2
+def write_report_file(output_path, output_format, resources, ignored_properties, unmatched_left, unmatched_right,
+                      changes=None, shown_rows=None, timings=NO_TIMINGS, duplicates=None):
+    """
+    Writes a report straight to output_path; resources may be a generator.
+    Returns the summary entries of the resources written. Raises OutputError if
+    output_path cannot be written.
+    """
+    summary_entries = []
 
-    # Unmatched resources in right template
-    ws_summary.cell(row=row, column=1, value="Unmatched Resources in Right Template").font = bold_font
-    row += 1
-    if right_dict:
-        ws_summary.cell(row=row, column=1, value="Resource Type")
-        ws_summary.cell(row=row, column=2, value="Name")
-        row += 1
-        for res in right_dict.values():
-            rtype = res.get("type", "Unknown type")
-            rname = res.get("name", "Unknown name")
-            ws_summary.cell(row=row, column=1, value=rtype)
-            ws_summary.cell(row=row, column=2, value=rname)
-            row += 1
-    else:
-        ws_summary.cell(row=row, column=1, value="None")
-        row += 1
+    def track(resources):
+        for resource in resources:
+            if shown_rows is not None:
+                resource.shown_rows = shown_rows
+            summary_entries.append(resource.summary_entry())
+            yield resource
 
-    #
-    # Details sheet
-    #
-    ws_details = wb.create_sheet("Details")
+    try:
+        if output_format == "xlsx":
+            wb = build_xlsx_workbook(track(resources), ignored_properties, unmatched_left, unmatched_right, changes,
+                                     duplicates)
+            with timings.phase("save"):
+                wb.save(output_path)
+        elif output_format == "sqlite":
+            write_sqlite_report(output_path, track(resources), ignored_properties, unmatched_left, unmatched_right,
+                                changes, duplicates)
+        elif output_format == "html-compact":
+            with open(output_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                write_compact_html_report(f, track(resources), ignored_properties, unmatched_left, unmatched_right,
+                                          changes, duplicates)
+        elif output_format == "ndjson":
+            with open(output_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                write_ndjson_report(f, track(resources), ignored_properties, unmatched_left, unmatched_right,
+                                    changes, duplicates)
+        else:
+            with open(output_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                write_text_report(f, output_format, track(resources), ignored_properties,
+                                  unmatched_left, unmatched_right, changes, duplicates)
+    except OSError as e:
+        # Resources are compared while the report is written, so errors reading
+        # other files (streamed templates, state) pass through unchanged
+        if e.filename not in (None, output_path):
+            raise
+        kind = "XLSX file" if output_format == "xlsx" else "output file"
+        raise OutputError(f"Failed to write {kind} '{output_path}': {e.strerror or e}") from e
+    return summary_entries
+
+def compare_templates_to_file(left_template, right_template, output_path, output_format,
+                              ignore_rules=None, resource_mappings=None, jobs=1, auto_pair=None,
+                              array_keys=None, previous_state=None, state_path=None, shown_rows=None,
+                              resource_filter=None, timings=NO_TIMINGS, comparison_rules=None, resolution=None):
+    """
+    Compares two templates and writes the report as each comparison completes,
+    so no more than one resource's rows are held in memory at a time.
+    ignore_rules may be a list of patterns or a compiled IgnoreMatcher.
+    If previous_state names a state file from an earlier run, only resource pairs
+    that changed since then are compared again and the report lists the changes.
+    If state_path is given, the state of this run is written there.
+    shown_rows (see build_row_filter) limits the detail rows written, and
+    resource_filter, a ResourceFilter, the resources compared.
+    timings, a Timings, records the phases and the slowest resource pairs.
+    comparison_rules is the comparisonRules config (or compiled ComparisonRules).
+    Types and names defined more than once on a side are listed in the report.
+    resolution (see Comparer.resolution) is recorded in the state, so that rows
+    compared with other expression settings are not reused.
+    Returns a ReportSummary.
+    """
+    with timings.phase("config"):
+        ignore_matcher = build_ignore_matcher(ignore_rules)
+        array_keys = build_array_keys(array_keys)
+        comparison_rules = build_comparison_rules(comparison_rules)
+    duplicates = []
+    resource_pairs, unmatched_left, unmatched_right, auto_pairs = pair_templates(
+        left_template, right_template, resource_mappings, ignore_matcher, auto_pair, resource_filter, timings,
+        duplicates)
+    ignored_properties = set()
+    changes = None
+    if previous_state or state_path:
+        from .state import iter_incremental_comparisons, open_previous_state
+        previous = None
+        if previous_state:
+            previous = open_previous_state(previous_state, resource_pairs, ignore_matcher, array_keys,
+                                           comparison_rules, resolution)
+        changes = [] if previous else None
+        comparisons = iter_incremental_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs,
+                                                   array_keys, previous, state_path, changes, comparison_rules,
+                                                   resolution, shown_rows)
+    else:
+        comparisons = iter_resource_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs,
+                                                output_format, array_keys, shown_rows, comparison_rules)
+    resources = mark_auto_paired(timings.iter_comparisons(comparisons), auto_pairs)
+    with timings.phase("render"):
+        summary_entries = write_report_file(output_path, output_format, resources, ignored_properties,
+                                            unmatched_left, unmatched_right, changes, shown_rows, timings,
+                                            duplicates)
+    return ReportSummary(summary_entries, len(unmatched_left), len(unmatched_right), len(ignored_properties),
+                         duplicate_resource_count(duplicates))
 
-    # Header
-    ws_details.cell(row=1, column=1, value="Resource Type").font = bold_font
-    ws_details.cell(row=1, column=2, value="Name").font = bold_font
-    
-    match_header = ws_details.cell(row=1, column=3)
-    match_header.value = "Matched"
-    match_header.font = bold_font
-    match_header.alignment = center_alignment
-
-    ws_details.cell(row=1, column=4, value="Property Path").font = bold_font
-    ws_details.cell(row=1, column=5, value="Left Value").font = bold_font
-    ws_details.cell(row=1, column=6, value="Right Value").font = bold_font
-
-    # Formatting
-    ws_details.column_dimensions['A'].width = 64
-    ws_details.column_dimensions['B'].width = 32
-    ws_details.column_dimensions['C'].width = 12
-    ws_details.column_dimensions['D'].width = 64
-    ws_details.column_dimensions['E'].width = 32
-    ws_details.column_dimensions['F'].width = 32
-
-    details_row = 2
-    for (rtype, rname, comparisons) in detailed_data:
-        for comp in comparisons:
-            matched, prop_path, left_val, right_val = comp
-
-            # Determine the fill based on 'matched' value
-            if matched == "Ignored":
-                row_fill = orange_fill
-            elif matched == "X":
-                row_fill = red_fill
-            else:  # assume matched == "" for "correct"
-                row_fill = green_fill
-                
-            # Write row
-            ws_details.cell(row=details_row, column=1, value=rtype)
-            ws_details.cell(row=details_row, column=2, value=rname)
-
-            # Center the matched column
-            matched_cell = ws_details.cell(row=details_row, column=3)
-            matched_cell.value = matched
-            matched_cell.alignment = center_alignment
-
-            ws_details.cell(row=details_row, column=4, value=prop_path)
-            ws_details.cell(row=details_row, column=5, value=str(left_val))
-            ws_details.cell(row=details_row, column=6, value=str(right_val))
-
-            # Apply the same fill to every cell in the row
-            for col in range(1, 7):
-                ws_details.cell(row=details_row, column=col).fill = row_fill
+#
+# Library API
+#
+class Comparer:
+    """
+    Compares templates with one compiled configuration.
 
-            details_row += 1
+    The ignore rules, resource mappings, array keys and comparison rules are
+    compiled once, when the Comparer is built, and shared by every comparison it
+    runs; their caches are bounded, so a Comparer can be kept for the life of a
+    process. Templates
+    may be parsed dicts or paths to template files. Errors are raised as
+    ArmCompareError (or the original exception) rather than ending the process.
 
-    # Auto-fit column widths (roughly)
-    for sheet in [ws_summary, ws_details]:
-        for col in range(1, sheet.max_column + 1):
-            sheet.column_dimensions[get_column_letter(col)].auto_size = True
+        comparer = Comparer.from_config("config.yaml")
+        result = comparer.compare("dev.json", "prd.json")
+        comparer.compare_to_file(left_dict, right_dict, "report.html")
 
-    return wb
+    With resolve_expressions, or when a side's parameters are given, template
+    expressions are resolved before the resources are paired (see resolve_template).
+    """
+    def __init__(self, ignore_rules=None, resource_mappings=None, array_keys=None, auto_pair=None, jobs=1,
+                 stream=False, cache=None, resolve_expressions=False, comparison_rules=None):
+        if auto_pair is not None and not 0 < auto_pair <= 1:
+            raise ConfigError("auto_pair must be greater than 0 and at most 1")
+        self.ignore_matcher = build_ignore_matcher(ignore_rules)
+        self.mapping_index = build_mapping_index(resource_mappings)
+        self.array_keys = build_array_keys(array_keys)
+        self.comparison_rules = build_comparison_rules(comparison_rules)
+        self.auto_pair = auto_pair
+        self.jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+        self.stream = stream
+        self.cache = cache
+        self.resolve_expressions = resolve_expressions
+
+    @classmethod
+    def from_config(cls, config=None, **options):
+        """
+        Builds a Comparer from a config dict or YAML file with the ignoreRules,
+        resourceMappings, arrayKeys and comparisonRules keys. options are passed to the constructor.
+        """
+        config = load_config(config)
+        return cls(config.get('ignoreRules', []), config.get('resourceMappings', []), config.get('arrayKeys', {}),
+                   comparison_rules=config.get('comparisonRules', []), **options)
+
+    def load(self, template):
+        """
+        Returns a template dict as it is, or loads the template file, directory or
+        glob at a path (indexed, with stream set).
+        """
+        if isinstance(template, dict):
+            return template
+        if isinstance(template, (str, os.PathLike)):
+            return load_templates(os.fspath(template), self.stream, self.cache)
+        raise TemplateError(f"Expected a template dict or a file path, not {type(template).__name__}.")
+
+    def prepare(self, left, right, left_parameters=None, right_parameters=None, timings=NO_TIMINGS):
+        """
+        Loads both templates and, if resolve_expressions is set or a side's parameters
+        (a parameters file path or dict) are given, resolves their expressions.
+        Returns (left_template, right_template).
+        """
+        left = self.load(left)
+        right = self.load(right)
+        if not self.resolves(left_parameters, right_parameters):
+            return left, right
+        from .expressions import resolve_template
+        with timings.phase("resolve"):
+            return resolve_template(left, left_parameters), resolve_template(right, right_parameters)
+
+    def resolves(self, left_parameters=None, right_parameters=None):
+        return self.resolve_expressions or left_parameters is not None or right_parameters is not None
+
+    def resolution(self, left_parameters=None, right_parameters=None):
+        """
+        Returns None if expressions are not resolved, otherwise a digest of the
+        parameter values of both sides, for the state file's settings.
+        """
+        if not self.resolves(left_parameters, right_parameters):
+            return None
+        from .expressions import load_parameter_values
+        return json_digest([load_parameter_values(left_parameters), load_parameter_values(right_parameters)])
+
+    def compare(self, left, right, resource_filter=None, left_parameters=None, right_parameters=None):
+        """
+        Compares two templates (dicts or paths) and returns a ComparisonResult.
+        """
+        left, right = self.prepare(left, right, left_parameters, right_parameters)
+        return compare_templates(left, right, self.ignore_matcher, self.mapping_index, self.jobs, self.auto_pair,
+                                 self.array_keys, resource_filter, self.comparison_rules)
+
+    def compare_to_file(self, left, right, output_path, output_format="html", previous_state=None,
+                        state_path=None, shown_rows=None, resource_filter=None, timings=NO_TIMINGS,
+                        left_parameters=None, right_parameters=None):
+        """
+        Compares two templates (dicts or paths) and writes the report to output_path
+        as each comparison completes (see compare_templates_to_file). Returns a ReportSummary.
+        """
+        left, right = self.prepare(left, right, left_parameters, right_parameters, timings)
+        resolution = self.resolution(left_parameters, right_parameters) if previous_state or state_path else None
+        return compare_templates_to_file(left, right, output_path, output_format,
+                                         self.ignore_matcher, self.mapping_index, self.jobs, self.auto_pair,
+                                         self.array_keys, previous_state, state_path, shown_rows,
+                                         resource_filter, timings, self.comparison_rules, resolution)
+
+def build_template_cache(args):
+    if not args.cache_dir:
+        return None
+    return TemplateCache(args.cache_dir, args.cache_size << 20)
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        from .server import serve_main
+        serve_main(sys.argv[2:])
+        return
     args = parse_arguments()
+    try:
+        run_with_instrumentation(args)
+    except ArmCompareError as e:
+        exit_with_error(f"Error: {e}")
+
+def run_with_instrumentation(args):
+    """
+    Runs the command line, under cProfile with --profile and timed with --timings.
+    """
+    timings = NO_TIMINGS
+    if args.timings:
+        from .timings import Timings
+        timings = Timings()
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, args, timings)
+        finally:
+            profiler.dump_stats(args.profile)
+            sys.stderr.write(f"Profile written to '{args.profile}' (view it with: python -m pstats {args.profile})\n")
+    else:
+        run(args, timings)
+    if timings:
+        timings.write(args.timings)
 
-    if not os.path.exists(args.left):
+def run(args, timings=NO_TIMINGS):
+    """
+    Runs the comparison (or batch) described by the parsed command line arguments.
+    """
+    if args.batch:
+        from .batch import run_batch
+        with timings.phase("batch"):
+            run_batch(args.batch, args.output, args.config, args.jobs, args.stream, args.auto_pair,
+                      build_template_cache(args), build_row_filter(args.only_differences, args.keep_ignored),
+                      build_resource_filter(args.resource_type, args.resource_name), args.resolve_expressions)
+        return
+
+    if not os.path.exists(args.left) and not is_template_glob(args.left):
         exit_with_error(f"Error: Left file '{args.left}' does not exist.")
-    if not os.path.exists(args.right):
+    if not os.path.exists(args.right) and not is_template_glob(args.right):
         exit_with_error(f"Error: Right file '{args.right}' does not exist.")
+    if args.previous and not os.path.exists(args.previous):
+        exit_with_error(f"Error: Previous state file '{args.previous}' does not exist.")
     if args.config and not os.path.exists(args.config):
         exit_with_error(f"Error: Config file '{args.config}' does not exist.")
-
-    left_template = load_json_file(args.left)
-    right_template = load_json_file(args.right)
-
-    config = {}
-    ignore_rules = []
-    resource_mappings = []
-    if args.config:
-        config = load_yaml_file(args.config)
-        ignore_rules = config.get('ignoreRules', [])
-        resource_mappings = config.get('resourceMappings', [])
-    
-    if "dependsOn" not in ignore_rules:
-        ignore_rules.append("dependsOn")
-
-    ignored_properties = set()
-
-    left_resources = left_template.get("resources", [])
-    right_resources = right_template.get("resources", [])
-
-    def get_key(resource):
-        return (resource.get("type"), resource.get("name"))
-    
-    left_dict = {get_key(res): res for res in left_resources if res.get("type") and res.get("name")}
-    right_dict = {get_key(res): res for res in right_resources if res.get("type") and res.get("name")}
-
-    resource_pairs = []
-    summary_entries = []
-
-    # Enhanced partial mapping based on prefixes
-    for mapping in resource_mappings:
-        left_prefix_type = mapping.get("leftResourceType")
-        left_prefix_name = mapping.get("leftResourceName")
-        right_prefix_type = mapping.get("rightResourceType")
-        right_prefix_name = mapping.get("rightResourceName")
-        
-        for key in list(left_dict.keys()):
-            ltype, lname = key
-            if ltype.startswith(left_prefix_type) and lname.startswith(left_prefix_name):
-                type_remainder = ltype[len(left_prefix_type):]
-                name_remainder = lname[len(left_prefix_name):]
-                candidate_right_type = right_prefix_type + type_remainder
-                candidate_right_name = right_prefix_name + name_remainder
-                candidate_key = (candidate_right_type, candidate_right_name)
-                if candidate_key in right_dict:
-                    resource_pairs.append((left_dict[key], right_dict[candidate_key]))
-                    del left_dict[key]
-                    del right_dict[candidate_key]
-
-    for key in list(left_dict.keys()):
-        if key in right_dict:
-            resource_pairs.append((left_dict[key], right_dict[key]))
-            del left_dict[key]
-            del right_dict[key]
-
-    # We'll collect the structured detail data for xlsx
-    detailed_data = []
-
-    detailed_sections = []
-    for left_res, right_res in resource_pairs:
-        resource_type = left_res.get("type", "Unknown type")
-        resource_name = left_res.get("name", "Unknown name")
-        resource_key_display = f"{resource_type} / {resource_name}"
-        anchor = generate_anchor(resource_type, resource_name)
-
-        # If the entire resource type is ignored by some rule, skip it
-        if ignore_rules and any(fnmatch.fnmatch(resource_type, pattern) for pattern in ignore_rules):
-            continue
-
-        left_flat = flatten_json(left_res)
-        right_flat = flatten_json(right_res)
-        
-        total = 0
-        correct = 0
-        incorrect = 0
-        ignored_count = 0
-        all_keys = set(left_flat.keys()).union(set(right_flat.keys()))
-
-        # We'll also collect detail rows for xlsx
-        comparison_rows = []
-
-        for key in sorted(all_keys):
-            is_ignored = ignore_rules and any(fnmatch.fnmatch(key, pattern) for pattern in ignore_rules)
-            left_val = left_flat.get(key, '')
-            right_val = right_flat.get(key, '')
-
-            total += 1
-            if is_ignored:
-                ignored_count += 1
-                matched = "Ignored"
-                ignored_properties.add(key)
-            else:
-                if left_val == right_val:
-                    correct += 1
-                    matched = ""
-                else:
-                    incorrect += 1
-                    matched = "X"
-
-            # For xlsx detail
-            comparison_rows.append((matched, key, left_val, right_val))
-
-        summary_entries.append((resource_type, resource_name, total, ignored_count, correct, incorrect, anchor))
-
-        # Store the detail for xlsx
-        detailed_data.append((resource_type, resource_name, comparison_rows))
-
-        # Also build up the "detailed_section" string for HTML/Markdown
-        detailed_section = f'<a id="{anchor}"></a>\n'
-        if args.format == "html":
-            detailed_section += generate_html_table(resource_key_display, left_flat, right_flat, ignore_rules, ignored_properties)
-        else:
-            # For markdown we do:
-            detailed_section += generate_markdown_table(resource_key_display, left_flat, right_flat, ignore_rules, ignored_properties)
-        detailed_sections.append(detailed_section)
-        detailed_sections.append("\n")
-
-    if args.format == "html":
-        final_output = generate_html_output(summary_entries, ignored_properties, left_dict, right_dict, detailed_sections)
-        try:
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(final_output)
-        except Exception as e:
-            exit_with_error(f"Error: Failed to write output file '{args.output}': {e}")
-
-    elif args.format == "markdown":
-        final_output = "\n".join([
-            generate_markdown_summary(summary_entries, ignored_properties, left_dict, right_dict),
-            "---"
-        ] + detailed_sections)
-        try:
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(final_output)
-        except Exception as e:
-            exit_with_error(f"Error: Failed to write output file '{args.output}': {e}")
-
-    # New XLSX output handling
-    else:  # args.format == "xlsx"
-        wb = generate_xlsx_output(summary_entries, ignored_properties, left_dict, right_dict, detailed_data)
-        try:
-            wb.save(args.output)
-        except Exception as e:
-            exit_with_error(f"Error: Failed to write XLSX file '{args.output}': {e}")
+    for parameters in (args.left_parameters, args.right_parameters):
+        if parameters and not os.path.exists(parameters):
+            exit_with_error(f"Error: Parameters file '{parameters}' does not exist.")
+
+    with timings.phase("config"):
+        comparer = Comparer.from_config(args.config, auto_pair=args.auto_pair, jobs=args.jobs, stream=args.stream,
+                                        cache=build_template_cache(args),
+                                        resolve_expressions=args.resolve_expressions)
+    with timings.phase("load left"):
+        left_template = comparer.load(args.left)
+    with timings.phase("load right"):
+        right_template = comparer.load(args.right)
+
+    comparer.compare_to_file(left_template, right_template, args.output, args.format, args.previous, args.state,
+                             build_row_filter(args.only_differences, args.keep_ignored),
+                             build_resource_filter(args.resource_type, args.resource_name), timings,
+                             args.left_parameters, args.right_parameters)
 
 if __name__ == '__main__':
     main()
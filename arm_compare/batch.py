@@ -0,0 +1,217 @@
+"""
+Batch mode: run many left/right comparisons from one manifest in a single process.
+
+The manifest is YAML or JSON:
+
+    config: config.yaml          # optional, shared by every comparison
+    index: reports/index.html    # optional roll-up report (.md for Markdown)
+    comparisons:
+      - left: dev/rg-app.json
+        right: prd/rg-app.json
+        output: reports/rg-app.html
+        format: html             # optional: html (default), html-compact, markdown, xlsx, ndjson or sqlite
+        leftParameters: dev/rg-app.parameters.json    # optional parameters files; they imply
+        rightParameters: prd/rg-app.parameters.json   # resolving the templates' expressions
+
+Relative paths are resolved against the manifest's directory. The ignore rules
+and resource mappings are compiled once and shared by every comparison.
+"""
+import concurrent.futures
+import os
+
+from .arm_compare import (
+    Comparer,
+    OUTPUT_FORMATS,
+    ConfigError,
+    OutputError,
+    TemplateError,
+    is_template_glob,
+    load_config,
+    load_json_file,
+    load_yaml_file,
+)
+
+def load_manifest(filepath):
+    """
+    Loads a batch manifest and returns (config_path, index_path, comparisons) with
+    every path resolved against the manifest's directory.
+    """
+    if filepath.lower().endswith(".json"):
+        manifest = load_json_file(filepath)
+    else:
+        manifest = load_yaml_file(filepath)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("comparisons"), list):
+        raise ConfigError(f"Batch manifest '{filepath}' must contain a 'comparisons' list.")
+
+    base_dir = os.path.dirname(os.path.abspath(filepath))
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+    comparisons = []
+    for i, entry in enumerate(manifest["comparisons"], start=1):
+        missing = [key for key in ("left", "right", "output") if not entry.get(key)]
+        if missing:
+            raise ConfigError(f"Comparison {i} in '{filepath}' is missing: {', '.join(missing)}")
+        output_format = entry.get("format", "html")
+        if output_format not in OUTPUT_FORMATS:
+            raise ConfigError(f"Comparison {i} in '{filepath}' has an unknown format '{output_format}'.")
+        comparisons.append({
+            "left": resolve(entry["left"]),
+            "right": resolve(entry["right"]),
+            "output": resolve(entry["output"]),
+            "format": output_format,
+            "leftParameters": resolve(entry["leftParameters"]) if entry.get("leftParameters") else None,
+            "rightParameters": resolve(entry["rightParameters"]) if entry.get("rightParameters") else None,
+        })
+
+    config_path = resolve(manifest["config"]) if manifest.get("config") else None
+    index_path = resolve(manifest.get("index", "index.html"))
+    return config_path, index_path, comparisons
+
+def run_comparison(comparison, comparer, shown_rows=None, resource_filter=None):
+    """
+    Runs one manifest comparison with a Comparer and returns its row for the index report:
+    (comparison, resources, resources_with_differences, incorrect, unmatched_left, unmatched_right).
+    """
+    for side in ("left", "right"):
+        if not os.path.exists(comparison[side]) and not is_template_glob(comparison[side]):
+            raise TemplateError(f"{side.capitalize()} file '{comparison[side]}' does not exist.")
+    left_template = comparer.load(comparison["left"])
+    right_template = comparer.load(comparison["right"])
+
+    output_dir = os.path.dirname(comparison["output"])
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    report = comparer.compare_to_file(left_template, right_template, comparison["output"], comparison["format"],
+                                      shown_rows=shown_rows, resource_filter=resource_filter,
+                                      left_parameters=comparison["leftParameters"],
+                                      right_parameters=comparison["rightParameters"])
+
+    incorrect = sum(entry[5] for entry in report.summary_entries)
+    with_differences = sum(1 for entry in report.summary_entries if entry[5])
+    return (comparison, len(report.summary_entries), with_differences, incorrect,
+            report.unmatched_left_count, report.unmatched_right_count)
+
+#
+# Parallel batches: each worker process builds one Comparer in its initializer
+# and reuses it for every comparison it runs.
+#
+_worker_state = None
+
+def _init_batch_worker(config, stream, auto_pair, cache, shown_rows, resource_filter, resolve_expressions):
+    global _worker_state
+    _worker_state = (Comparer.from_config(config, auto_pair=auto_pair, stream=stream, cache=cache,
+                                          resolve_expressions=resolve_expressions),
+                     shown_rows, resource_filter)
+
+def _run_comparison_in_worker(comparison):
+    return run_comparison(comparison, *_worker_state)
+
+def generate_index_html(rows, index_path):
+    """
+    Generates the roll-up HTML report linking to every per-comparison report.
+    """
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    html = []
+    html.append("<html>")
+    html.append("<head>")
+    html.append("<meta charset='UTF-8'>")
+    html.append("<title>Comparison Index</title>")
+    html.append("<style>")
+    html.append("table { width: 100%; max-width: 100%; border-collapse: collapse; }")
+    html.append("th, td { border: 1px solid #000; padding: 4px; overflow-wrap: break-word; word-wrap: break-word; }")
+    html.append("</style>")
+    html.append("</head>")
+    html.append("<body>")
+    html.append("<h1>Comparison Index</h1>")
+    html.append("<table>")
+    html.append("<thead>")
+    html.append("<tr><th>Left</th><th>Right</th><th>Report</th><th>Resources Compared</th>"
+                "<th>Resources With Differences</th><th>Incorrect Properties</th>"
+                "<th>Unmatched Left</th><th>Unmatched Right</th></tr>")
+    html.append("</thead>")
+    html.append("<tbody>")
+    for comparison, resources, with_differences, incorrect, unmatched_left, unmatched_right in rows:
+        link = os.path.relpath(comparison["output"], index_dir).replace(os.sep, "/")
+        html.append(
+            f"<tr>"
+            f"<td>{os.path.basename(comparison['left'])}</td>"
+            f"<td>{os.path.basename(comparison['right'])}</td>"
+            f"<td><a href='{link}'>{link}</a></td>"
+            f"<td>{resources}</td>"
+            f"<td>{with_differences}</td>"
+            f"<td>{incorrect}</td>"
+            f"<td>{unmatched_left}</td>"
+            f"<td>{unmatched_right}</td>"
+            f"</tr>"
+        )
+    html.append("</tbody>")
+    html.append("</table>")
+    html.append("</body>")
+    html.append("</html>")
+    return "\n".join(html)
+
+def generate_index_markdown(rows, index_path):
+    """
+    Generates the roll-up Markdown report linking to every per-comparison report.
+    """
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    lines = []
+    lines.append("# Comparison Index\n")
+    lines.append("| Left | Right | Report | Resources Compared | Resources With Differences | "
+                 "Incorrect Properties | Unmatched Left | Unmatched Right |")
+    lines.append("| --- | --- | --- | --- | --- | --- | --- | --- |")
+    for comparison, resources, with_differences, incorrect, unmatched_left, unmatched_right in rows:
+        link = os.path.relpath(comparison["output"], index_dir).replace(os.sep, "/")
+        lines.append(
+            f"| {os.path.basename(comparison['left'])} | {os.path.basename(comparison['right'])} | "
+            f"[{link}]({link}) | {resources} | {with_differences} | {incorrect} | "
+            f"{unmatched_left} | {unmatched_right} |"
+        )
+    return "\n".join(lines)
+
+def run_batch(manifest_path, index_path=None, config_path=None, jobs=1, stream=False, auto_pair=None, cache=None,
+              shown_rows=None, resource_filter=None, resolve_expressions=False):
+    """
+    Runs every comparison in a batch manifest and writes the roll-up index report.
+    index_path and config_path override the manifest's own settings.
+    With jobs > 1 the comparisons are spread across a process pool.
+    auto_pair is the optional --auto-pair similarity threshold for every comparison.
+    cache is an optional TemplateCache, so with stream a template shared by several
+    comparisons is only indexed once. shown_rows and resource_filter apply to every comparison
+    (see compare_templates_to_file), and resolve_expressions resolves the template
+    expressions of every comparison (see Comparer).
+    """
+    if not os.path.exists(manifest_path):
+        raise ConfigError(f"Batch manifest '{manifest_path}' does not exist.")
+    manifest_config, manifest_index, comparisons = load_manifest(manifest_path)
+    config_path = config_path or manifest_config
+    index_path = index_path or manifest_index
+    config = load_config(config_path)
+
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    if jobs > 1 and len(comparisons) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(comparisons)),
+                                                    initializer=_init_batch_worker,
+                                                    initargs=(config, stream, auto_pair, cache, shown_rows,
+                                                              resource_filter, resolve_expressions)) as executor:
+            rows = list(executor.map(_run_comparison_in_worker, comparisons))
+    else:
+        comparer = Comparer.from_config(config, auto_pair=auto_pair, stream=stream, cache=cache,
+                                        resolve_expressions=resolve_expressions)
+        rows = [run_comparison(comparison, comparer, shown_rows, resource_filter) for comparison in comparisons]
+
+    if index_path.lower().endswith(".md"):
+        index = generate_index_markdown(rows, index_path)
+    else:
+        index = generate_index_html(rows, index_path)
+    index_dir = os.path.dirname(index_path)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+    try:
+        with open(index_path, 'w', encoding='utf-8') as f:
+            f.write(index)
+    except OSError as e:
+        raise OutputError(f"Failed to write index file '{index_path}': {e.strerror or e}") from e
+    return rows
@@ -0,0 +1,503 @@
+"""
+ARM template expressions for --resolve-expressions.
+
+String values of the form "[...]" are template expressions. A TemplateEvaluator
+evaluates them with the template's own parameters and variables sections and,
+optionally, the values of a parameters file, so that two environments that are
+the same apart from how their values are written compare as equal:
+
+    "[parameters('location')]"                                  -> "westeurope"
+    "[resourceId('Microsoft.Storage/storageAccounts', 'st001')]"
+        -> "/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/..."
+
+A resolved scalar is kept as a ResolvedValue, which compares as its value and is
+shown in the report together with the expression it came from. Expressions that
+depend on the deployment (reference(), listKeys(), uniqueString(), ...) or use a
+function the evaluator does not know are left as they are. subscription() and
+resourceGroup() resolve to placeholders, since a template does not say where it
+is deployed.
+
+The same expressions repeat across the resources of an export, so parsed
+expressions are cached for the process and each evaluator memoizes its results
+per expression string.
+"""
+import functools
+import json
+import re
+
+from .arm_compare import (
+    ArmCompareError,
+    ResolvedValue,
+    ResourceRef,
+    expand_nested_resources,
+    is_template_expression,
+    json_digest,
+    load_json_file,
+    resource_source,
+    with_source,
+)
+
+SUBSCRIPTION_ID = "{subscriptionId}"
+RESOURCE_GROUP_NAME = "{resourceGroupName}"
+RESOURCE_GROUP_LOCATION = "{resourceGroupLocation}"
+TENANT_ID = "{tenantId}"
+
+PARSE_CACHE_SIZE = 1 << 14
+
+
+class Unresolved(Exception):
+    """
+    Raised while evaluating an expression that cannot be resolved from the template alone.
+    """
+
+
+#
+# Parsing
+#
+# An expression is parsed into nested tuples: ("literal", value),
+# ("call", function_name, [arguments]), ("property", node, name) and
+# ("index", node, index_node).
+#
+TOKEN_RE = re.compile(r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?)"
+                      r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<punct>[(),.\[\]]))")
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if match is None:
+            raise Unresolved(f"Unexpected character at {pos} in '{text}'")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        elif kind == "number":
+            value = float(value) if "." in value else int(value)
+        tokens.append((kind, value))
+    return tokens
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_expression(expression):
+    """
+    Parses an expression string (with its enclosing brackets) into its tuple form.
+    """
+    tokens = tokenize(expression[1:-1])
+    node, pos = _parse(tokens, 0)
+    if pos != len(tokens):
+        raise Unresolved(f"Unexpected '{tokens[pos][1]}' in '{expression}'")
+    return node
+
+def _expect(tokens, pos, punct):
+    if pos >= len(tokens) or tokens[pos] != ("punct", punct):
+        raise Unresolved(f"Expected '{punct}'")
+    return pos + 1
+
+def _parse(tokens, pos):
+    if pos >= len(tokens):
+        raise Unresolved("Unexpected end of expression")
+    kind, value = tokens[pos]
+    pos += 1
+    if kind in ("string", "number"):
+        node = ("literal", value)
+    elif kind == "name":
+        pos = _expect(tokens, pos, "(")
+        arguments = []
+        if tokens[pos:pos + 1] != [("punct", ")")]:
+            while True:
+                argument, pos = _parse(tokens, pos)
+                arguments.append(argument)
+                if tokens[pos:pos + 1] != [("punct", ",")]:
+                    break
+                pos += 1
+        pos = _expect(tokens, pos, ")")
+        node = ("call", value.lower(), arguments)
+    else:
+        raise Unresolved(f"Unexpected '{value}'")
+    while pos < len(tokens) and tokens[pos] in (("punct", "."), ("punct", "[")):
+        if tokens[pos][1] == ".":
+            if pos + 1 >= len(tokens) or tokens[pos + 1][0] != "name":
+                raise Unresolved("Expected a property name")
+            node = ("property", node, tokens[pos + 1][1])
+            pos += 2
+        else:
+            index, pos = _parse(tokens, pos + 1)
+            pos = _expect(tokens, pos, "]")
+            node = ("index", node, index)
+    return node, pos
+
+#
+# Functions
+#
+# Each function takes the evaluated arguments. Functions that need the
+# evaluator (parameters, variables) are methods of TemplateEvaluator.
+#
+def _string(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "True" if value else "False"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+def _concat(*args):
+    if args and all(isinstance(arg, list) for arg in args):
+        return [item for arg in args for item in arg]
+    return "".join(_string(arg) for arg in args)
+
+def _format(template, *args):
+    def replace(match):
+        if match.group(2):
+            raise Unresolved("format() with format specifiers")
+        return _string(args[int(match.group(1))])
+    return re.sub(r"\{(\d+)(:[^}]*)?\}", replace, template)
+
+def _split_resource_type(resource_type, names):
+    """
+    Returns the "/providers/..." part of a resource ID for a resource type and its names.
+    """
+    if not isinstance(resource_type, str) or "/" not in resource_type:
+        raise Unresolved(f"Not a resource type: {resource_type!r}")
+    namespace, *types = resource_type.split("/")
+    if len(types) != len(names):
+        raise Unresolved(f"{resource_type} needs {len(types)} name segments")
+    parts = [f"/providers/{namespace}"]
+    for rtype, name in zip(types, names):
+        parts.append(f"/{rtype}/{_string(name)}")
+    return "".join(parts)
+
+def _type_position(args):
+    for position, arg in enumerate(args):
+        if isinstance(arg, str) and "/" in arg and "." in arg.split("/", 1)[0]:
+            return position
+    raise Unresolved("resourceId() without a resource type")
+
+def _resource_id(*args):
+    position = _type_position(args)
+    scope = list(args[:position])
+    subscription_id = scope[0] if len(scope) == 2 else SUBSCRIPTION_ID
+    resource_group = scope[-1] if scope else RESOURCE_GROUP_NAME
+    return (f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+            + _split_resource_type(args[position], args[position + 1:]))
+
+def _subscription_resource_id(*args):
+    position = _type_position(args)
+    subscription_id = args[0] if position == 1 else SUBSCRIPTION_ID
+    return f"/subscriptions/{subscription_id}" + _split_resource_type(args[position], args[position + 1:])
+
+def _tenant_resource_id(resource_type, *names):
+    return _split_resource_type(resource_type, names)
+
+def _union(*args):
+    if all(isinstance(arg, dict) for arg in args):
+        merged = {}
+        for arg in args:
+            merged.update(arg)
+        return merged
+    if all(isinstance(arg, list) for arg in args):
+        merged = []
+        for arg in args:
+            merged.extend(item for item in arg if item not in merged)
+        return merged
+    raise Unresolved("union() of mixed types")
+
+def _json(value):
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        raise Unresolved(f"json(): {e}") from e
+
+def _coalesce(*args):
+    return next((arg for arg in args if arg is not None), None)
+
+def _contains(container, item):
+    if isinstance(container, str):
+        return _string(item).lower() in container.lower()
+    return item in container
+
+def _div(a, b):
+    if b == 0:
+        raise Unresolved("div() by zero")
+    return int(a / b)
+
+def _mod(a, b):
+    if b == 0:
+        raise Unresolved("mod() by zero")
+    return int(a - b * int(a / b))
+
+def _subscription():
+    return {"id": f"/subscriptions/{SUBSCRIPTION_ID}", "subscriptionId": SUBSCRIPTION_ID, "tenantId": TENANT_ID}
+
+def _resource_group():
+    return {"id": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP_NAME}",
+            "name": RESOURCE_GROUP_NAME, "location": RESOURCE_GROUP_LOCATION}
+
+FUNCTIONS = {
+    "add": lambda a, b: a + b,
+    "and": lambda *args: all(args),
+    "bool": lambda value: value.lower() == "true" if isinstance(value, str) else bool(value),
+    "coalesce": _coalesce,
+    "concat": _concat,
+    "contains": _contains,
+    "createarray": lambda *args: list(args),
+    "createobject": lambda *args: dict(zip(args[::2], args[1::2])),
+    "div": _div,
+    "empty": lambda value: value is None or len(value) == 0,
+    "endswith": lambda value, suffix: value.lower().endswith(suffix.lower()),
+    "equals": lambda a, b: a == b,
+    "false": lambda: False,
+    "first": lambda value: value[0],
+    "format": _format,
+    "greater": lambda a, b: a > b,
+    "greaterorequals": lambda a, b: a >= b,
+    "if": lambda condition, true_value, false_value: true_value if condition else false_value,
+    "indexof": lambda value, item: value.lower().find(item.lower()),
+    "int": int,
+    "json": _json,
+    "last": lambda value: value[-1],
+    "lastindexof": lambda value, item: value.lower().rfind(item.lower()),
+    "length": len,
+    "less": lambda a, b: a < b,
+    "lessorequals": lambda a, b: a <= b,
+    "max": lambda *args: max(args[0] if len(args) == 1 else args),
+    "min": lambda *args: min(args[0] if len(args) == 1 else args),
+    "mod": _mod,
+    "mul": lambda a, b: a * b,
+    "not": lambda value: not value,
+    "null": lambda: None,
+    "or": lambda *args: any(args),
+    "padleft": lambda value, width, char=" ": _string(value).rjust(width, char),
+    "replace": lambda value, old, new: value.replace(old, new),
+    "resourcegroup": _resource_group,
+    "resourceid": _resource_id,
+    "skip": lambda value, count: value[max(count, 0):],
+    "split": lambda value, delimiter: value.split(delimiter),
+    "startswith": lambda value, prefix: value.lower().startswith(prefix.lower()),
+    "string": _string,
+    "sub": lambda a, b: a - b,
+    "subscription": _subscription,
+    "subscriptionresourceid": _subscription_resource_id,
+    "substring": lambda value, start, length=None: value[start:] if length is None else value[start:start + length],
+    "take": lambda value, count: value[:max(count, 0)],
+    "tenantresourceid": _tenant_resource_id,
+    "tolower": lambda value: value.lower(),
+    "toupper": lambda value: value.upper(),
+    "trim": lambda value: value.strip(),
+    "true": lambda: True,
+    "union": _union,
+}
+
+#
+# Evaluation
+#
+def load_parameter_values(parameters):
+    """
+    Returns the parameter values as a dict of name -> value. parameters may be None,
+    a parameters file ({"parameters": {"name": {"value": ...}}}, as a dict or a path)
+    or a plain dict of name -> value. Key Vault references are left out.
+    """
+    if parameters is None:
+        return {}
+    if isinstance(parameters, str):
+        parameters = load_json_file(parameters)
+    if not isinstance(parameters, dict):
+        raise ArmCompareError("Parameters must be a parameters file or a mapping of names to values.")
+    if isinstance(parameters.get("parameters"), dict):
+        return {name: entry["value"] for name, entry in parameters["parameters"].items()
+                if isinstance(entry, dict) and "value" in entry}
+    return dict(parameters)
+
+
+class TemplateEvaluator:
+    """
+    Evaluates the expressions of one template. Parameters take their value from
+    parameter_values, or else their defaultValue; variables are evaluated on first
+    use. Results are memoized per expression string.
+    """
+    def __init__(self, template, parameter_values=None):
+        self.parameters = {name.lower(): definition for name, definition in
+                           (template.get("parameters") or {}).items()}
+        self.variables = {name.lower(): value for name, value in (template.get("variables") or {}).items()}
+        self.parameter_values = {name.lower(): value for name, value in (parameter_values or {}).items()}
+        self.fingerprint = json_digest([template.get("parameters"), template.get("variables"),
+                                        sorted(self.parameter_values.items())])
+        self._results = {}  # expression -> (resolved, value)
+        self._resolved_parameters = {}
+        self._resolved_variables = {}
+        self._pending_variables = set()
+
+    def evaluate(self, expression):
+        """
+        Returns the value of an expression string, or raises Unresolved.
+        """
+        result = self._results.get(expression)
+        if result is None:
+            try:
+                result = (True, self._evaluate(parse_expression(expression)))
+            except Unresolved:
+                result = (False, None)
+            except (TypeError, ValueError, IndexError, KeyError, AttributeError, RecursionError):
+                result = (False, None)
+            self._results[expression] = result
+        if not result[0]:
+            raise Unresolved(expression)
+        return result[1]
+
+    def _evaluate(self, node):
+        kind = node[0]
+        if kind == "literal":
+            return node[1]
+        if kind == "property":
+            target = self._evaluate(node[1])
+            return self._member(target, node[2])
+        if kind == "index":
+            target = self._evaluate(node[1])
+            index = self._evaluate(node[2])
+            if isinstance(target, dict):
+                return self._member(target, index)
+            return target[index]
+        name, arguments = node[1], node[2]
+        args = [self._evaluate(argument) for argument in arguments]
+        if name == "parameters":
+            return self.parameter(*args)
+        if name == "variables":
+            return self.variable(*args)
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise Unresolved(f"{name}() is not supported")
+        return function(*args)
+
+    @staticmethod
+    def _member(target, name):
+        if not isinstance(target, dict):
+            raise Unresolved(f"'{name}' of a non-object")
+        if name in target:
+            return target[name]
+        lowered = str(name).lower()
+        for key, value in target.items():
+            if key.lower() == lowered:
+                return value
+        raise Unresolved(f"No property '{name}'")
+
+    def parameter(self, name):
+        key = name.lower()
+        if key in self.parameter_values:
+            return self.parameter_values[key]
+        if key not in self._resolved_parameters:
+            definition = self.parameters.get(key)
+            if not isinstance(definition, dict) or "defaultValue" not in definition:
+                raise Unresolved(f"Parameter '{name}' has no value")
+            self._resolved_parameters[key] = self.resolve_plain(definition["defaultValue"])
+        return self._resolved_parameters[key]
+
+    def variable(self, name):
+        key = name.lower()
+        if key not in self._resolved_variables:
+            if key not in self.variables or key in self._pending_variables:
+                raise Unresolved(f"Variable '{name}' is not defined")
+            self._pending_variables.add(key)
+            try:
+                self._resolved_variables[key] = self.resolve_plain(self.variables[key])
+            finally:
+                self._pending_variables.discard(key)
+        return self._resolved_variables[key]
+
+    def resolve_plain(self, value):
+        """
+        Returns value with every expression in it evaluated; expressions that cannot
+        be resolved make the whole value unresolved.
+        """
+        if isinstance(value, dict):
+            return {key: self.resolve_plain(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_plain(item) for item in value]
+        if is_template_expression(value):
+            return self.evaluate(value)
+        return value
+
+    def resolve(self, value):
+        """
+        Returns value with its expressions resolved where possible: a scalar result
+        becomes a ResolvedValue, an object or array result replaces the expression,
+        and an expression that cannot be resolved is kept as it is.
+        """
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if not is_template_expression(value):
+            return value
+        try:
+            result = self.evaluate(value)
+        except Unresolved:
+            return value
+        if isinstance(result, (dict, list)):
+            return result
+        return ResolvedValue(result, value)
+
+    def resolve_key(self, value):
+        """
+        Returns a resource type or name resolved to a plain string, or as it is.
+        """
+        if not is_template_expression(value):
+            return value
+        try:
+            result = self.evaluate(value)
+        except Unresolved:
+            return value
+        return result if isinstance(result, str) else value
+
+    def resolve_resource(self, resource):
+        resolved = self.resolve(resource)
+        for key in ("type", "name"):
+            if key in resource:
+                resolved[key] = self.resolve_key(resource[key])
+        return with_source(resolved, resource_source(resource))
+
+
+class ResolvedRef(ResourceRef):
+    """
+    A ResourceRef from --stream whose body has its expressions resolved when it is loaded.
+    """
+    __slots__ = ("evaluator",)
+
+    def __init__(self, ref, evaluator):
+        for slot in ResourceRef.__slots__:
+            setattr(self, slot, getattr(ref, slot))
+        self.type = evaluator.resolve_key(ref.type)
+        self.name = evaluator.resolve_key(ref.name)
+        self.digest = json_digest([ref.digest, evaluator.fingerprint])
+        self.evaluator = evaluator
+
+    def load(self):
+        return self.evaluator.resolve_resource(super().load())
+
+
+def resolve_template(template, parameters=None):
+    """
+    Returns a copy of template whose resources have their expressions resolved
+    (see TemplateEvaluator). parameters is as for load_parameter_values. Nested
+    child resources are lifted out first, so their names can be resolved too.
+    The resources of a template merged from several files are resolved with the
+    parameters and variables of the file they came from.
+    """
+    parameter_values = load_parameter_values(parameters)
+    sources = getattr(template, "sources", None) or {}
+    evaluators = {None: TemplateEvaluator(template, parameter_values)}
+    resources = []
+    for resource in expand_nested_resources(template.get("resources", [])):
+        source = resource_source(resource) if sources else None
+        if source not in evaluators:
+            evaluators[source] = TemplateEvaluator(sources[source], parameter_values) if source in sources \
+                else evaluators[None]
+        evaluator = evaluators[source]
+        if isinstance(resource, ResourceRef):
+            resources.append(ResolvedRef(resource, evaluator))
+        elif isinstance(resource, dict):
+            resources.append(evaluator.resolve_resource(resource))
+        else:
+            resources.append(resource)
+    return dict(template, resources=resources)
@@ -0,0 +1,319 @@
+"""
+Server mode: `arm-compare serve` runs a local HTTP server that compares
+templates on request, so the start-up cost is paid once and not per comparison.
+
+Compiled configs (a Comparer per distinct config) and templates loaded from
+paths are kept in memory in LRU caches of bounded size. A template file is
+keyed by its path, size and modification time, so an edited file is loaded
+again.
+
+    POST /compare
+    {
+      "left": {...} or "exports/dev.json",      # a template, or a file, directory or glob under --path-root
+      "right": {...} or "exports/prd.json",
+      "config": {...} or "config.yaml",         # optional
+      "format": "html",                         # optional: any --format (default: html)
+      "autoPair": 0.6,                          # optional, as --auto-pair
+      "onlyDifferences": false,                 # optional, as --only-differences
+      "keepIgnored": false,                     # optional, as --keep-ignored
+      "resourceTypes": ["Microsoft.Web/*"],     # optional, as --resource-type
+      "resourceNames": ["app-*"],               # optional, as --resource-name
+      "resolveExpressions": false,              # optional, as --resolve-expressions
+      "leftParameters": {...} or "dev.parameters.json",   # optional, as --left-parameters
+      "rightParameters": {...} or "prd.parameters.json"   # optional, as --right-parameters
+    }
+
+Fields of the wrong type, and configs of the wrong shape, are refused with status 400.
+
+The response body is the report, with the summary counts in X-Resources,
+X-Resources-With-Differences, X-Incorrect-Properties, X-Unmatched-Left,
+X-Unmatched-Right and X-Duplicate-Resources headers. Errors are returned as {"error": "..."} with status
+400 for bad requests and 500 otherwise. GET /health reports the cache sizes.
+"""
+import argparse
+import collections
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from .arm_compare import (
+    OUTPUT_FORMATS,
+    ArmCompareError,
+    Comparer,
+    TemplateError,
+    build_resource_filter,
+    build_row_filter,
+    load_templates,
+    template_paths,
+)
+
+CONTENT_TYPES = {
+    "html": "text/html; charset=utf-8",
+    "html-compact": "text/html; charset=utf-8",
+    "markdown": "text/markdown; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+    "sqlite": "application/vnd.sqlite3",
+}
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_CONFIGS = 32
+DEFAULT_MAX_TEMPLATES = 16
+DEFAULT_MAX_REQUEST_MB = 256
+RESPONSE_CHUNK_SIZE = 1 << 16
+
+
+class LruCache:
+    """
+    A thread-safe mapping that keeps the max_entries most recently used values.
+    Values are created outside the lock, so a slow load does not hold up other requests.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, create):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = create()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "maxEntries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def boolean_field(request, name):
+    value = request.get(name, False)
+    if not isinstance(value, bool):
+        raise ArmCompareError(f"'{name}' must be true or false.")
+    return value
+
+def glob_list_field(request, name):
+    value = request.get(name)
+    if value is not None and (not isinstance(value, list) or not all(isinstance(item, str) for item in value)):
+        raise ArmCompareError(f"'{name}' must be a list of glob strings.")
+    return value
+
+def auto_pair_field(request):
+    value = request.get("autoPair")
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= 1):
+        raise ArmCompareError("'autoPair' must be a number greater than 0 and at most 1.")
+    return value
+
+
+class CompareService:
+    """
+    Runs the comparisons for the server, with the warm Comparer and template caches.
+    Paths in requests are resolved against path_root and may not leave it.
+    """
+    def __init__(self, path_root, max_configs=DEFAULT_MAX_CONFIGS, max_templates=DEFAULT_MAX_TEMPLATES, jobs=1):
+        self.path_root = os.path.realpath(path_root)
+        self.jobs = jobs
+        self.comparers = LruCache(max_configs)
+        self.templates = LruCache(max_templates)
+
+    def resolve_path(self, path):
+        resolved = os.path.realpath(os.path.join(self.path_root, path))
+        if os.path.commonpath([resolved, self.path_root]) != self.path_root:
+            raise ArmCompareError(f"Path '{path}' is outside the server's path root.")
+        return resolved
+
+    def file_key(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise TemplateError(f"Cannot read '{path}': {e.strerror}") from e
+        return (path, stat.st_size, stat.st_mtime_ns)
+
+    def comparer(self, config, auto_pair, resolve_expressions=False):
+        if isinstance(config, str):
+            path = self.resolve_path(config)
+            key = ("file", self.file_key(path), auto_pair, resolve_expressions)
+            config = path
+        elif config is None or isinstance(config, dict):
+            key = ("inline", json.dumps(config, sort_keys=True), auto_pair, resolve_expressions)
+        else:
+            raise ArmCompareError("'config' must be an object or a path.")
+        return self.comparers.get_or_create(
+            key, lambda: Comparer.from_config(config, auto_pair=auto_pair, jobs=self.jobs,
+                                              resolve_expressions=resolve_expressions))
+
+    def template(self, template, side):
+        if isinstance(template, dict):
+            return template
+        if not isinstance(template, str):
+            raise ArmCompareError(f"'{side}' must be a template object or a path.")
+        path = self.resolve_path(template)
+        # A directory or glob is keyed by all of its files, so adding, removing or
+        # editing one loads it again
+        paths = [self.resolve_path(filepath) for filepath in template_paths(path)]
+        key = tuple(self.file_key(filepath) for filepath in paths)
+        return self.templates.get_or_create(key, lambda: load_templates(path))
+
+    def parameters(self, parameters, side):
+        if parameters is None or isinstance(parameters, dict):
+            return parameters
+        if not isinstance(parameters, str):
+            raise ArmCompareError(f"'{side}Parameters' must be an object or a path.")
+        return self.resolve_path(parameters)
+
+    def compare(self, request, output_path):
+        """
+        Writes the report for a /compare request to output_path and returns
+        (output_format, ReportSummary).
+        """
+        if not isinstance(request, dict):
+            raise ArmCompareError("The request body must be a JSON object.")
+        missing = [side for side in ("left", "right") if side not in request]
+        if missing:
+            raise ArmCompareError(f"The request is missing: {', '.join(missing)}")
+        output_format = request.get("format", "html")
+        if output_format not in OUTPUT_FORMATS:
+            raise ArmCompareError(f"Unknown format '{output_format}'; "
+                                  f"expected one of: {', '.join(OUTPUT_FORMATS)}")
+        only_differences = boolean_field(request, "onlyDifferences")
+        keep_ignored = boolean_field(request, "keepIgnored")
+        resource_filter = build_resource_filter(glob_list_field(request, "resourceTypes"),
+                                                glob_list_field(request, "resourceNames"))
+        comparer = self.comparer(request.get("config"), auto_pair_field(request),
+                                 boolean_field(request, "resolveExpressions"))
+        left = self.template(request["left"], "left")
+        right = self.template(request["right"], "right")
+        summary = comparer.compare_to_file(
+            left, right, output_path, output_format,
+            shown_rows=build_row_filter(only_differences, keep_ignored),
+            resource_filter=resource_filter,
+            left_parameters=self.parameters(request.get("leftParameters"), "left"),
+            right_parameters=self.parameters(request.get("rightParameters"), "right"))
+        return output_format, summary
+
+    def health(self):
+        return {"status": "ok", "configs": self.comparers.stats(), "templates": self.templates.stats()}
+
+
+class CompareRequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "arm-compare"
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'."})
+            return
+        self.send_json(200, self.server.service.health())
+
+    def do_POST(self):
+        if self.path != "/compare":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {"error": "The Content-Length header is not a valid length."})
+            return
+        if length > self.server.max_request_bytes:
+            self.send_json(413, {"error": "The request body is too large."})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {"error": f"The request body is not valid JSON: {e}"})
+            return
+
+        with tempfile.TemporaryDirectory(prefix="arm-compare-") as workdir:
+            output_path = os.path.join(workdir, "report")
+            try:
+                output_format, summary = self.server.service.compare(request, output_path)
+            except ArmCompareError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            incorrect = sum(entry[5] for entry in summary.summary_entries)
+            with_differences = sum(1 for entry in summary.summary_entries if entry[5])
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPES[output_format])
+            self.send_header("Content-Length", str(os.path.getsize(output_path)))
+            self.send_header("X-Resources", str(len(summary.summary_entries)))
+            self.send_header("X-Resources-With-Differences", str(with_differences))
+            self.send_header("X-Incorrect-Properties", str(incorrect))
+            self.send_header("X-Unmatched-Left", str(summary.unmatched_left_count))
+            self.send_header("X-Unmatched-Right", str(summary.unmatched_right_count))
+            self.send_header("X-Duplicate-Resources", str(summary.duplicate_count))
+            self.end_headers()
+            with open(output_path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile, RESPONSE_CHUNK_SIZE)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class CompareServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, max_request_bytes=DEFAULT_MAX_REQUEST_MB << 20):
+        super().__init__(address, CompareRequestHandler)
+        self.service = service
+        self.max_request_bytes = max_request_bytes
+
+
+def parse_serve_arguments(argv):
+    parser = argparse.ArgumentParser(prog='arm-compare serve',
+                                     description='Serve comparisons over HTTP from a long-running process')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--path-root', default='.',
+                        help='Directory that template and config paths in requests are resolved against; '
+                             'paths outside it are refused (default: the current directory)')
+    parser.add_argument('--max-configs', type=int, default=DEFAULT_MAX_CONFIGS,
+                        help=f'Compiled configs kept in memory (default: {DEFAULT_MAX_CONFIGS})')
+    parser.add_argument('--max-templates', type=int, default=DEFAULT_MAX_TEMPLATES,
+                        help=f'Templates loaded from paths kept in memory (default: {DEFAULT_MAX_TEMPLATES})')
+    parser.add_argument('--max-request-mb', type=int, default=DEFAULT_MAX_REQUEST_MB,
+                        help=f'Largest request body accepted, in MB (default: {DEFAULT_MAX_REQUEST_MB})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to compare the resources of one request; '
+                             '0 uses every CPU (default: 1)')
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 (every CPU) or more")
+    return args
+
+
+def serve_main(argv):
+    args = parse_serve_arguments(argv)
+    service = CompareService(args.path_root, args.max_configs, args.max_templates, args.jobs)
+    server = CompareServer((args.host, args.port), service, args.max_request_mb << 20)
+    host, port = server.server_address[:2]
+    sys.stderr.write(f"arm-compare serving on http://{host}:{port} (paths under {service.path_root})\n")
+    sys.stderr.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
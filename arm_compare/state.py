@@ -0,0 +1,260 @@
+"""
+Incremental re-comparison against a previous run's state file.
+
+A state file records, for every compared resource pair, a digest of the left
+and right resource and the comparison rows. Given the previous state, only
+pairs whose left or right digest changed are compared again; the rows of the
+others are read back from the state file. The state is written as the report
+is, one resource at a time, and the previous state is indexed rather than
+loaded, so neither is held in memory as a whole.
+
+    {
+      "format": 1,
+      "version": "0.0.6",
+      "configDigest": "...",       # ignore rules, array keys, comparison rules and expression resolution
+      "digestMode": "json",        # "stream" digests are of the raw file bytes
+      "resources": [
+        {"type": "...", "name": "...", "rightType": "...", "rightName": "...",
+         "leftDigest": "...", "rightDigest": "...",
+         "rows": [["", "properties.httpsOnly", true, true], ...]},
+        ...
+      ]
+    }
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from .arm_compare import (
+    IgnoredSubtree,
+    ResolvedValue,
+    ResourceComparison,
+    ResourceRef,
+    get_resource_key,
+    index_json_file,
+    iter_resource_comparisons,
+    json_digest,
+    replace_with_temp_file,
+    tool_version,
+)
+
+STATE_FORMAT = 1
+
+# Change descriptions shown in the report
+CHANGE_NEW = "New"
+CHANGE_REMOVED = "Removed"
+CHANGE_LEFT = "Left changed"
+CHANGE_RIGHT = "Right changed"
+CHANGE_BOTH = "Left and right changed"
+
+def resource_digest(resource):
+    """
+    Returns the content digest of a resource: for a ResourceRef the digest of its
+    raw bytes, otherwise the digest of its canonical JSON.
+    """
+    if isinstance(resource, ResourceRef):
+        return resource.digest
+    return json_digest(resource)
+
+def config_digest(ignore_matcher, array_keys, comparison_rules=None, resolution=None):
+    """
+    Returns a digest of the settings that change the rows of a resource pair.
+    resolution is None, or the digest of the parameters expressions were resolved with.
+    """
+    settings = [sorted(ignore_matcher.rules), sorted((array_keys.rules if array_keys else {}).items())]
+    if comparison_rules:
+        settings.append(comparison_rules.rules)
+    if resolution is not None:
+        settings.append({"resolution": resolution})
+    return hashlib.blake2b(json.dumps(settings).encode('utf-8'), digest_size=16).hexdigest()
+
+def encode_value(value):
+    if isinstance(value, IgnoredSubtree):
+        return {"ignoredSubtree": "list" if value.is_list else "dict"}
+    if isinstance(value, ResolvedValue):
+        return {"resolved": value.value, "expression": value.expression}
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "expression" in value:
+            return ResolvedValue(value.get("resolved"), value["expression"])
+        return IgnoredSubtree([] if value.get("ignoredSubtree") == "list" else {})
+    return value
+
+
+class PreviousState:
+    """
+    A state file from an earlier run, indexed by left resource key.
+    reusable is False when the rows cannot be reused (different format, tool
+    version or settings); digests are still compared to report what changed.
+    comparable is False when the digests were made in the other digest mode.
+    """
+    def __init__(self, filepath, digest_mode, settings_digest):
+        state = index_json_file(filepath)
+        self.entries = {get_resource_key(ref): ref for ref in state.get("resources", [])}
+        self.comparable = state.get("digestMode") == digest_mode
+        self.reusable = (self.comparable
+                         and state.get("format") == STATE_FORMAT
+                         and state.get("version") == tool_version()
+                         and state.get("configDigest") == settings_digest)
+
+    def entry(self, key):
+        ref = self.entries.get(key)
+        return ref.load() if ref is not None else None
+
+
+class StateWriter:
+    """
+    Writes a state file one resource entry at a time. The file is written to a
+    temporary path and only replaces filepath once close() is called, so the
+    previous state can be read while the new one is written over it.
+    """
+    def __init__(self, filepath, digest_mode, settings_digest):
+        self.filepath = filepath
+        directory = os.path.dirname(os.path.abspath(filepath))
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self.f = os.fdopen(fd, 'w', encoding='utf-8')
+        header = {"format": STATE_FORMAT, "version": tool_version(),
+                  "configDigest": settings_digest, "digestMode": digest_mode}
+        self.f.write(json.dumps(header)[:-1] + ', "resources": [\n')
+        self.first = True
+
+    def write(self, left_res, right_res, left_digest, right_digest, rows):
+        entry = {
+            "type": left_res.get("type"),
+            "name": left_res.get("name"),
+            "rightType": right_res.get("type"),
+            "rightName": right_res.get("name"),
+            "leftDigest": left_digest,
+            "rightDigest": right_digest,
+            "rows": [[matched, path, encode_value(left_val), encode_value(right_val)]
+                     for matched, path, left_val, right_val in rows],
+        }
+        if not self.first:
+            self.f.write(",\n")
+        self.f.write(json.dumps(entry, ensure_ascii=False))
+        self.first = False
+
+    def close(self):
+        self.f.write("\n]}\n")
+        self.f.close()
+        replace_with_temp_file(self.temp_path, self.filepath)
+
+    def discard(self):
+        self.f.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+
+def digest_mode_of(resource_pairs):
+    """
+    Returns "stream" if the resources were indexed with --stream, otherwise "json".
+    """
+    for pair in resource_pairs:
+        return "stream" if isinstance(pair[0], ResourceRef) else "json"
+    return "json"
+
+def open_previous_state(filepath, resource_pairs, ignore_matcher, array_keys=None, comparison_rules=None,
+                        resolution=None):
+    """
+    Opens a previous state file for iter_incremental_comparisons. Returns None,
+    with a warning, if it cannot be read or its digests cannot be compared.
+    """
+    try:
+        previous = PreviousState(filepath, digest_mode_of(resource_pairs),
+                                 config_digest(ignore_matcher, array_keys, comparison_rules, resolution))
+    except Exception as e:
+        sys.stderr.write(f"Warning: Ignoring previous state '{filepath}': {e}\n")
+        return None
+    if not previous.comparable:
+        with_stream = "without" if digest_mode_of(resource_pairs) == "stream" else "with"
+        sys.stderr.write(f"Warning: Ignoring previous state '{filepath}': it was written {with_stream} --stream, "
+                         "so its resource digests cannot be compared.\n")
+        return None
+    return previous
+
+def change_of(entry, right_key, left_digest, right_digest):
+    """
+    Returns how a resource pair changed since the previous entry, or None.
+    """
+    if entry is None or (entry.get("rightType"), entry.get("rightName")) != right_key:
+        return CHANGE_NEW
+    left_changed = entry.get("leftDigest") != left_digest
+    right_changed = entry.get("rightDigest") != right_digest
+    if left_changed and right_changed:
+        return CHANGE_BOTH
+    if left_changed:
+        return CHANGE_LEFT
+    if right_changed:
+        return CHANGE_RIGHT
+    return None
+
+def iter_incremental_comparisons(resource_pairs, ignore_matcher, ignored_properties, jobs=1, array_keys=None,
+                                 previous=None, state_path=None, changes=None, comparison_rules=None,
+                                 resolution=None, shown_rows=None):
+    """
+    Yields a ResourceComparison per resource pair, in pairing order, like
+    iter_resource_comparisons. Pairs whose digests match the PreviousState are
+    read back from it instead of being compared again. If state_path is given the
+    new state is written there. Changes since the previous run are appended to
+    changes as (resource_type, resource_name, change, anchor) tuples; anchor is
+    None for resources that are no longer compared. shown_rows is set on every
+    comparison, as by iter_resource_comparisons, but the comparisons still keep
+    every row for the state file.
+    """
+    # If the entire resource type is ignored by some rule, skip it
+    resource_pairs = [(left_res, right_res) for left_res, right_res in resource_pairs
+                      if not ignore_matcher(left_res.get("type", "Unknown type"))]
+    digest_mode = digest_mode_of(resource_pairs)
+    settings_digest = config_digest(ignore_matcher, array_keys, comparison_rules, resolution)
+
+    # Decide which pairs can be reused before comparing the rest in one pass,
+    # so they can still be spread across worker processes.
+    plan = []
+    to_compare = []
+    for left_res, right_res in resource_pairs:
+        left_digest = resource_digest(left_res)
+        right_digest = resource_digest(right_res)
+        entry = previous.entry(get_resource_key(left_res)) if previous else None
+        change = change_of(entry, get_resource_key(right_res), left_digest, right_digest) if previous else None
+        rows = entry["rows"] if entry is not None and change is None and previous.reusable else None
+        plan.append((left_res, right_res, left_digest, right_digest, change, rows))
+        if rows is None:
+            to_compare.append((left_res, right_res))
+
+    writer = StateWriter(state_path, digest_mode, settings_digest) if state_path else None
+    try:
+        compared = iter_resource_comparisons(to_compare, ignore_matcher, ignored_properties, jobs,
+                                             array_keys=array_keys, comparison_rules=comparison_rules)
+        for left_res, right_res, left_digest, right_digest, change, rows in plan:
+            if rows is None:
+                comparison = next(compared)
+            else:
+                rows = [(matched, path, decode_value(left_val), decode_value(right_val))
+                        for matched, path, left_val, right_val in rows]
+                ignored_properties.update(path for matched, path, _l, _r in rows if matched == "Ignored")
+                comparison = ResourceComparison(left_res.get("type", "Unknown type"),
+                                                left_res.get("name", "Unknown name"), rows)
+            comparison.shown_rows = shown_rows
+            if change is not None and changes is not None:
+                changes.append((comparison.resource_type, comparison.resource_name, change, comparison.anchor))
+            yield comparison
+            if writer:
+                writer.write(left_res, right_res, left_digest, right_digest, comparison.rows)
+
+        if previous and changes is not None:
+            compared_keys = {get_resource_key(left_res) for left_res, _right_res in resource_pairs}
+            for key in previous.entries:
+                if key not in compared_keys:
+                    changes.append((key[0], key[1], CHANGE_REMOVED, None))
+    except BaseException:
+        if writer:
+            writer.discard()
+        raise
+    if writer:
+        writer.close()
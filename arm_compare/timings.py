@@ -0,0 +1,172 @@
+"""
+Per-phase timings for --timings.
+
+Timings records the wall time, CPU time and peak resident memory of each phase
+of a run, and the resource pairs that took longest to compare. Phases may be
+nested; each phase is reported with the time spent in its nested phases taken
+out, so the phases add up to the total. When --timings is not given the
+NO_TIMINGS stand-in is used: its phases are a shared no-op context manager and
+the comparisons are passed through untouched, so nothing is measured per pair.
+"""
+import contextlib
+import heapq
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TOP_PAIRS = 20
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB, or None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+class Timings:
+    """
+    Collects phase timings and the slowest resource pairs of one run.
+    """
+    def __init__(self, top_pairs=TOP_PAIRS):
+        self.phases = {}  # name -> [wall, cpu, peak_rss_mb]; in order of first use
+        self._stack = []  # [nested_wall, nested_cpu] of each open phase
+        self._pairs = []  # min-heap of (seconds, sequence, pair entry)
+        self.top_pairs = top_pairs
+        self.pair_count = 0
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def __bool__(self):
+        return True
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._stack.append([0.0, 0.0])
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            nested_wall, nested_cpu = self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            entry = self.phases.setdefault(name, [0.0, 0.0, None])
+            entry[0] += wall - nested_wall
+            entry[1] += cpu - nested_cpu
+            entry[2] = peak_rss_mb()
+
+    def iter_comparisons(self, comparisons):
+        """
+        Passes comparisons through, timing each one in the "compare" phase and the
+        expansion of its matched branches in the "expand" phase.
+        With worker processes the compare time is the time spent waiting for the result.
+        """
+        comparisons = iter(comparisons)
+        while True:
+            start = time.perf_counter()
+            with self.phase("compare"):
+                comparison = next(comparisons, None)
+            if comparison is None:
+                return
+            compared = time.perf_counter()
+            if comparison.shown_rows is None and comparison.rendered_table is None:
+                with self.phase("expand"):
+                    comparison.rows
+            expanded = time.perf_counter()
+            self.add_pair(comparison, compared - start, expanded - compared)
+            yield comparison
+
+    def add_pair(self, comparison, compare_seconds, expand_seconds):
+        self.pair_count += 1
+        entry = (comparison.resource_type, comparison.resource_name, compare_seconds, expand_seconds,
+                 comparison.total)
+        item = (compare_seconds + expand_seconds, self.pair_count, entry)
+        if len(self._pairs) < self.top_pairs:
+            heapq.heappush(self._pairs, item)
+        elif item[0] > self._pairs[0][0]:
+            heapq.heapreplace(self._pairs, item)
+
+    def slowest_pairs(self):
+        return [item[2] for item in sorted(self._pairs, key=lambda item: (-item[0], item[1]))]
+
+    def as_dict(self):
+        return {
+            "phases": [{"name": name, "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+                        "peak_rss_mb": None if peak is None else round(peak, 1)}
+                       for name, (wall, cpu, peak) in self.phases.items()],
+            "total": {"wall_s": round(time.perf_counter() - self._start_wall, 6),
+                      "cpu_s": round(time.process_time() - self._start_cpu, 6),
+                      "peak_rss_mb": None if peak_rss_mb() is None else round(peak_rss_mb(), 1)},
+            "resourcePairs": self.pair_count,
+            "slowestPairs": [{"type": rtype, "name": rname, "compare_s": round(compare_s, 6),
+                              "expand_s": round(expand_s, 6), "rows": rows}
+                             for rtype, rname, compare_s, expand_s, rows in self.slowest_pairs()],
+        }
+
+    def write(self, path):
+        """
+        Writes the timings as JSON to path, or as tables to stderr if path is "-".
+        """
+        data = self.as_dict()
+        if path != "-":
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+                f.write("\n")
+            return
+
+        def mb(value):
+            return "-" if value is None else f"{value:.1f}"
+
+        lines = [f"{'Phase':<16} {'Wall s':>9} {'CPU s':>9} {'Peak RSS MB':>12}"]
+        for phase in data["phases"]:
+            lines.append(f"{phase['name']:<16} {phase['wall_s']:>9.3f} {phase['cpu_s']:>9.3f} "
+                         f"{mb(phase['peak_rss_mb']):>12}")
+        total = data["total"]
+        lines.append(f"{'total':<16} {total['wall_s']:>9.3f} {total['cpu_s']:>9.3f} {mb(total['peak_rss_mb']):>12}")
+        if data["slowestPairs"]:
+            lines.append("")
+            lines.append(f"Slowest of {data['resourcePairs']} resource pairs:")
+            lines.append(f"{'Compare s':>9} {'Expand s':>9} {'Rows':>8}  Resource")
+            for pair in data["slowestPairs"]:
+                lines.append(f"{pair['compare_s']:>9.3f} {pair['expand_s']:>9.3f} {pair['rows']:>8}  "
+                             f"{pair['type']} / {pair['name']}")
+        sys.stderr.write("\n".join(lines) + "\n")
+
+
+class _NoPhase:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NoTimings:
+    """
+    The stand-in used when --timings is not given.
+    """
+    _phase = _NoPhase()
+
+    def __bool__(self):
+        return False
+
+    def phase(self, name):
+        return self._phase
+
+    def iter_comparisons(self, comparisons):
+        return comparisons
+
+
+NO_TIMINGS = NoTimings()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark for resource pairing with many resourceMappings.
+
+Times pair_resources (mappings compiled into a prefix trie) against the
+previous loop, which tested every mapping against every left resource.
+
+Usage:
+    python benchmarks/bench_pairing.py --mappings 500 1000 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arm_compare.arm_compare import get_resource_key, pair_resources
+
+
+def legacy_pair_resources(left_resources, right_resources, resource_mappings):
+    """
+    pair_resources as it was before the mapping index.
+    Kept here only as a baseline for comparison.
+    """
+    left_dict = {get_resource_key(res): res for res in left_resources if res.get("type") and res.get("name")}
+    right_dict = {get_resource_key(res): res for res in right_resources if res.get("type") and res.get("name")}
+
+    resource_pairs = []
+    for mapping in resource_mappings:
+        left_prefix_type = mapping.get("leftResourceType")
+        left_prefix_name = mapping.get("leftResourceName")
+        right_prefix_type = mapping.get("rightResourceType")
+        right_prefix_name = mapping.get("rightResourceName")
+
+        for key in list(left_dict.keys()):
+            ltype, lname = key
+            if ltype.startswith(left_prefix_type) and lname.startswith(left_prefix_name):
+                candidate_key = (right_prefix_type + ltype[len(left_prefix_type):],
+                                 right_prefix_name + lname[len(left_prefix_name):])
+                if candidate_key in right_dict:
+                    resource_pairs.append((left_dict[key], right_dict[candidate_key]))
+                    del left_dict[key]
+                    del right_dict[candidate_key]
+
+    for key in list(left_dict.keys()):
+        if key in right_dict:
+            resource_pairs.append((left_dict[key], right_dict[key]))
+            del left_dict[key]
+            del right_dict[key]
+
+    return resource_pairs, left_dict, right_dict
+
+
+def make_templates(mapping_count, children=2):
+    """
+    Builds one renamed storage account per mapping, each with child resources
+    that are paired through the parent's mapping.
+    """
+    left, right, mappings = [], [], []
+    for i in range(mapping_count):
+        parent_type = "Microsoft.Storage/storageAccounts"
+        left.append({"type": parent_type, "name": f"stweu{i:05d}"})
+        right.append({"type": parent_type, "name": f"stneu{i:05d}"})
+        for c in range(children):
+            left.append({"type": f"{parent_type}/blobServices", "name": f"stweu{i:05d}/child{c}"})
+            right.append({"type": f"{parent_type}/blobServices", "name": f"stneu{i:05d}/child{c}"})
+        mappings.append({
+            "leftResourceType": parent_type,
+            "leftResourceName": f"stweu{i:05d}",
+            "rightResourceType": parent_type,
+            "rightResourceName": f"stneu{i:05d}",
+        })
+    return left, right, mappings
+
+
+def measure(pair, left, right, mappings):
+    start = time.perf_counter()
+    pairs, _unmatched_left, _unmatched_right = pair(left, right, mappings)
+    return time.perf_counter() - start, len(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark resource pairing with resourceMappings')
+    parser.add_argument('--mappings', type=int, nargs='+', default=[500, 1000, 2000],
+                        help='Mapping counts to benchmark (three resources per mapping)')
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='Only time the indexed pairing (the legacy loop is quadratic)')
+    args = parser.parse_args()
+
+    print(f"{'mappings':>8} {'pairs':>7} {'indexed s':>10} {'legacy s':>10}")
+    for count in args.mappings:
+        left, right, mappings = make_templates(count)
+        new_time, pairs = measure(pair_resources, left, right, mappings)
+        if args.skip_legacy:
+            old = "-".rjust(10)
+        else:
+            old_time, old_pairs = measure(legacy_pair_resources, left, right, mappings)
+            assert old_pairs == pairs
+            old = f"{old_time:>10.3f}"
+        print(f"{count:>8} {pairs:>7} {new_time:>10.3f} {old}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Start-up and latency benchmark for `arm-compare serve`.
+
+Generates a pair of synthetic exports (see generate_templates.py) and times:
+
+- import: `import arm_compare` in a fresh interpreter
+- cli: one full command line run per comparison, as a subprocess
+- server start-up: from starting `arm-compare serve` until /health answers
+- server first request: with cold config and template caches
+- server requests: the following requests, with warm caches
+
+Usage:
+    python benchmarks/bench_server.py --resources 200 --requests 20 --format markdown
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_ROOT)
+
+from generate_templates import add_generator_arguments, generator_params, write_templates
+
+ENV = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+# The same entry point as the installed arm-compare script
+ARM_COMPARE = ["-c", "import sys; from arm_compare import main; sys.argv[0] = 'arm-compare'; main()"]
+
+
+def run_python(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, check=True, env=ENV, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def summarize(times):
+    ordered = sorted(times)
+    return {"count": len(times), "mean_s": round(statistics.mean(times), 6),
+            "p50_s": round(ordered[len(ordered) // 2], 6),
+            "p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 6)}
+
+
+def start_server(path_root):
+    """
+    Starts `arm-compare serve` on a free port and returns (process, base_url, startup_seconds).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + ARM_COMPARE + ["serve", "--port", "0", "--path-root", path_root,
+                                                                 "--no-cache"],
+                               env=ENV, stderr=subprocess.PIPE, text=True)
+    banner = process.stderr.readline()  # "arm-compare serving on http://HOST:PORT (...)"
+    if " serving on " not in banner:
+        process.kill()
+        raise RuntimeError(f"The server did not start: {banner.strip()}")
+    base_url = banner.split(" serving on ", 1)[1].split(" ", 1)[0]
+    with urllib.request.urlopen(base_url + "/health") as response:
+        response.read()
+    return process, base_url, time.perf_counter() - start
+
+
+def post_compare(base_url, request):
+    data = json.dumps(request).encode('utf-8')
+    start = time.perf_counter()
+    req = urllib.request.Request(base_url + "/compare", data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server start-up and request latency')
+    add_generator_arguments(parser)
+    parser.add_argument('--requests', type=int, default=20, help='Requests (and CLI runs) to time')
+    parser.add_argument('--format', default='markdown', help='Report format (default: markdown)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        left_path, right_path, config_path = write_templates(workdir, **generator_params(args))
+        report_path = os.path.join(workdir, "report")
+
+        import_times = [run_python(["-c", "import arm_compare"]) for _ in range(args.requests)]
+        cli_times = [run_python(ARM_COMPARE + ["--left", left_path, "--right", right_path,
+                                 "--config", config_path, "--output", report_path, "--format", args.format,
+                                 "--no-cache"])
+                     for _ in range(args.requests)]
+
+        process, base_url, startup = start_server(workdir)
+        try:
+            request = {"left": "left.json", "right": "right.json", "config": "config.json", "format": args.format}
+            first = post_compare(base_url, request)
+            warm_times = [post_compare(base_url, request) for _ in range(args.requests)]
+        finally:
+            process.terminate()
+            process.wait()
+
+    results = {
+        "generator": generator_params(args),
+        "format": args.format,
+        "import": summarize(import_times),
+        "cli": summarize(cli_times),
+        "server": {"startup_s": round(startup, 6), "first_request_s": round(first, 6),
+                   "requests": summarize(warm_times)},
+    }
+    print(f"{'':<24} {'mean s':>9} {'p50 s':>9} {'p95 s':>9}")
+    for name, entry in (("import arm_compare", results["import"]), ("cli run", results["cli"]),
+                        ("server request (warm)", results["server"]["requests"])):
+        print(f"{name:<24} {entry['mean_s']:>9.3f} {entry['p50_s']:>9.3f} {entry['p95_s']:>9.3f}")
+    print(f"{'server start-up':<24} {startup:>9.3f}")
+    print(f"{'server first request':<24} {first:>9.3f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main()
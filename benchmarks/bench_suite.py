@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite over synthetic templates from generate_templates.py.
+
+Times each stage of a comparison on its own: loading (load_json_file and the
+--stream index_json_file), pairing with resourceMappings, flatten_json, the
+compare loop and every renderer. Each benchmark is run --repeat times and the
+minimum and median are kept. Results are written as JSON with sorted keys, so
+two runs can be diffed or compared with --baseline:
+
+    {
+      "schema": 1,
+      "generator": {"resources": 1000, ...},
+      "environment": {"python": "3.12.3", "platform": "...", "version": "..."},
+      "benchmarks": {
+        "compare": {"items": 1000, "min_s": 0.41, "median_s": 0.42, "repeat": 3},
+        ...
+      }
+    }
+
+Usage:
+    python benchmarks/bench_suite.py --resources 3000 --output results.json
+    python benchmarks/bench_suite.py --resources 3000 --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arm_compare.arm_compare import (
+    ComparisonResult,
+    build_ignore_matcher,
+    build_mapping_index,
+    flatten_json,
+    index_json_file,
+    iter_resource_comparisons,
+    load_json_file,
+    pair_resources,
+    tool_version,
+    write_report,
+)
+from generate_templates import add_generator_arguments, generator_params, write_templates
+
+RESULTS_SCHEMA = 1
+RENDER_FORMATS = ["html", "html-compact", "markdown", "xlsx", "ndjson", "sqlite"]
+
+
+def timed(fn, repeat):
+    """
+    Runs fn repeat times and returns (min_seconds, median_seconds, last_result).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times), result
+
+
+def run_suite(paths, repeat, formats, workdir):
+    """
+    Runs every benchmark and returns the "benchmarks" mapping of the results.
+    """
+    left_path, right_path, config_path = paths
+    results = {}
+
+    def record(name, fn, items):
+        best, median, value = timed(fn, repeat)
+        results[name] = {"items": items, "min_s": round(best, 6), "median_s": round(median, 6), "repeat": repeat}
+        print(f"{name:<24} {items:>9} {best:>10.3f} {median:>10.3f}", file=sys.stderr)
+        return value
+
+    print(f"{'benchmark':<24} {'items':>9} {'min s':>10} {'median s':>10}", file=sys.stderr)
+    left = load_json_file(left_path)
+    right = load_json_file(right_path)
+    config = load_json_file(config_path)
+    left_resources = left["resources"]
+    right_resources = right["resources"]
+    resource_count = len(left_resources) + len(right_resources)
+
+    record("load_json_file", lambda: (load_json_file(left_path), load_json_file(right_path)), resource_count)
+    record("index_json_file", lambda: (index_json_file(left_path), index_json_file(right_path)), resource_count)
+
+    mappings = config["resourceMappings"]
+    record("build_mapping_index", lambda: build_mapping_index(mappings), len(mappings))
+    pairs, unmatched_left, unmatched_right = record(
+        "pair_resources", lambda: pair_resources(left_resources, right_resources, build_mapping_index(mappings)),
+        resource_count)
+
+    ignore_matcher = build_ignore_matcher(config["ignoreRules"])
+    record("flatten_json", lambda: [flatten_json(res, ignore_matcher=ignore_matcher) for res in left_resources],
+           len(left_resources))
+
+    def compare():
+        ignored_properties = set()
+        comparisons = []
+        for comparison in iter_resource_comparisons(pairs, ignore_matcher, ignored_properties):
+            comparison.rows
+            comparisons.append(comparison)
+        return ComparisonResult(comparisons, unmatched_left, unmatched_right, ignored_properties)
+
+    result = record("compare", compare, len(pairs))
+    row_count = sum(resource.total for resource in result.resources)
+
+    for output_format in formats:
+        extension = {"markdown": "md", "html-compact": "html"}.get(output_format, output_format)
+        output_path = os.path.join(workdir, f"report-{output_format}.{extension}")
+        record(f"render_{output_format}", lambda: write_report(result, output_path, output_format), row_count)
+    return results
+
+
+def print_comparison(results, baseline):
+    """
+    Prints each benchmark's minimum time against the same benchmark in baseline.
+    """
+    print(f"{'benchmark':<24} {'baseline s':>10} {'current s':>10} {'ratio':>7}")
+    for name, entry in sorted(results["benchmarks"].items()):
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            print(f"{name:<24} {'-':>10} {entry['min_s']:>10.3f} {'-':>7}")
+            continue
+        ratio = entry["min_s"] / previous["min_s"] if previous["min_s"] else float("inf")
+        print(f"{name:<24} {previous['min_s']:>10.3f} {entry['min_s']:>10.3f} {ratio:>6.2f}x")
+    if baseline.get("generator") != results["generator"]:
+        print("Warning: the baseline was generated with different parameters.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every stage of a comparison on synthetic templates')
+    add_generator_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark (default: 3)')
+    parser.add_argument('--formats', nargs='+', choices=RENDER_FORMATS, default=RENDER_FORMATS,
+                        help='Renderers to benchmark (default: all)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = write_templates(workdir, **generator_params(args))
+        benchmarks = run_suite(paths, args.repeat, args.formats, workdir)
+
+    results = {
+        "schema": RESULTS_SCHEMA,
+        "generator": generator_params(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "version": tool_version()},
+        "benchmarks": benchmarks,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Regression benchmark for the XLSX Details sheet.
+
+Times the streaming write-only builder (generate_xlsx_output) against the
+previous in-memory builder, which re-applied wrap alignment to every row of
+columns C and D after each property row was written.
+
+Usage:
+    python benchmarks/bench_xlsx.py --rows 100 200 400
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, Alignment, PatternFill
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arm_compare.arm_compare import ComparisonResult, ResourceComparison, generate_xlsx_output
+
+
+def legacy_generate_xlsx_details(detailed_data):
+    """
+    The Details sheet builder as it was before the write-only rewrite.
+    Kept here only as a baseline for comparison.
+    """
+    wb = Workbook()
+    ws_details = wb.active
+    ws_details.title = "Details"
+
+    bold_font = Font(bold=True)
+    larger_bold_font = Font(bold=True, size=16)
+    center_alignment = Alignment(horizontal='center')
+    orange_fill = PatternFill(start_color='FFF2CC', end_color='FFF2CC', fill_type='solid')
+    red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+    green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+
+    details_row = 1
+    for (rtype, rname, comparisons) in detailed_data:
+        ws_details.merge_cells(start_row=details_row, start_column=1, end_row=details_row, end_column=4)
+        resource_cell = ws_details.cell(row=details_row, column=1)
+        resource_cell.value = f"{rtype}/{rname}"
+        resource_cell.font = larger_bold_font
+        details_row += 1
+
+        ws_details.cell(row=details_row, column=1, value="Matched").font = bold_font
+        ws_details.cell(row=details_row, column=2, value="Property Path").font = bold_font
+        ws_details.cell(row=details_row, column=3, value="Left Value").font = bold_font
+        ws_details.cell(row=details_row, column=4, value="Right Value").font = bold_font
+        details_row += 1
+
+        for matched, prop_path, left_val, right_val in comparisons:
+            if matched == "Ignored":
+                row_fill = orange_fill
+            elif matched == "X":
+                row_fill = red_fill
+            else:
+                row_fill = green_fill
+
+            matched_cell = ws_details.cell(row=details_row, column=1)
+            matched_cell.value = matched
+            matched_cell.alignment = center_alignment
+
+            ws_details.cell(row=details_row, column=2, value=prop_path)
+            ws_details.cell(row=details_row, column=3, value=str(left_val))
+            ws_details.cell(row=details_row, column=4, value=str(right_val))
+
+            for col in range(1, 5):
+                ws_details.cell(row=details_row, column=col).fill = row_fill
+
+            for row_cells in ws_details.iter_rows(min_col=3, max_col=4, min_row=1, max_row=ws_details.max_row):
+                for cell in row_cells:
+                    cell.alignment = Alignment(wrap_text=True)
+
+            details_row += 1
+        details_row += 1
+    return wb
+
+
+def make_detailed_data(total_rows, rows_per_resource=50):
+    """
+    Builds synthetic detail rows: roughly 90% correct, 5% ignored, 5% different.
+    """
+    detailed_data = []
+    remaining = total_rows
+    index = 0
+    while remaining > 0:
+        count = min(rows_per_resource, remaining)
+        rows = []
+        for i in range(count):
+            if i % 20 == 0:
+                matched = "Ignored"
+            elif i % 20 == 1:
+                matched = "X"
+            else:
+                matched = ""
+            rows.append((matched, f"properties.setting{i}.value", f"left-{i}", f"right-{i}" if matched == "X" else f"left-{i}"))
+        detailed_data.append(("Microsoft.Web/sites", f"site{index:05d}", rows))
+        remaining -= count
+        index += 1
+    return detailed_data
+
+
+def measure(build, detailed_data, path):
+    """
+    Returns (seconds, peak_bytes) for building and saving a workbook.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    wb = build(detailed_data)
+    wb.save(path)
+    elapsed = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the XLSX Details sheet builders')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 200, 400],
+                        help='Property row counts to benchmark')
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='Only time the streaming builder (the legacy builder is quadratic)')
+    args = parser.parse_args()
+
+    def streaming(detailed_data):
+        resources = [ResourceComparison(rtype, rname, rows) for rtype, rname, rows in detailed_data]
+        return generate_xlsx_output(ComparisonResult(resources, {}, {}, set()))
+
+    print(f"{'rows':>8} {'streaming s':>12} {'streaming MB':>13} {'legacy s':>10} {'legacy MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            detailed_data = make_detailed_data(rows)
+            new_time, new_peak = measure(streaming, detailed_data, os.path.join(tmp, "streaming.xlsx"))
+            if args.skip_legacy:
+                old = "-".rjust(10) + " " + "-".rjust(10)
+            else:
+                old_time, old_peak = measure(legacy_generate_xlsx_details, detailed_data,
+                                             os.path.join(tmp, "legacy.xlsx"))
+                old = f"{old_time:>10.3f} {old_peak / 1e6:>10.1f}"
+            print(f"{rows:>8} {new_time:>12.3f} {new_peak / 1e6:>13.1f} {old}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Deterministic generator of synthetic ARM template exports for benchmarking.
+
+Builds a left and a right export of the same shape together with a config.
+The same parameters and seed always give byte-identical files, so timings
+can be compared between commits.
+
+- resources: number of resources on the left, spread over a few parent types,
+  each with child resources named "<parent>/<child>"
+- depth: nesting depth of each resource's properties
+- array_size: number of objects in each array of named objects
+- diff_rate: probability that a right-hand leaf value differs from the left
+- mapping_rate: share of parent resources renamed on the right ("-dev-" to
+  "-prd-"), each with a resourceMappings entry that their children follow
+- unmatched_rate: share of resources that only exist on one side
+
+Usage:
+    python benchmarks/generate_templates.py --resources 3000 --output-dir /tmp/synthetic
+"""
+import argparse
+import copy
+import json
+import os
+import random
+
+PARENT_TYPES = [
+    ("Microsoft.Storage/storageAccounts", ["blobServices", "fileServices", "queueServices"]),
+    ("Microsoft.Web/sites", ["config", "slots"]),
+    ("Microsoft.Network/networkSecurityGroups", ["securityRules"]),
+    ("Microsoft.Network/virtualNetworks", ["subnets"]),
+    ("Microsoft.KeyVault/vaults", ["accessPolicies"]),
+]
+
+SCALAR_CHOICES = ["Enabled", "Disabled", "Standard", "Premium", "TLS1_2", "Allow", "Deny", "westeurope"]
+
+
+def make_value(rng, depth, array_size):
+    """
+    Returns a random properties object nested depth levels deep.
+    """
+    node = {}
+    for i in range(rng.randint(3, 6)):
+        kind = rng.random()
+        key = f"setting{i}"
+        if depth > 1 and kind < 0.25:
+            node[key] = make_value(rng, depth - 1, array_size)
+        elif depth > 1 and kind < 0.35:
+            node[f"{key}List"] = [dict(make_value(rng, depth - 1, array_size), name=f"item{j:03d}")
+                                  for j in range(array_size)]
+        elif kind < 0.55:
+            node[key] = rng.randint(0, 1000)
+        elif kind < 0.7:
+            node[key] = rng.random() < 0.5
+        elif kind < 0.75:
+            node[key] = "https://example.invalid/" + "".join(rng.choice("abcdef0123456789") for _ in range(80))
+        else:
+            node[key] = rng.choice(SCALAR_CHOICES)
+    return node
+
+
+def mutate(rng, node, diff_rate):
+    """
+    Changes each leaf of node in place with probability diff_rate.
+    """
+    items = node.items() if isinstance(node, dict) else enumerate(node)
+    for key, value in list(items):
+        if isinstance(value, (dict, list)):
+            mutate(rng, value, diff_rate)
+        elif key != "name" and rng.random() < diff_rate:
+            if isinstance(value, bool):
+                node[key] = not value
+            elif isinstance(value, int):
+                node[key] = value + 1
+            else:
+                node[key] = rng.choice(SCALAR_CHOICES) + "-changed"
+
+
+def make_resource(rng, rtype, name, depth, array_size):
+    return {
+        "type": rtype,
+        "apiVersion": "2023-05-01",
+        "name": name,
+        "location": "westeurope",
+        "dependsOn": [],
+        "tags": {"environment": "dev", "owner": f"team{rng.randint(1, 9)}"},
+        "properties": make_value(rng, depth, array_size),
+    }
+
+
+def generate(resources=1000, depth=3, array_size=4, diff_rate=0.05, mapping_rate=0.2, unmatched_rate=0.01,
+             seed=0):
+    """
+    Returns (left_template, right_template, config) for the given parameters.
+    """
+    rng = random.Random(seed)
+    left, right, mappings = [], [], []
+    index = 0
+    while len(left) < resources:
+        parent_type, child_types = PARENT_TYPES[index % len(PARENT_TYPES)]
+        parent_name = f"res-dev-{index:06d}"
+        renamed = rng.random() < mapping_rate
+        right_parent = parent_name.replace("-dev-", "-prd-") if renamed else parent_name
+        if renamed:
+            mappings.append({"leftResourceType": parent_type, "leftResourceName": parent_name,
+                             "rightResourceType": parent_type, "rightResourceName": right_parent})
+        family = [(parent_type, parent_name, right_parent)]
+        family += [(f"{parent_type}/{child}", f"{parent_name}/default", f"{right_parent}/default")
+                   for child in child_types]
+        for rtype, left_name, right_name in family:
+            if len(left) >= resources:
+                break
+            resource = make_resource(rng, rtype, left_name, depth, array_size)
+            side = rng.random()
+            left_only = side < unmatched_rate / 2
+            right_only = unmatched_rate / 2 <= side < unmatched_rate
+            if not left_only:
+                counterpart = copy.deepcopy(resource)
+                counterpart["name"] = right_name
+                counterpart["tags"]["environment"] = "prd"
+                mutate(rng, counterpart["properties"], diff_rate)
+                right.append(counterpart)
+            if not right_only:
+                left.append(resource)
+        index += 1
+
+    def template(resource_list):
+        return {
+            "$schema": "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#",
+            "contentVersion": "1.0.0.0",
+            "parameters": {},
+            "variables": {},
+            "resources": resource_list,
+        }
+
+    config = {"ignoreRules": ["name", "tags.environment"], "resourceMappings": mappings}
+    return template(left), template(right), config
+
+
+def write_templates(output_dir, **params):
+    """
+    Writes left.json, right.json and config.json (valid YAML) to output_dir and
+    returns their paths.
+    """
+    left, right, config = generate(**params)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for name, data in (("left.json", left), ("right.json", right), ("config.json", config)):
+        path = os.path.join(output_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        paths.append(path)
+    return tuple(paths)
+
+
+def add_generator_arguments(parser):
+    parser.add_argument('--resources', type=int, default=1000, help='Number of left-hand resources')
+    parser.add_argument('--depth', type=int, default=3, help='Nesting depth of the properties')
+    parser.add_argument('--array-size', type=int, default=4, help='Objects per array of named objects')
+    parser.add_argument('--diff-rate', type=float, default=0.05,
+                        help='Probability that a right-hand value differs')
+    parser.add_argument('--mapping-rate', type=float, default=0.2,
+                        help='Share of parent resources renamed on the right with a resourceMappings entry')
+    parser.add_argument('--unmatched-rate', type=float, default=0.01,
+                        help='Share of resources that only exist on one side')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+
+def generator_params(args):
+    return {"resources": args.resources, "depth": args.depth, "array_size": args.array_size,
+            "diff_rate": args.diff_rate, "mapping_rate": args.mapping_rate,
+            "unmatched_rate": args.unmatched_rate, "seed": args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic ARM template exports')
+    add_generator_arguments(parser)
+    parser.add_argument('--output-dir', required=True, help='Directory for left.json, right.json and config.json')
+    args = parser.parse_args()
+    for path in write_templates(args.output_dir, **generator_params(args)):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()